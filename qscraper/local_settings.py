@@ -0,0 +1 @@
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': '/tmp/qs.db'}}
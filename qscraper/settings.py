@@ -102,10 +102,10 @@ MIDDLEWARE_CLASSES = (
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
-ROOT_URLCONF = 'scraper.urls'
+ROOT_URLCONF = 'qscraper.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
-WSGI_APPLICATION = 'scraper.wsgi.application'
+WSGI_APPLICATION = 'qscraper.wsgi.application'
 
 TEMPLATE_DIRS = (
     # Put strings here, like "/home/html/django_templates" or "C:/www/django/templates".
@@ -160,6 +160,123 @@ EMAIL_HOST='localhost'
 FROM_EMAIL = ''
 ALERT_RECIPIENTS = []
 
+# Scraper concurrency: number of pages downloaded at once, and the most
+# simultaneous requests allowed to a single host
+SCRAPER_WORKERS = 8
+SCRAPER_PER_HOST = 4
+
+# Most courses waiting between two stages of scrape --pipeline
+SCRAPER_QUEUE_SIZE = 16
+
+# Most courses saved in one transaction.  Each department (or, with
+# --pipeline, each term) is committed even if it has fewer.
+SCRAPER_BATCH_SIZE = 100
+
+# Failed fetches are retried after SCRAPER_RETRY_BASE_DELAY seconds, doubling
+# each time up to SCRAPER_RETRY_MAX_DELAY, with up to SCRAPER_RETRY_JITTER of
+# each delay randomized.  After SCRAPER_RETRY_ATTEMPTS attempts the path goes
+# to the dead letters file, which scrape --replay-failed works through.
+SCRAPER_RETRY_BASE_DELAY = 2
+SCRAPER_RETRY_MAX_DELAY = 120
+SCRAPER_RETRY_ATTEMPTS = 6
+SCRAPER_RETRY_JITTER = 0.5
+SCRAPER_DEAD_LETTERS = 'scraper/log/dead_letters.log'
+
+# Downloads from each host start at SCRAPER_RATE requests per second.  The
+# rate creeps up while downloads are quicker than SCRAPER_TARGET_LATENCY
+# seconds and is cut when they're slower, fail, or return blank histograms,
+# staying between SCRAPER_MIN_RATE and SCRAPER_MAX_RATE.  The current rate
+# and queue depth are logged after every department.
+SCRAPER_RATE = 4.0
+SCRAPER_MIN_RATE = 0.5
+SCRAPER_MAX_RATE = 50.0
+SCRAPER_TARGET_LATENCY = 2.0
+
+# How pages are downloaded: 'https' (pooled keep-alive connections with gzip),
+# 'urllib' (a plain urllib2 opener) or 'fixture' (scrape --fixtures).
+# SCRAPER_POOL_SIZE is the most idle connections kept open per host.
+SCRAPER_TRANSPORT = 'https'
+SCRAPER_POOL_SIZE = 4
+
+# Lowest level of scraper log messages written to scraper/log.  DEBUG includes
+# every rating row parsed and every row saved; INFO leaves those out.
+SCRAPER_LOG_LEVEL = 'DEBUG'
+
+# Errors are mailed to ALERT_RECIPIENTS as a digest at most once every
+# SCRAPER_ALERT_INTERVAL seconds (and at the end of a run), quoting the first
+# SCRAPER_ALERT_SAMPLES in full and counting the rest by kind.  To try alerts
+# without a mail server, run a scraper.alerts.LocalSMTPServer and point
+# EMAIL_HOST and EMAIL_PORT at it.
+SCRAPER_ALERT_INTERVAL = 600
+SCRAPER_ALERT_SAMPLES = 10
+
+# Sharded scrapes (scrape --coordinator): worker processes the coordinator
+# starts on this machine, and seconds after which a department a worker
+# claimed but never finished is handed to another worker.  A department
+# claimed SCRAPER_CLAIM_ATTEMPTS times without finishing is marked failed.
+SCRAPER_PROCESSES = 4
+SCRAPER_CLAIM_TIMEOUT = 3600
+SCRAPER_CLAIM_ATTEMPTS = 3
+
+# While scrape runs, its counters and stage timings (see scraper/metrics.py)
+# are written to SCRAPER_METRICS_FILE in Prometheus' text format every
+# SCRAPER_METRICS_INTERVAL seconds; point node_exporter's textfile collector
+# at its directory to graph them.  Workers of a sharded scrape write their own
+# file, named after the worker.  None turns it off.
+SCRAPER_METRICS_FILE = 'scraper/log/scraper.prom'
+SCRAPER_METRICS_INTERVAL = 15
+
+# Where rebuild_from_cache lists the paths it needed but the page store
+# didn't have
+SCRAPER_CACHE_MISSES = 'scraper/log/cache_misses.log'
+
+# Where export_data writes, and how many rows it reads from the database at a
+# time
+SCRAPER_EXPORT_DIR = 'scraper/data/export/'
+SCRAPER_EXPORT_CHUNK_SIZE = 5000
+
+# Refresh the stats tables (see scraper/stats.py) at the end of every run that
+# finishes.  manage.py refresh_stats does it on demand.
+SCRAPER_REFRESH_STATS = True
+
+# The JSON API (scraper/views.py): results per page by default and at most,
+# and seconds a response stays cached.  Finished runs clear the cache, but
+# only for web servers sharing the scraper's CACHES backend; the others see
+# new data within SCRAPER_API_CACHE_TIMEOUT.
+SCRAPER_API_PAGE_SIZE = 50
+SCRAPER_API_MAX_PAGE_SIZE = 200
+SCRAPER_API_CACHE_TIMEOUT = 3600
+
+# Incremental scrapes always re-check this many of the newest terms, since
+# their evaluations can still change.  Older terms are scraped once.
+SCRAPER_OPEN_TERMS = 2
+
+# Stored pages of the open terms are revalidated with a conditional GET
+# (If-None-Match / If-Modified-Since) on every run, and cost a 304 if they
+# haven't changed.  SCRAPER_PAGE_TTLS lists (path prefix, seconds) pairs for
+# pages that can go that long after being checked before they're revalidated
+# again, None meaning never; the first matching prefix counts.  Pages of older
+# terms never expire.
+SCRAPER_PAGE_TTLS = [
+    # Department lists barely change during a term
+    ('list?yearterm=', 6 * 3600),
+]
+
+# Downloaded pages are kept in this SQLite file.  PAGE_STORE_CODEC is 'zlib',
+# 'none', or 'zstd' if the zstandard package is installed.
+PAGE_STORE = 'scraper/data/pages.db'
+PAGE_STORE_CODEC = 'zlib'
+
+# SQLite file holding the full-text index of comments (see scraper/search.py).
+# None stops saves from updating it.
+SEARCH_INDEX = 'scraper/data/comments.db'
+
+# manage.py benchmark writes its synthetic Q guide (see scraper/fixtures.py)
+# to SCRAPER_BENCH_CORPUS and appends every result to SCRAPER_BENCH_HISTORY,
+# one JSON object per line, to compare against later runs
+SCRAPER_BENCH_CORPUS = 'scraper/data/bench/'
+SCRAPER_BENCH_HISTORY = 'scraper/log/bench_history.jsonl'
+
 try:
     from local_settings import *
 except:
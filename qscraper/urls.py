@@ -8,6 +8,7 @@ urlpatterns = patterns('',
     # Examples:
     # url(r'^$', 'qscraper.views.home', name='home'),
     # url(r'^qscraper/', include('qscraper.foo.urls')),
+    url(r'^api/', include('scraper.urls')),
 
     # Uncomment the admin/doc line below to enable admin documentation:
     # url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
@@ -0,0 +1,154 @@
+################################################################################
+# Alert emails.  Errors are queued as they're logged and a background thread  #
+# mails them as one digest, with a count per kind of error, at most once      #
+# every interval.  The scrape never waits on SMTP and a burst of failures     #
+# makes one email instead of hundreds.                                        #
+#                                                                              #
+# LocalSMTPServer is an SMTP server that keeps what it receives in memory, for #
+# the tests and for trying alerts out without a real mail server (point        #
+# EMAIL_HOST and EMAIL_PORT at it).                                            #
+################################################################################
+
+import asyncore
+import email
+import re
+import smtpd
+import threading
+import time
+
+# Python's repr of an exception class, as logged by log_fetch_failure
+CLASS_REGEX = re.compile(r"<(?:class|type) '([\w\.]+)'>")
+
+class AlertDigest(object):
+    # send - function taking a subject and body that sends the email
+    # interval - least seconds between two emails
+    # samples - errors quoted in full in each email; the rest are only counted
+    def __init__(self, send, interval=600, samples=10):
+        self.send = send
+        self.interval = interval
+        self.samples = samples
+        self.cond = threading.Condition()
+        self._reset()
+        self.last_sent = 0
+        self.sending = False
+        self.flushing = False
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='alerts')
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Queues an error for the next digest
+    def add(self, msg, course_id):
+        kind = error_kind(msg)
+        with self.cond:
+            if not self.total:
+                self.since = time.time()
+            self.total += 1
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            if len(self.queued) < self.samples:
+                self.queued.append('{0}: {1}'.format(course_id, msg))
+            self.cond.notify_all()
+
+    # Sends whatever is queued now, whenever the last email went out, and
+    # waits until it's sent
+    def flush(self):
+        with self.cond:
+            self.flushing = True
+            self.cond.notify_all()
+            while self.flushing or self.sending:
+                self.cond.wait(1)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def _reset(self):
+        self.total = 0
+        self.since = None
+        self.counts = {}   # kind of error -> times it happened
+        self.queued = []   # first few errors
+
+    def _run(self):
+        with self.cond:
+            while True:
+                now = time.time()
+                due = self.last_sent + self.interval
+                if self.total and (now >= due or self.flushing or
+                        self.closed):
+                    subject, body = self._digest()
+                    self._reset()
+                    self.last_sent = now
+                    self.sending = True
+                    self.flushing = False
+                    self.cond.release()
+                    try:
+                        self.send(subject, body)
+                    except Exception:
+                        # Nowhere left to report it; the errors are in the
+                        # log files anyway
+                        pass
+                    finally:
+                        self.cond.acquire()
+                        self.sending = False
+                        self.cond.notify_all()
+                    continue
+                if self.closed:
+                    return
+                if self.flushing:
+                    self.flushing = False
+                    self.cond.notify_all()
+                if self.total:
+                    self.cond.wait(max(min(due - now, 1), 0.01))
+                else:
+                    self.cond.wait(1)
+
+    def _digest(self):
+        errors = '{0} error{1}'.format(self.total,
+            '' if self.total == 1 else 's')
+        subject = 'scraper: ' + errors
+        lines = ['{0} since {1}:'.format(errors,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.since))),
+            '']
+        for kind, count in sorted(self.counts.items(),
+                key=lambda x: (-x[1], x[0])):
+            lines.append('{0:6d}  {1}'.format(count, kind))
+        lines = lines + ['', 'First {0}:'.format(len(self.queued))] + \
+            self.queued
+        return subject, '\n'.join(lines)
+
+# What an error is counted as in a digest: the exception class if it names
+# one, otherwise the message up to any details in parentheses or after a colon
+def error_kind(msg):
+    match = CLASS_REGEX.search(msg)
+    if match:
+        return match.group(1)
+    return re.split(r'[\(:\n]', msg, 1)[0].strip()[:80]
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    # port - 0 to pick a free one; see .port
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append(email.message_from_string(data))
+
+    def start(self):
+        self.thread = threading.Thread(target=self._serve, name='smtp')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.close()
+
+    def _serve(self):
+        while not self.stopped.is_set():
+            asyncore.loop(timeout=0.1, count=1)
@@ -0,0 +1,253 @@
+################################################################################
+# Benchmarks.  benchmark_parse times the page parsers in parse.py over pages  #
+# from a page store, read into memory first so only parsing is measured, and #
+# reports pages per second for each kind of page.                             #
+#                                                                              #
+# benchmark_e2e runs a whole scrape against a fakeserver.FixtureServer         #
+# replaying a synthetic corpus (see fixtures.py), and benchmark_write times    #
+# the CourseWriter on its own.  Both save into a throwaway test database, so   #
+# the real one is never truncated, and benchmark_e2e finishes its run in a     #
+# cache of its own, so the real API's cache is left alone.  record keeps every #
+# result in settings.SCRAPER_BENCH_HISTORY so runs can be compared over time.  #
+################################################################################
+
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from django.core.cache import get_cache
+from django.db import connection
+from django.utils import timezone
+
+from fakeserver import FixtureServer
+import fixtures
+from models import *
+from pagestore import PageStore
+import parse
+import scrape
+import search
+import views
+from transport import HTTPSTransport
+from writer import CourseWriter
+from qscraper import settings
+
+# Kinds of page: (name, start of their paths, function parsing one page)
+PAGE_KINDS = [
+    ('dept lists', 'list?yearterm=',
+        lambda html: parse.dept_names(parse.parse_html(html))),
+    ('course lists', 'guide_dept?',
+        lambda html: parse_course_list(html)),
+    ('course summaries', 'new_course_summary.html?',
+        lambda html: parse_report(html)),
+    ('comments', 'view_comments.html?',
+        lambda html: parse.has_comments(html) and
+            parse.comment_texts(parse.parse_html(html))),
+    ('instructor pages', 'inst-tf_summary.html?',
+        lambda html: parse_instructor_page(html)),
+    ('histograms', 'histogram', parse.read_histogram),
+]
+
+# Parses up to limit pages of each kind in store, repeat times.  Returns
+# [(kind, pages, pages that failed to parse, seconds, pages per second)], the
+# seconds being the best of the tries.
+def benchmark_parse(store, limit=500, repeat=3):
+    results = []
+    for name, prefix, parse_page in PAGE_KINDS:
+        paths = store.paths(prefix)
+        if limit:
+            paths = paths[:limit]
+        pages = [store.get(path) for path in paths]
+        pages = [page for page in pages if page is not None]
+        if not pages:
+            continue
+        best = None
+        for i in range(repeat):
+            errors = 0
+            start = time.time()
+            for page in pages:
+                try:
+                    parse_page(page)
+                except Exception:
+                    errors += 1
+            seconds = time.time() - start
+            best = seconds if best is None else min(best, seconds)
+        results.append((name, len(pages), errors, best,
+            len(pages) / best if best else 0))
+    return results
+
+def parse_course_list(html):
+    tree = parse.parse_html(html)
+    if tree.getroot() is None:
+        return []
+    return parse.course_links(tree)
+
+# Everything scrape.py reads from a course summary page
+def parse_report(html):
+    tree = parse.parse_html(html)
+    if parse.summary_stats(tree) is None:
+        return
+    tables = parse.report_tables(tree)
+    for table in tables[:-2]:
+        parse.standard_table_rows(table)
+    if len(tables) > 1:
+        parse.pie_chart_rows(tables[-2])
+    if tables:
+        parse.reason_rows(tables[-1])
+
+def parse_instructor_page(html):
+    tree = parse.parse_html(html)
+    parse.instructor_options(tree)
+    for table in parse.report_tables(tree):
+        parse.standard_table_rows(table)
+
+# Imports a corpus directory into a page store in scratch, for benchmark_parse
+def corpus_page_store(corpus, scratch):
+    store = PageStore(os.path.join(scratch, 'pages.db'))
+    store.import_dir(corpus)
+    return store
+
+# Scrapes every page of corpus, served over HTTP by a FixtureServer with
+# latency seconds of delay per response, error_rate of them failing with a
+# 500 and drop_rate of them cut off without an answer.  The pages, dead
+# letters and search index go to a scratch directory, the logs to bench.*
+# files in scrape.LOG_DIR and the courses into a test database, so nothing
+# real is touched.  Returns a dict of measurements.
+#
+# log_level - lowest level logged (settings.SCRAPER_LOG_LEVEL by default)
+def benchmark_e2e(corpus, latency=0, error_rate=0, drop_rate=0,
+        workers=settings.SCRAPER_WORKERS, per_host=settings.SCRAPER_PER_HOST,
+        log_level=None):
+    scratch = tempfile.mkdtemp()
+    server = FixtureServer(corpus, latency, error_rate, drop_rate).start()
+    store, index = scrape.PAGE_STORE, search.SEARCH_INDEX
+    try:
+        scrape.use_page_store(os.path.join(scratch, 'pages.db'))
+        search.use_search_index(os.path.join(scratch, 'comments.db'))
+        scrape.configure_logging(log_level, 'bench.')
+        scrape.disable_alerts()
+        with scratch_settings(scratch), scratch_cache(), test_database():
+            start = time.time()
+            scrape.scrape('', workers, per_host,
+                transport=HTTPSTransport(server.url, ''))
+            seconds = time.time() - start
+            succeeded = ScrapeRun.objects.filter(succeeded=True).exists()
+            courses = CourseInstance.objects.count()
+            dead_letters = len(scrape.get_dead_letters().entries())
+    finally:
+        server.stop()
+        scrape.PAGE_STORE, search.SEARCH_INDEX = store, index
+        shutil.rmtree(scratch)
+    counters = server.counters.snapshot()
+    return {
+        'succeeded':        succeeded,
+        'seconds':          round(seconds, 3),
+        'requests':         counters.get('requests', 0),
+        'injected_errors':  counters.get('errors', 0),
+        'dropped':          counters.get('drops', 0),
+        'dead_letters':     dead_letters,
+        'courses':          courses,
+        'requests_per_sec': round(counters.get('requests', 0) / seconds, 1),
+        'courses_per_sec':  round(courses / seconds, 1),
+    }
+
+# Saves courses synthetic courses with a CourseWriter into a test database,
+# then saves them again, which updates them in place.  Returns a dict of
+# measurements.
+def benchmark_write(courses=1000, batch_size=settings.SCRAPER_BATCH_SIZE):
+    course_dicts = fixtures.course_dicts(courses)
+    scratch = tempfile.mkdtemp()
+    index = search.SEARCH_INDEX
+    results = {}
+    try:
+        search.use_search_index(os.path.join(scratch, 'comments.db'))
+        with scratch_settings(scratch), test_database():
+            for name in ['insert', 'update']:
+                writer = CourseWriter(batch_size)
+                start = time.time()
+                for course in course_dicts:
+                    writer.add(dict(course))
+                writer.flush()
+                seconds = time.time() - start
+                results[name + '_seconds'] = round(seconds, 3)
+                results[name + '_courses_per_sec'] = round(courses / seconds,
+                    1)
+    finally:
+        search.SEARCH_INDEX = index
+        shutil.rmtree(scratch)
+    return results
+
+# Points the settings the scraper writes files to at a scratch directory
+@contextmanager
+def scratch_settings(scratch):
+    names = ['SCRAPER_DEAD_LETTERS', 'SEARCH_INDEX']
+    saved = dict((name, getattr(settings, name)) for name in names)
+    for name in names:
+        setattr(settings, name, os.path.join(scratch, name.lower()))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+# Points the API views at an empty cache of their own, so the benchmark's
+# finish_run starts a new generation there and not in the cache the real API
+# is served from (with the pk of a run in a throwaway database)
+@contextmanager
+def scratch_cache():
+    saved = views.cache
+    views.cache = get_cache('django.core.cache.backends.locmem.LocMemCache',
+        LOCATION='bench')
+    views.cache.clear()
+    try:
+        yield
+    finally:
+        views.cache = saved
+
+# Switches the connection to a new, empty test database and drops it after
+@contextmanager
+def test_database():
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+# Appends a result to settings.SCRAPER_BENCH_HISTORY, with the time and the
+# commit the code was at.  Returns the entry.
+def record(suite, params, metrics):
+    entry = {
+        'time':    timezone.now().isoformat(),
+        'commit':  git_commit(),
+        'suite':   suite,
+        'params':  params,
+        'metrics': metrics,
+    }
+    with open(settings.SCRAPER_BENCH_HISTORY, 'a') as f:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+    return entry
+
+# Every recorded result of suite run with params, oldest first
+def history(suite, params):
+    entries = []
+    try:
+        with open(settings.SCRAPER_BENCH_HISTORY) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['suite'] == suite and entry['params'] == params:
+                    entries.append(entry)
+    except IOError:
+        pass
+    return entries
+
+# The commit checked out, or None outside a git checkout
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
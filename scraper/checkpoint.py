@@ -0,0 +1,50 @@
+################################################################################
+# Checkpoints for resuming an interrupted run.  A run records each term,      #
+# department and course once it's saved (ScrapedTerm, ScrapedDept and        #
+# ScrapedCourse rows pointing at the run), so a resumed run can skip          #
+# everything that was already committed and carry on from there.             #
+################################################################################
+
+from django.utils import timezone
+
+from models import *
+
+class Checkpoints(object):
+    def __init__(self, run):
+        self.run = run
+        self.terms = set(ScrapedTerm.objects.filter(run=run)\
+            .values_list('year', 'term'))
+        self.depts = set(ScrapedDept.objects.filter(run=run)\
+            .values_list('year', 'term', 'dept'))
+        self.courses = set(ScrapedCourse.objects.filter(run=run)\
+            .values_list('qcourse_id', flat=True))
+
+    def term_done(self, year, term):
+        return (year, term) in self.terms
+
+    def dept_done(self, year, term, dept):
+        return (year, term, dept) in self.depts
+
+    def course_done(self, course_id):
+        return course_id in self.courses
+
+    # Records that every course of a department has been saved
+    def finish_dept(self, year, term, dept):
+        if not self.dept_done(year, term, dept):
+            ScrapedDept.objects.create(run=self.run, year=year, term=term,
+                dept=dept)
+            self.depts.add((year, term, dept))
+
+# Returns the newest run that never finished, or None
+def get_resumable_run():
+    runs = ScrapeRun.objects.filter(finished__isnull=True).order_by('-pk')
+    if not runs:
+        return None
+    return runs[0]
+
+# Closes every run that never finished, as failed.  A new run can't resume
+# them, and left open they'd hold back every export and stats refresh after
+# them (see export.exported_run) for good.  Returns how many were closed.
+def abandon_unfinished_runs():
+    return ScrapeRun.objects.filter(finished__isnull=True)\
+        .update(finished=timezone.now())
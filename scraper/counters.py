@@ -0,0 +1,28 @@
+################################################################################
+# Per-run counters.  Any thread can bump a named counter; the totals are      #
+# logged when a run finishes so runs can be compared.                         #
+################################################################################
+
+import threading
+
+class Counters(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name, n=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + n
+
+    def get(self, name):
+        with self.lock:
+            return self.values.get(name, 0)
+
+    # Returns a copy of every counter
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
@@ -0,0 +1,238 @@
+################################################################################
+# Streaming export of scraped data for analysis.  Each table is written one   #
+# file per term, read from the database a chunk of rows at a time with       #
+# values_list (joins instead of a query per row), so memory stays flat        #
+# however big the data gets.                                                  #
+#                                                                              #
+# Files are Parquet if pyarrow is installed, or gzipped CSV with the column   #
+# types in schema.json.  An export remembers the last run it saw; the next    #
+# one only rewrites the terms that runs since then saved courses in.          #
+################################################################################
+
+import csv
+import gzip
+import json
+import os
+
+from django.db.models import Q
+
+from models import *
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+STATE_FILE = 'export_state.json'
+SCHEMA_FILE = 'schema.json'
+
+# Both rating tables, after the column naming what's rated
+RATING_COLUMNS = [
+    ('category',      'category__name', 'str'),
+    ('value',         'value',          'float'),
+    ('num_responses', 'num_responses',  'int'),
+    ('ones',          'ones',           'int'),
+    ('twos',          'twos',           'int'),
+    ('threes',        'threes',         'int'),
+    ('fours',         'fours',          'int'),
+    ('fives',         'fives',          'int'),
+]
+
+# Exported tables: (name, function taking a year and term and returning the
+# queryset of that term's rows, [(column, values_list lookup, type)])
+TABLES = [
+    ('course_instances',
+        lambda year, term: CourseInstance.objects.filter(year=year, term=term),
+        [('id',            'id',                          'int'),
+         ('qcourse_id',    'qcourse_id',                  'int'),
+         ('course_id',     'course',                      'int'),
+         ('field',         'course__field__abbreviation', 'str'),
+         ('number',        'course__number',              'str'),
+         ('title',         'course__title',               'str'),
+         ('year',          'year',                        'int'),
+         ('term',          'term',                        'int'),
+         ('enrollment',    'enrollment',                  'int'),
+         ('evaluations',   'evaluations',                 'int'),
+         ('response_rate', 'response_rate',               'float')]),
+    ('course_ratings',
+        lambda year, term: CourseRating.objects.filter(
+            course_instance__year=year, course_instance__term=term),
+        [('id',                 'id',              'int'),
+         ('course_instance_id', 'course_instance', 'int')] + RATING_COLUMNS),
+    # instructor_relation_id is the instructors row id
+    ('instructor_ratings',
+        lambda year, term: InstructorRating.objects.filter(
+            instructor_relation__course_instance__year=year,
+            instructor_relation__course_instance__term=term),
+        [('id',                     'id',                  'int'),
+         ('instructor_relation_id', 'instructor_relation', 'int')] +
+        RATING_COLUMNS),
+    ('instructors',
+        lambda year, term: InstructorCourseInstanceRelation.objects.filter(
+            course_instance__year=year, course_instance__term=term),
+        [('id',                 'id',                 'int'),
+         ('course_instance_id', 'course_instance',    'int'),
+         ('instructor_id',      'instructor',         'int'),
+         ('prof_id',            'instructor__prof_id', 'str'),
+         ('first',              'instructor__first',  'str'),
+         ('last',               'instructor__last',   'str')]),
+    ('reasons',
+        lambda year, term: Reason.objects.filter(course__year=year,
+            course__term=term),
+        [('id',                 'id',     'int'),
+         ('course_instance_id', 'course', 'int'),
+         ('reason',             'reason', 'str'),
+         ('number',             'number', 'int')]),
+    ('comments',
+        lambda year, term: Comment.objects.filter(course__year=year,
+            course__term=term),
+        [('id',                 'id',      'int'),
+         ('course_instance_id', 'course',  'int'),
+         ('comment',            'comment', 'str')]),
+]
+
+# Converts a database value to each column type, leaving NULLs alone
+CONVERTERS = {
+    'int': int,
+    'float': float,
+    'str': lambda x: x.encode('utf-8') if isinstance(x, unicode) else str(x),
+}
+
+# Writes the tables under out_dir in fmt ('parquet' or 'csv'; parquet needs
+# pyarrow), reading chunk_size rows at a time.  Unless full, only the terms
+# changed since the last export to out_dir are written.  Returns the
+# (year, term)s written.
+def export(out_dir, fmt='parquet', chunk_size=5000, full=False):
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError('Parquet export needs the pyarrow package')
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    state = read_state(out_dir)
+    if full or state.get('format') != fmt:
+        state = {}
+    # Runs still going may save more, so they're looked at again next time
+    last_run = exported_run()
+    yearterms = changed_terms(state.get('run'))
+
+    for name, rows, columns in TABLES:
+        for year, term in yearterms:
+            filename = os.path.join(out_dir, name,
+                '{0}-{1}.{2}'.format(year, term,
+                'parquet' if fmt == 'parquet' else 'csv.gz'))
+            write_table(filename, fmt, rows(year, term), columns, chunk_size)
+
+    with open(os.path.join(out_dir, SCHEMA_FILE), 'w') as f:
+        json.dump(dict((name, [(column, dtype)
+            for column, lookup, dtype in columns])
+            for name, rows, columns in TABLES), f, indent=2, sort_keys=True)
+    write_state(out_dir, {'run': last_run, 'format': fmt})
+    return yearterms
+
+# Streams queryset into filename a chunk at a time, paging by primary key so
+# every chunk is a cheap indexed query
+def write_table(filename, fmt, queryset, columns, chunk_size):
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    lookups = [lookup for column, lookup, dtype in columns]
+    converters = [CONVERTERS[dtype] for column, lookup, dtype in columns]
+    if fmt == 'parquet':
+        writer = ParquetWriter(filename, columns)
+    else:
+        writer = CSVWriter(filename, columns)
+    last_pk = 0
+    try:
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')\
+                .values_list(*lookups)[:chunk_size])
+            if not chunk:
+                break
+            writer.write([[None if value is None else convert(value)
+                for convert, value in zip(converters, row)] for row in chunk])
+            last_pk = chunk[-1][0]
+    except:
+        writer.abort()
+        raise
+    writer.close()
+
+# Terms with course instances saved by runs after since_run, or every term
+# with course instances if since_run is None
+def changed_terms(since_run):
+    instances = CourseInstance.objects.all()
+    if since_run is not None:
+        instances = instances.filter(qcourse_id__in=ScrapedCourse.objects\
+            .filter(Q(run__gt=since_run) | Q(run__isnull=True))\
+            .values('qcourse_id'))
+    return sorted(set(instances.values_list('year', 'term').distinct()),
+        reverse=True)
+
+# The newest run that every run up to has finished.  Runs given up on when a
+# newer one started count as finished (see checkpoint.abandon_unfinished_runs).
+def exported_run():
+    unfinished = ScrapeRun.objects.filter(finished__isnull=True)\
+        .order_by('pk').values_list('pk', flat=True)[:1]
+    runs = ScrapeRun.objects.all()
+    if unfinished:
+        runs = runs.filter(pk__lt=unfinished[0])
+    runs = runs.order_by('-pk').values_list('pk', flat=True)[:1]
+    return runs[0] if runs else None
+
+def read_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+def write_state(out_dir, state):
+    with open(os.path.join(out_dir, STATE_FILE), 'w') as f:
+        json.dump(state, f)
+
+# Both writers write to a temporary file and move it into place when closed,
+# so a failed export never leaves half a file behind
+class CSVWriter(object):
+    def __init__(self, filename, columns):
+        self.filename = filename
+        self.f = gzip.open(filename + '.tmp', 'wb')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow([column for column, lookup, dtype in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+        os.rename(self.filename + '.tmp', self.filename)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.filename + '.tmp')
+
+class ParquetWriter(object):
+    TYPES = {
+        'int': lambda: pyarrow.int64(),
+        'float': lambda: pyarrow.float64(),
+        'str': lambda: pyarrow.string(),
+    }
+
+    def __init__(self, filename, columns):
+        self.filename = filename
+        self.schema = pyarrow.schema([(column, self.TYPES[dtype]())
+            for column, lookup, dtype in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(filename + '.tmp',
+            self.schema)
+
+    def write(self, rows):
+        arrays = [pyarrow.array(list(values), field.type)
+            for values, field in zip(zip(*rows), self.schema)]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays,
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+        os.rename(self.filename + '.tmp', self.filename)
+
+    def abort(self):
+        self.writer.close()
+        os.remove(self.filename + '.tmp')
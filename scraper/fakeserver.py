@@ -0,0 +1,132 @@
+################################################################################
+# A local HTTP server replaying a directory of pages saved one file per path   #
+# (see fixtures.py), so the whole scraper, HTTPSTransport and all, can be      #
+# run and timed without the Q guide.  Every response can be held back to       #
+# pretend to be far away, and some can be made to fail, to see how retries     #
+# and the rate limiter cope.  Pages carry an ETag and Last-Modified and get a  #
+# 304 when a conditional GET's validators still match.                         #
+################################################################################
+
+import BaseHTTPServer
+import gzip
+import os
+import random
+import SocketServer
+import threading
+import time
+from StringIO import StringIO
+
+from counters import Counters
+from transport import content_etag, http_date, not_modified
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    # directory - pages saved one file per path
+    # latency - seconds each response is held back
+    # error_rate - fraction of requests answered with an HTTP 500
+    # drop_rate - fraction of requests whose connection is closed without an
+    #     answer
+    # seed - for picking which requests fail
+    # port - 0 for any free port
+    def __init__(self, directory, latency=0, error_rate=0, drop_rate=0,
+            seed=0, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+            FixtureHandler)
+        self.directory = directory
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        # requests, errors (injected 500s), drops, missing (404s),
+        # not_modified (304s), bytes
+        self.counters = Counters()
+        self.thread = None
+
+    # Base URL to give a transport
+    @property
+    def url(self):
+        return 'http://{0}:{1}/'.format(*self.server_address)
+
+    # Serves requests from a background thread
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    # 'error', 'drop' or None, for the next request
+    def pick_failure(self):
+        with self.random_lock:
+            x = self.random.random()
+        if x < self.error_rate:
+            return 'error'
+        if x < self.error_rate + self.drop_rate:
+            return 'drop'
+        return None
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive, like the Q guide
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.counters.add('requests')
+        if server.latency:
+            time.sleep(server.latency)
+
+        failure = server.pick_failure()
+        if failure == 'drop':
+            server.counters.add('drops')
+            self.close_connection = 1
+            return
+        if failure == 'error':
+            server.counters.add('errors')
+            self.respond(500, 'Injected error')
+            return
+
+        # Paths are file names as they were requested, still quoted
+        path = self.path.lstrip('/')
+        filename = os.path.join(server.directory, path)
+        try:
+            with open(filename, 'rb') as f:
+                contents = f.read()
+            modified = http_date(os.path.getmtime(filename))
+        except (IOError, OSError):
+            server.counters.add('missing')
+            self.respond(404, 'No fixture for ' + path)
+            return
+        etag = content_etag(contents)
+        validators = [('ETag', etag), ('Last-Modified', modified)]
+        if not_modified(etag, modified, self.headers.get('If-None-Match'),
+                self.headers.get('If-Modified-Since')):
+            server.counters.add('not_modified')
+            self.respond(304, '', validators)
+            return
+        self.respond(200, contents, validators)
+
+    def respond(self, status, contents, extra_headers=[]):
+        headers = [('Content-Type', 'text/html; charset=utf-8')] + \
+            extra_headers
+        if contents and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(contents)
+            contents = buf.getvalue()
+            headers.append(('Content-Encoding', 'gzip'))
+        self.server.counters.add('bytes', len(contents))
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(contents)))
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,279 @@
+################################################################################
+# Concurrent page fetching for the scraper.  A Fetcher owns a pool of worker  #
+# threads that download pages through a fetch function (normally             #
+# scrape.get_data_from_path), so independent pages can be in flight at once.  #
+# Failed fetches are retried by a scheduler thread after a backoff delay, so  #
+# a path that is waiting to be retried never holds up a worker.  Downloads    #
+# can be paced per host by an adaptive rate limiter.                          #
+################################################################################
+
+from collections import namedtuple
+import heapq
+import httplib
+import itertools
+import Queue
+import sys
+import threading
+import time
+import urlparse
+
+from retry import InvalidPage, RetryPolicy
+
+# One path of a get_all batch
+#
+# validate - function taking the contents and returning whether they're
+#     usable; if not, the path is downloaded again
+# context - recorded with the path if it ends up in the dead letters
+# attempts - failed attempts so far
+_Job = namedtuple('_Job',
+    ['batch', 'i', 'path', 'refresh', 'validate', 'context', 'attempts'])
+
+class Fetcher(object):
+    # fetch - function taking a path and a refresh flag and returning the page
+    #     contents; refresh means a stored copy must not be used without
+    #     checking it's current.  Always called with refresh when cached is
+    #     given, since cached was tried.
+    # base_url - URL the paths are relative to; used to find each path's host
+    # workers - number of fetch threads
+    # per_host - most requests allowed in flight to any single host
+    # policy - RetryPolicy deciding when to retry failures and when to give up
+    # dead_letters - DeadLetters to record paths that are given up on
+    # on_failure - called with (path, error, attempts, gave_up) after every
+    #     failed attempt, for logging
+    # retry_on - exceptions from fetch that are worth retrying
+    # cached - function taking a path and a refresh flag and returning its
+    #     stored contents, or None if it has to be fetched.  With refresh, it
+    #     only returns a copy that's known to be current.  Stored pages skip
+    #     the rate limiter and the per-host cap.
+    # limiter - function returning a new rate limiter (see ratelimit.py) for
+    #     each host; None for no rate limiting
+    # on_invalid - called with a path whose stored or downloaded page failed
+    #     validation, before it's downloaded again, so a stored copy that's
+    #     no good isn't used or revalidated
+    # clock - function returning the time in seconds, which retries are
+    #     scheduled and downloads timed by (tests give a fake one)
+    def __init__(self, fetch, base_url, workers=8, per_host=4, policy=None,
+            dead_letters=None, on_failure=None,
+            retry_on=(IOError, httplib.HTTPException), cached=None,
+            limiter=None, on_invalid=None, clock=time.time):
+        self.fetch = fetch
+        self.base_url = base_url
+        self.per_host = per_host
+        self.policy = policy or RetryPolicy()
+        self.dead_letters = dead_letters
+        self.on_failure = on_failure
+        self.retry_on = retry_on + (InvalidPage,)
+        self.cached = cached
+        self.make_limiter = limiter
+        self.on_invalid = on_invalid
+        self.clock = clock
+        self.jobs = Queue.Queue()
+        self.host_slots = {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work,
+                name='fetcher-{0}'.format(i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+        # Heap of (due time, sequence number, job) waiting to be retried
+        self.retries = []
+        self.retry_seq = itertools.count()
+        self.retry_cond = threading.Condition()
+        self.closed = False
+        self.retry_thread = threading.Thread(target=self._run_retries,
+            name='fetcher-retries')
+        self.retry_thread.daemon = True
+        self.retry_thread.start()
+
+    # Fetches a single page
+    def get(self, path, refresh=False, validate=None, context=None):
+        return self.get_all([path], refresh, validate, context)[0]
+
+    # Fetches every path concurrently and returns the contents in the same
+    # order as paths.  A path that fails every retry comes back as None and
+    # goes to the dead letters.  Anything else a fetch raises is re-raised
+    # here once the rest of the batch has finished.  Must not be called from
+    # a worker thread.
+    #
+    # context - recorded with dead letters; either one value for the whole
+    #     batch or a list with one per path
+    def get_all(self, paths, refresh=False, validate=None, context=None):
+        if not isinstance(context, list):
+            context = [context] * len(paths)
+        batch = _Batch(len(paths))
+        for i, path in enumerate(paths):
+            self.jobs.put(_Job(batch, i, path, refresh, validate, context[i],
+                0))
+        return batch.wait()
+
+    # Returns a view of this fetcher that records context with every dead
+    # letter, so callers further down don't need to pass it along
+    def with_context(self, context):
+        return _ContextFetcher(self, context)
+
+    # Returns how many paths are queued or waiting to be retried, and the rate
+    # limiter stats of each host
+    def stats(self):
+        with self.retry_cond:
+            retrying = len(self.retries)
+        with self.lock:
+            hosts = dict((host, limiter.stats())
+                for host, limiter in self.limiters.items())
+        return {
+            'queued': self.jobs.qsize(),
+            'retrying': retrying,
+            'hosts': hosts,
+        }
+
+    # Stops the worker threads once the queued jobs are done
+    def close(self):
+        with self.retry_cond:
+            self.closed = True
+            self.retry_cond.notify_all()
+        self.retry_thread.join()
+        for t in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+
+    # Returns the per-host slot semaphore and rate limiter for a path
+    def _host(self, path):
+        host = urlparse.urlparse(urlparse.urljoin(self.base_url, path)).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(
+                    self.per_host)
+                if self.make_limiter is not None:
+                    self.limiters[host] = self.make_limiter()
+            return self.host_slots[host], self.limiters.get(host)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                contents = None
+                if self.cached is not None:
+                    contents = self.cached(job.path, job.refresh)
+                    # A bad stored copy is downloaded again right away
+                    if contents is not None and job.validate is not None \
+                            and not job.validate(contents):
+                        self._invalid(job.path)
+                        contents = None
+                if contents is None:
+                    contents = self._download(job)
+            except self.retry_on as e:
+                self._failed(job, e)
+            except BaseException:
+                # An expired cookie, for one: the caller decides
+                job.batch.fail(sys.exc_info())
+            else:
+                job.batch.done(job.i, contents)
+
+    def _download(self, job):
+        slot, limiter = self._host(job.path)
+        if limiter is not None:
+            limiter.acquire()
+        slot.acquire()
+        try:
+            start = self.clock()
+            contents = self.fetch(job.path,
+                job.refresh or self.cached is not None)
+            if job.validate is not None and not job.validate(contents):
+                self._invalid(job.path)
+                raise InvalidPage('page failed validation')
+        except self.retry_on:
+            if limiter is not None:
+                limiter.failure()
+            raise
+        finally:
+            slot.release()
+        if limiter is not None:
+            limiter.success(self.clock() - start)
+        return contents
+
+    def _invalid(self, path):
+        if self.on_invalid is not None:
+            self.on_invalid(path)
+
+    # Schedules a retry of a failed job, or gives up on it
+    def _failed(self, job, error):
+        attempts = job.attempts + 1
+        gave_up = self.policy.gave_up(attempts)
+        if self.on_failure is not None:
+            self.on_failure(job.path, error, attempts, gave_up)
+        if gave_up:
+            if self.dead_letters is not None:
+                self.dead_letters.add(job.path, error, attempts, job.context)
+            job.batch.done(job.i, None)
+            return
+
+        # An invalid page may have come from the page store, so skip it
+        refresh = job.refresh or isinstance(error, InvalidPage)
+        job = job._replace(attempts=attempts, refresh=refresh)
+        with self.retry_cond:
+            heapq.heappush(self.retries, (self.clock() +
+                self.policy.delay(attempts), next(self.retry_seq), job))
+            self.retry_cond.notify()
+
+    # Puts jobs back on the queue once their delay is up
+    def _run_retries(self):
+        with self.retry_cond:
+            while not self.closed:
+                if not self.retries:
+                    self.retry_cond.wait(1)
+                    continue
+                wait = self.retries[0][0] - self.clock()
+                if wait > 0:
+                    self.retry_cond.wait(min(wait, 1))
+                    continue
+                self.jobs.put(heapq.heappop(self.retries)[2])
+
+class _ContextFetcher(object):
+    def __init__(self, fetcher, context):
+        self.fetcher = fetcher
+        self.context = context
+
+    def get(self, path, refresh=False, validate=None):
+        return self.fetcher.get(path, refresh, validate, self.context)
+
+    def get_all(self, paths, refresh=False, validate=None):
+        return self.fetcher.get_all(paths, refresh, validate, self.context)
+
+    def with_context(self, context):
+        return _ContextFetcher(self.fetcher, context)
+
+# Collects the results of one get_all call
+class _Batch(object):
+    def __init__(self, size):
+        self.results = [None] * size
+        self.remaining = size
+        self.exc_info = None
+        self.cond = threading.Condition()
+
+    def done(self, i, contents):
+        with self.cond:
+            self.results[i] = contents
+            self.remaining -= 1
+            self.cond.notify_all()
+
+    def fail(self, exc_info):
+        with self.cond:
+            if self.exc_info is None:
+                self.exc_info = exc_info
+            self.remaining -= 1
+            self.cond.notify_all()
+
+    def wait(self):
+        with self.cond:
+            while self.remaining:
+                # Wake up now and then so Ctrl-C still works
+                self.cond.wait(1)
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.results
@@ -0,0 +1,241 @@
+################################################################################
+# A synthetic Q guide for benchmarks.  write_corpus saves department lists,    #
+# course lists, course summaries, histograms, comments and instructor pages    #
+# one file per path, laid out like the pages the scraper reads, so they can    #
+# be served by a FixtureTransport or a fakeserver.FixtureServer.  Pages are    #
+# generated from a seed, so the same arguments always give the same corpus.    #
+#                                                                              #
+# course_dicts makes course dicts like scrape_course_data's, for timing the    #
+# CourseWriter without any pages.                                              #
+################################################################################
+
+import json
+import os
+import random
+import urllib2
+
+CATEGORIES = ['Course Overall', 'Materials', 'Assignments', 'Feedback',
+    'Section', 'Workload (hours per week)', 'Would You Recommend']
+INSTRUCTOR_CATEGORIES = ['Instructor Overall', 'Effective Lectures',
+    'Accessible Outside Class', 'Generates Enthusiasm',
+    'Facilitates Discussion',
+    'Gives Useful Feedback', 'Returns Assignments in Timely Fashion']
+PIE_CATEGORIES = ['Difficulty', 'Compared to Other Courses']
+REASONS = ['Elective', 'Concentration or Department Requirement',
+    'Secondary Field or Language Citation Requirement',
+    'Undergraduate Core or General Education Requirement',
+    'Expository Writing Requirement', 'Foreign Language Requirement',
+    'Pre-Med Requirement']
+WORDS = ['the', 'course', 'lectures', 'professor', 'problem', 'sets', 'were',
+    'really', 'interesting', 'hard', 'but', 'fair', 'workload', 'too', 'much',
+    'great', 'section', 'exams', 'boring', 'recommend', 'take', 'this', 'if',
+    'you', 'like', 'readings', 'papers', 'helpful', 'office', 'hours']
+FIRST_NAMES = ['Ann', 'Ben', 'Carla', 'David', 'Elena', 'Frank', 'Grace',
+    'Hiro', 'Ines', 'Jamal']
+LAST_NAMES = ['Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Gupta',
+    'Hughes', 'Ito', 'Jones', 'Kim', 'Lopez']
+
+# Writes a corpus under directory for every (year, term) in yearterms.
+# Returns the number of pages written.
+#
+# depts - departments per term
+# courses - courses per department
+# instructors - most instructors per course
+# comments - most comments per course
+# inline - fraction of courses whose summary page draws its histograms in the
+#     rows, like newer Q guide pages, instead of linking to histogram pages
+def write_corpus(directory, yearterms, depts=3, courses=5, instructors=2,
+        comments=10, inline=0.5, seed=0):
+    rand = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    pages = {}
+    course_id = 1000
+    for year, term in yearterms:
+        names = ['DEPT{0}'.format(i) for i in range(depts)]
+        pages['list?yearterm={0}_{1}'.format(year, term)] = \
+            dept_list_page(names)
+        for dept in names:
+            listed = []
+            for i in range(courses):
+                course_id += 1
+                listed.append((course_id, dept, str(100 + i),
+                    'Course {0} of {1}'.format(i, dept)))
+                course_pages(rand, pages, course_id, instructors, comments,
+                    rand.random() < inline)
+            pages['guide_dept?dept={0}&term={1}&year={2}'.format(
+                urllib2.quote(dept, ''), term, year)] = \
+                course_list_page(listed)
+    for path, html in pages.items():
+        with open(os.path.join(directory, path), 'w') as f:
+            f.write(html)
+    with open(os.path.join(directory, 'corpus.json'), 'w') as f:
+        json.dump({'yearterms': yearterms, 'depts': depts,
+            'courses': courses, 'instructors': instructors,
+            'comments': comments, 'inline': inline, 'seed': seed}, f)
+    return len(pages)
+
+# The arguments a corpus was written with, or None if directory has none
+def read_corpus(directory):
+    try:
+        with open(os.path.join(directory, 'corpus.json')) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+# Adds the pages of one course to pages
+def course_pages(rand, pages, course_id, instructors, comments, inline):
+    histograms = {}
+    pages['new_course_summary.html?course_id={0}'.format(course_id)] = \
+        summary_page(rand, course_id, CATEGORIES, inline, histograms)
+
+    texts = [comment_text(rand) for i in range(rand.randint(0, comments))]
+    path = 'view_comments.html?course_id={0}'.format(course_id)
+    pages[path] = comments_page([] if not texts else texts[:1])
+    pages[path + '&qid=1487'] = comments_page(texts)
+
+    profs = []
+    for i in range(rand.randint(1, instructors)):
+        profs.append(('{0:08X}:{1}'.format(rand.getrandbits(32), i),
+            rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES)))
+    tables = report_tables(rand, course_id, INSTRUCTOR_CATEGORIES, False,
+        histograms)
+    for i, prof in enumerate(profs):
+        html = instructor_page(profs, i, tables)
+        path = 'inst-tf_summary.html?sect_num=&course_id={0}'.format(
+            course_id)
+        if i == 0:
+            pages[path] = html
+        pages[path + '&current_instructor_or_tf_huid_param=' +
+            urllib2.quote(prof[0], '')] = html
+        tables = report_tables(rand, course_id, INSTRUCTOR_CATEGORIES, False,
+            histograms)
+    pages.update(histograms)
+
+def dept_list_page(names):
+    return page('<div class="displayed_courses">' + ''.join(('<div><span ' +
+        'class="course-block-title" title="{0}">{0}</span></div>').format(name)
+        for name in names) + '</div>')
+
+def course_list_page(listed):
+    return page(''.join(('<li><a href="new_course_summary.html?' +
+        'course_id={0}">{1} {2}: {3}</a></li>').format(*course)
+        for course in listed))
+
+def summary_page(rand, course_id, categories, inline, histograms):
+    enrollment = rand.randint(5, 300)
+    evaluations = rand.randint(1, enrollment)
+    stats = ('<div id="summaryStats">Enrollment: {0}\n Evaluations: {1}\n' +
+        ' Response Rate: {2:.2f}%\n</div>').format(enrollment, evaluations,
+        100.0 * evaluations / enrollment)
+    pies = ''.join(pie_chart_row(rand, category)
+        for category in PIE_CATEGORIES)
+    reasons = ''.join('<tr><td></td><td>{0}</td><td>{1}</td></tr>'.format(
+        rand.randint(0, evaluations), reason)
+        for reason in rand.sample(REASONS, rand.randint(1, 3)))
+    return page(stats + '<div id="reportContent">' +
+        report_tables(rand, course_id, categories, inline, histograms) +
+        '<table>' + pies + '</table>' +
+        '<table><tr><th>Reasons</th></tr>' + reasons + '</table></div>')
+
+# One table of score bars, with histograms linked (added to histograms) or
+# drawn inline
+def report_tables(rand, course_id, categories, inline, histograms):
+    rows = ['<tr><th>Category</th><th>N</th><th>Score</th><th></th></tr>']
+    for category in categories:
+        scores = [rand.randint(0, 20) for i in range(5)]
+        n = sum(scores)
+        mean = sum((i + 1) * x for i, x in enumerate(scores)) / float(n or 1)
+        image = '../histogram-{0}-{1}-{2}-{3}-{4}-{5}.jpg'.format(
+            *(scores + [n]))
+        if inline:
+            histogram = '<img src="{0}">'.format(image)
+        else:
+            path = 'histogram.html?course_id={0}&q={1}'.format(course_id,
+                len(histograms))
+            histograms[path] = page('<img src="{0}">'.format(image))
+            histogram = '<a href="{0}">histogram</a>'.format(path)
+        rows.append(('<tr><td><strong>{0}</strong></td><td>{1}</td>' +
+            '<td><img src="../bar_1to5-{2:.2f}.png"></td><td>{3}</td></tr>')\
+            .format(category, n, mean, histogram))
+    rows.append('<tr><td>Scale</td></tr>')
+    rows.append('<tr><td>Legend</td></tr>')
+    return '<table>' + ''.join(rows) + '</table>'
+
+def pie_chart_row(rand, category):
+    scores = [rand.randint(0, 20) for i in range(5)]
+    n = sum(scores)
+    mean = sum((i + 1) * x for i, x in enumerate(scores)) / float(n or 1)
+    return ('<tr><td><strong>{0}</strong></td><td>Total Responses: {1}' +
+        '<br>Mean: {2:.2f}</td><td>{3}</td></tr>').format(category, n, mean,
+        ' '.join('<span>{0} (n={1})</span>'.format(i + 1, x)
+            for i, x in enumerate(scores)))
+
+def comments_page(texts):
+    if not texts:
+        return page('The response(s) to this question are not available. ' +
+            'This is due to one of the following reasons:')
+    return page('<div id="responseBlock">' + ''.join(
+        '<div class="response"><p>{0}</p></div>'.format(text)
+        for text in texts) + '</div>')
+
+def instructor_page(profs, selected, tables):
+    options = ''.join('<option value="{0}"{1}>{2}, {3}</option>'.format(
+        value, ' selected' if i == selected else '', last, first)
+        for i, (value, first, last) in enumerate(profs))
+    return page('<select name="current_instructor_or_tf_huid_param">' +
+        options + '</select><div id="reportContent">' + tables + '</div>')
+
+def comment_text(rand):
+    return ' '.join(rand.choice(WORDS)
+        for i in range(rand.randint(5, 60))).capitalize() + '.'
+
+def page(body):
+    return '<html><head><title>Q Guide</title></head><body>' + body + \
+        '</body></html>'
+
+# Makes n course dicts like scrape_course_data's, with ids from first_id
+def course_dicts(n, first_id=1, instructors=2, comments=10, seed=0):
+    rand = random.Random(seed)
+    courses = []
+    for course_id in range(first_id, first_id + n):
+        courses.append({
+            'id':            course_id,
+            'field':         'DEPT{0}'.format(course_id % 20),
+            'number':        str(course_id),
+            'title':         'Course {0}'.format(course_id),
+            'year':          2006 + course_id % 7,
+            'term':          1 + course_id % 2,
+            'enrollment':    rand.randint(5, 300),
+            'evaluations':   rand.randint(1, 5),
+            'response_rate': round(rand.uniform(10, 100), 2),
+            'fingerprint':   '{0:040x}'.format(rand.getrandbits(160)),
+            'ratings':       rating_dicts(rand, CATEGORIES),
+            'reasons':       dict((reason, rand.randint(0, 50))
+                for reason in rand.sample(REASONS, 2)),
+            'comments':      [comment_text(rand)
+                for i in range(rand.randint(0, comments))],
+            'profs':         [{
+                'prof_id': '{0:08X}'.format(rand.getrandbits(32) % 5000),
+                'first':   rand.choice(FIRST_NAMES),
+                'last':    rand.choice(LAST_NAMES),
+                'ratings': rating_dicts(rand, INSTRUCTOR_CATEGORIES),
+            } for i in range(rand.randint(1, instructors))],
+        })
+    return courses
+
+def rating_dicts(rand, categories):
+    ratings = []
+    for category in categories:
+        scores = [rand.randint(0, 20) for i in range(5)]
+        ratings.append({
+            'category':      category,
+            'num_responses': sum(scores),
+            'value':         round(rand.uniform(1, 5), 2),
+            'ones':          scores[0],
+            'twos':          scores[1],
+            'threes':        scores[2],
+            'fours':         scores[3],
+            'fives':         scores[4],
+        })
+    return ratings
@@ -0,0 +1,141 @@
+from optparse import make_option
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from qscraper import settings
+from scraper import bench, fixtures, scrape
+
+SUITES = ['e2e', 'parse', 'write']
+
+class Command(BaseCommand):
+    args = '[e2e|parse|write ...]'
+    help = 'Benchmarks the scraper against a synthetic Q guide and ' + \
+        'compares with earlier results'
+    option_list = BaseCommand.option_list + (
+        make_option('--corpus', dest='corpus',
+            default=settings.SCRAPER_BENCH_CORPUS,
+            help='Directory of the synthetic Q guide, written if missing'),
+        make_option('--depts', type='int', dest='depts', default=3,
+            help='Departments per term in the synthetic Q guide'),
+        make_option('--courses', type='int', dest='courses', default=5,
+            help='Courses per department in the synthetic Q guide'),
+        make_option('--latency', type='float', dest='latency', default=0,
+            help='Seconds the fake server holds back each response'),
+        make_option('--error-rate', type='float', dest='error_rate',
+            default=0,
+            help='Fraction of requests the fake server answers with a 500'),
+        make_option('--drop-rate', type='float', dest='drop_rate', default=0,
+            help='Fraction of requests the fake server hangs up on'),
+        make_option('--workers', type='int', dest='workers',
+            default=settings.SCRAPER_WORKERS,
+            help='Number of pages to download at the same time'),
+        make_option('--per-host', type='int', dest='per_host',
+            default=settings.SCRAPER_PER_HOST,
+            help='Most simultaneous requests to a single host'),
+        make_option('--log-level', dest='log_level',
+            default=settings.SCRAPER_LOG_LEVEL,
+            choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+            help='Lowest level of log messages the e2e scrape writes'),
+        make_option('--limit', type='int', dest='limit', default=500,
+            help='Most pages of each kind to parse (0 for all)'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+            help='Times to parse the pages; the fastest counts'),
+        make_option('--write-courses', type='int', dest='write_courses',
+            default=1000, help='Courses the write benchmark saves'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=settings.SCRAPER_BATCH_SIZE,
+            help='Most courses saved in one transaction'),
+        make_option('--no-history', action='store_false', dest='history',
+            default=True,
+            help='Don\'t add the results to settings.SCRAPER_BENCH_HISTORY'),
+    )
+
+    def handle(self, *args, **options):
+        suites = list(args) or SUITES
+        for suite in suites:
+            if suite not in SUITES:
+                raise CommandError('Unknown benchmark {0}'.format(suite))
+
+        corpus = None
+        if 'e2e' in suites or 'parse' in suites:
+            corpus = self.corpus(options)
+
+        for suite in suites:
+            if suite == 'e2e':
+                params = dict(corpus, latency=options['latency'],
+                    error_rate=options['error_rate'],
+                    drop_rate=options['drop_rate'],
+                    workers=options['workers'], per_host=options['per_host'],
+                    log_level=options['log_level'])
+                metrics = bench.benchmark_e2e(options['corpus'],
+                    options['latency'], options['error_rate'],
+                    options['drop_rate'], options['workers'],
+                    options['per_host'], options['log_level'])
+            elif suite == 'parse':
+                params = dict(corpus, limit=options['limit'])
+                metrics = self.parse(options)
+            else:
+                params = {'courses': options['write_courses'],
+                    'batch_size': options['batch_size']}
+                metrics = bench.benchmark_write(options['write_courses'],
+                    options['batch_size'])
+            self.report(suite, params, metrics, options['history'])
+
+    # The parameters of the corpus, which is written first if it's missing or
+    # was written with different ones
+    def corpus(self, options):
+        wanted = {'depts': options['depts'], 'courses': options['courses']}
+        corpus = fixtures.read_corpus(options['corpus'])
+        if corpus is None or any(corpus[key] != value
+                for key, value in wanted.items()):
+            if corpus is not None:
+                shutil.rmtree(options['corpus'])
+            elif os.path.exists(options['corpus']):
+                raise CommandError('{0} isn\'t a benchmark corpus'.format(
+                    options['corpus']))
+            pages = fixtures.write_corpus(options['corpus'],
+                scrape.get_yearterms(), **wanted)
+            self.stdout.write('Wrote {0} pages to {1}'.format(pages,
+                options['corpus']))
+            corpus = fixtures.read_corpus(options['corpus'])
+        return corpus
+
+    def parse(self, options):
+        scratch = tempfile.mkdtemp()
+        try:
+            store = bench.corpus_page_store(options['corpus'], scratch)
+            results = bench.benchmark_parse(store, options['limit'],
+                options['repeat'])
+            store.close()
+        finally:
+            shutil.rmtree(scratch)
+        metrics = {}
+        for name, pages, errors, seconds, rate in results:
+            metrics[name + ' pages/sec'] = round(rate, 1)
+            metrics[name + ' errors'] = errors
+        return metrics
+
+    # Prints metrics next to the last recorded result with the same params,
+    # then records them
+    def report(self, suite, params, metrics, record):
+        previous = bench.history(suite, params)
+        previous = previous[-1] if previous else None
+        self.stdout.write(suite)
+        for name in sorted(metrics):
+            line = '  {0:32} {1:>12}'.format(name, metrics[name])
+            if previous is not None and \
+                    previous['metrics'].get(name) is not None:
+                was = previous['metrics'][name]
+                line += '  (was {0}'.format(was)
+                if was and not isinstance(was, bool):
+                    line += ', {0:+.1f}%'.format(
+                        100.0 * (metrics[name] - was) / was)
+                line += ')'
+            self.stdout.write(line)
+        if previous is not None:
+            self.stdout.write('  compared with {0} at {1}'.format(
+                previous['time'], previous['commit']))
+        if record:
+            bench.record(suite, params, metrics)
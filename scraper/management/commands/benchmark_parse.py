@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from scraper import bench, scrape
+
+class Command(BaseCommand):
+    help = 'Times the page parsers over pages in the page store'
+    option_list = BaseCommand.option_list + (
+        make_option('--page-store', dest='page_store', default=None,
+            help='Page store file to use instead of settings.PAGE_STORE'),
+        make_option('--limit', type='int', dest='limit', default=500,
+            help='Most pages of each kind to parse (0 for all)'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+            help='Times to parse the pages; the fastest counts'),
+    )
+
+    def handle(self, *args, **options):
+        if options['page_store']:
+            scrape.use_page_store(options['page_store'])
+        results = bench.benchmark_parse(scrape.get_page_store(),
+            options['limit'], options['repeat'])
+        if not results:
+            raise CommandError('The page store has no pages')
+        self.stdout.write('{0:18} {1:>7} {2:>7} {3:>9} {4:>10}'.format('',
+            'pages', 'errors', 'seconds', 'pages/sec'))
+        for name, pages, errors, seconds, rate in results:
+            self.stdout.write('{0:18} {1:7d} {2:7d} {3:9.3f} {4:10.1f}'.format(
+                name, pages, errors, seconds, rate))
@@ -0,0 +1,24 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from scraper import ratings
+
+class Command(BaseCommand):
+    help = 'Compares reading ratings from the old Rating table with ' + \
+        'reading them from CourseRating and InstructorRating'
+    option_list = BaseCommand.option_list + (
+        make_option('--instances', type='int', dest='instances',
+            default=100,
+            help='Newest course instances to read the ratings of'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+            help='Times to read each; the fastest counts'),
+    )
+
+    def handle(self, *args, **options):
+        results = ratings.benchmark_ratings(options['instances'],
+            options['repeat'])
+        self.stdout.write('{0:52} {1:>7} {2:>7} {3:>9}'.format('', 'rows',
+            'queries', 'seconds'))
+        for name, rows, queries, seconds in results:
+            self.stdout.write('{0:52} {1:7d} {2:7d} {3:9.4f}'.format(name,
+                rows, queries, seconds))
@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from qscraper import settings
+from scraper import export
+
+class Command(BaseCommand):
+    args = '[out_dir]'
+    help = 'Exports course instances, ratings, instructors, reasons and ' + \
+        'comments to one file per table and term'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+            choices=['parquet', 'csv'],
+            help='parquet (needs pyarrow) or csv; parquet if pyarrow is ' +
+                'installed'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=settings.SCRAPER_EXPORT_CHUNK_SIZE,
+            help='Rows read from the database at a time'),
+        make_option('--full', action='store_true', dest='full',
+            default=False,
+            help='Write every term, not just those changed since the last ' +
+                'export'),
+    )
+
+    def handle(self, *args, **options):
+        out_dir = settings.SCRAPER_EXPORT_DIR
+        if len(args):
+            out_dir = args[0]
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'csv' if export.pyarrow is None else 'parquet'
+        try:
+            yearterms = export.export(out_dir, fmt, options['chunk_size'],
+                options['full'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Exported {0} terms to {1}'.format(len(yearterms),
+            out_dir))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from scraper import scrape
+
+class Command(BaseCommand):
+    args = '[data_dir]'
+    help = 'Imports pages cached one file per path into the page store'
+
+    def handle(self, *args, **options):
+        data_dir = scrape.DATA_DIR
+        if len(args):
+            data_dir = args[0]
+        self.stdout.write('Importing pages from {0}'.format(data_dir))
+        count = scrape.import_data_dir(data_dir)
+        self.stdout.write('Imported {0} pages'.format(count))
@@ -0,0 +1,23 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from scraper import ratings
+
+class Command(BaseCommand):
+    help = 'Copies ratings from the old Rating table into CourseRating ' + \
+        'and InstructorRating'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=5000,
+            help='Ratings copied in one transaction'),
+        make_option('--delete', action='store_true', dest='delete',
+            default=False,
+            help='Delete the old ratings as they are copied'),
+    )
+
+    def handle(self, *args, **options):
+        counts = ratings.migrate_ratings(options['chunk_size'],
+            options['delete'])
+        self.stdout.write('Copied {0} ratings'.format(counts['copied']))
+        self.stdout.write('Skipped {0} duplicates and {1} orphans'.format(
+            counts['duplicates'], counts['orphans']))
@@ -0,0 +1,46 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from qscraper import settings
+from scraper import reparse, scrape
+
+class Command(BaseCommand):
+    help = 'Rebuilds the database from the page store without downloading ' + \
+        'anything'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+            default=settings.SCRAPER_PROCESSES,
+            help='Number of processes parsing pages'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=settings.SCRAPER_BATCH_SIZE,
+            help='Most courses saved in one transaction'),
+        make_option('--page-store', dest='page_store', default=None,
+            help='Page store file to use instead of settings.PAGE_STORE'),
+        make_option('--misses', dest='misses',
+            default=settings.SCRAPER_CACHE_MISSES,
+            help='File to list the paths missing from the page store in'),
+        make_option('--log-level', dest='log_level', default='INFO',
+            choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+            help='Lowest level of log messages to write'),
+    )
+
+    def handle(self, *args, **options):
+        scrape.configure_logging(options['log_level'])
+        if options['page_store']:
+            scrape.use_page_store(options['page_store'])
+        self.stdout.write('Rebuilding the database from {0}'.format(
+            scrape.get_page_store().filename))
+        counts = reparse.reparse(options['processes'], options['batch_size'],
+            True, options['misses'])
+        if counts is None:
+            raise CommandError('Rebuild failed; see {0}{1}'.format(
+                scrape.LOG_DIR, scrape.ERROR_LOG))
+        self.stdout.write('Saved {0} courses'.format(
+            counts.get('courses_saved', 0)))
+        self.stdout.write('{0} pages missing from the page store{1}'.format(
+            counts.get('pages_missing', 0),
+            ' (listed in {0})'.format(options['misses'])
+                if counts.get('pages_missing') else ''))
+        self.stdout.write('{0} courses failed to parse'.format(
+            counts.get('parse_errors', 0)))
+        self.stdout.write('Done rebuilding!')
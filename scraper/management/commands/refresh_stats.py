@@ -0,0 +1,18 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from scraper import stats
+
+class Command(BaseCommand):
+    help = 'Rebuilds the course, instructor and field stats of the terms ' + \
+        'changed since the last refresh'
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', dest='full',
+            default=False,
+            help='Rebuild every term'),
+    )
+
+    def handle(self, *args, **options):
+        yearterms = stats.refresh_stats(options['full'])
+        self.stdout.write('Refreshed the stats of {0} terms'.format(
+            len(yearterms)))
@@ -1,14 +1,174 @@
+from optparse import make_option
+import os
+import socket
+import subprocess
+import sys
+
 from django.core.management.base import BaseCommand, CommandError
-from scraper import scrape
+from qscraper import settings
+from scraper import pipeline, reparse, scrape, shard
+from scraper.checkpoint import get_resumable_run
+
+# Environment variable the cookie is read from when it isn't an argument.
+# Worker processes get it this way, since arguments show up in ps.
+COOKIE_VARIABLE = 'SCRAPER_COOKIE'
 
 class Command(BaseCommand):
     args = '<cookie>'
-    help = 'Runs the Q guide scraper'
+    help = 'Runs the Q guide scraper.  The cookie can also be given in ' + \
+        'the ' + COOKIE_VARIABLE + ' environment variable.'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers',
+            default=settings.SCRAPER_WORKERS,
+            help='Number of pages to download at the same time'),
+        make_option('--per-host', type='int', dest='per_host',
+            default=settings.SCRAPER_PER_HOST,
+            help='Most simultaneous requests to a single host'),
+        make_option('--pipeline', action='store_true', dest='pipeline',
+            default=False,
+            help='Fetch, parse and save courses in concurrent stages'),
+        make_option('--queue-size', type='int', dest='queue_size',
+            default=settings.SCRAPER_QUEUE_SIZE,
+            help='Most courses waiting between two pipeline stages'),
+        make_option('--incremental', action='store_true', dest='incremental',
+            default=False,
+            help='Keep the database and only scrape new or changed courses'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=settings.SCRAPER_BATCH_SIZE,
+            help='Most courses saved in one transaction'),
+        make_option('--resume', action='store_true', dest='resume',
+            default=False,
+            help='Carry on with the last run that didn\'t finish, e.g. ' +
+                'after the cookie expired'),
+        make_option('--replay-failed', action='store_true',
+            dest='replay_failed', default=False,
+            help='Scrape again whatever a previous run gave up on'),
+        make_option('--transport', dest='transport',
+            default=settings.SCRAPER_TRANSPORT,
+            choices=['https', 'urllib', 'fixture'],
+            help='How pages are downloaded: https, urllib or fixture'),
+        make_option('--fixtures', dest='fixtures', default=None,
+            help='Directory or page store file that --transport fixture ' +
+                'serves pages from'),
+        make_option('--fixture-latency', type='float', dest='fixture_latency',
+            default=0,
+            help='Seconds each fixture page pretends to take'),
+        make_option('--pool-size', type='int', dest='pool_size',
+            default=settings.SCRAPER_POOL_SIZE,
+            help='Most idle connections kept open per host'),
+        make_option('--page-store', dest='page_store', default=None,
+            help='Page store file to use instead of settings.PAGE_STORE'),
+        make_option('--log-level', dest='log_level',
+            default=settings.SCRAPER_LOG_LEVEL,
+            choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+            help='Lowest level of log messages to write'),
+        make_option('--reparse', action='store_true', dest='reparse',
+            default=False,
+            help='Parse the courses in the page store again, in ' +
+                '--processes processes, without downloading anything'),
+        make_option('--coordinator', action='store_true', dest='coordinator',
+            default=False,
+            help='Queue departments for worker processes and wait for them'),
+        make_option('--processes', type='int', dest='processes',
+            default=settings.SCRAPER_PROCESSES,
+            help='Worker processes the coordinator starts on this ' +
+                'machine, or parsing processes for --reparse'),
+        make_option('--worker', action='store_true', dest='worker',
+            default=False,
+            help='Scrape departments a coordinator queued (needs --run)'),
+        make_option('--run', type='int', dest='run', default=None,
+            help='Run whose departments a worker scrapes'),
+        make_option('--worker-name', dest='worker_name', default=None,
+            help='Name of this worker in the work queue and its log files'),
+        make_option('--metrics-file', dest='metrics_file',
+            default=settings.SCRAPER_METRICS_FILE,
+            help='File to keep the run\'s metrics in, in Prometheus\' ' +
+                'text format (\'\' for none)'),
+    )
 
     def handle(self, *args, **options):
-        cookie = ''
+        cookie = os.environ.get(COOKIE_VARIABLE, '')
         if len(args):
             cookie = args[0]
+        if options['resume'] and get_resumable_run() is None:
+            raise CommandError('There is no unfinished run to resume')
+        if options['transport'] == 'fixture' and not options['fixtures']:
+            raise CommandError('--transport fixture needs --fixtures')
+        if options['worker'] and options['run'] is None:
+            raise CommandError('--worker needs --run')
+        worker_name = options['worker_name'] or \
+            '{0}-{1}'.format(socket.gethostname(), os.getpid())
+        if options['worker']:
+            scrape.configure_logging(options['log_level'], worker_name + '.')
+        else:
+            scrape.configure_logging(options['log_level'])
+        if options['page_store']:
+            scrape.use_page_store(options['page_store'])
+        transport = scrape.make_transport(cookie, options['transport'],
+            options['fixtures'], options['fixture_latency'],
+            options['pool_size'])
+
+        metrics_file = options['metrics_file']
+        if metrics_file and options['worker']:
+            metrics_file = os.path.join(os.path.dirname(metrics_file),
+                worker_name + '.' + os.path.basename(metrics_file))
+        metrics = scrape.start_metrics_file(metrics_file)
+        try:
+            self.run_scraper(cookie, worker_name, transport, options)
+        finally:
+            if metrics is not None:
+                metrics.stop()
+
+    def run_scraper(self, cookie, worker_name, transport, options):
+        if options['reparse']:
+            self.stdout.write('Reparsing the page store')
+            reparse.reparse(options['processes'], options['batch_size'])
+            self.stdout.write('Done reparsing!')
+            return
+
         self.stdout.write('Scraping Q guide with cookie {0}'.format(cookie))
-        scrape.scrape(cookie)
+        if options['worker']:
+            shard.work(cookie, options['run'], worker_name,
+                options['workers'], options['per_host'],
+                options['batch_size'], transport)
+        elif options['coordinator']:
+            shard.coordinate(cookie, options['processes'],
+                lambda run, i: self.spawn_worker(cookie, run, i, options),
+                options['workers'], options['per_host'],
+                options['incremental'], transport, options['resume'])
+        elif options['replay_failed']:
+            scrape.replay_failed(cookie, options['workers'],
+                options['per_host'], options['batch_size'], transport)
+        elif options['pipeline']:
+            pipeline.scrape_pipeline(cookie, options['workers'],
+                options['per_host'], options['queue_size'],
+                options['incremental'], options['batch_size'], transport,
+                options['resume'])
+        else:
+            scrape.scrape(cookie, options['workers'], options['per_host'],
+                options['incremental'], options['batch_size'], transport,
+                options['resume'])
         self.stdout.write('Done scraping!')
+
+    # Starts `manage.py scrape --worker` for run in a new process, passing on
+    # the options that matter to a worker.  The cookie goes in its
+    # environment, where other users can't see it.
+    def spawn_worker(self, cookie, run, i, options):
+        args = [sys.executable, os.path.abspath(sys.argv[0]), 'scrape',
+            '--worker', '--run', str(run.pk),
+            '--worker-name', '{0}-{1}'.format(socket.gethostname(), i),
+            '--workers', str(options['workers']),
+            '--per-host', str(options['per_host']),
+            '--batch-size', str(options['batch_size']),
+            '--transport', options['transport'],
+            '--pool-size', str(options['pool_size']),
+            '--log-level', options['log_level']]
+        if options['fixtures']:
+            args = args + ['--fixtures', options['fixtures'],
+                '--fixture-latency', str(options['fixture_latency'])]
+        if options['page_store']:
+            args = args + ['--page-store', options['page_store']]
+        args = args + ['--metrics-file', options['metrics_file'] or '']
+        env = dict(os.environ)
+        env[COOKIE_VARIABLE] = cookie
+        return subprocess.Popen(args, env=env)
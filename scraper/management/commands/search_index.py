@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from scraper import search
+
+class Command(BaseCommand):
+    args = '[query]'
+    help = 'Searches course comments, or rebuilds their search index'
+    option_list = BaseCommand.option_list + (
+        make_option('--rebuild', action='store_true', dest='rebuild',
+            default=False,
+            help='Index every comment in the database from scratch'),
+        make_option('--field', dest='field', default=None,
+            help='Only comments on courses in this field'),
+        make_option('--year', type='int', dest='year', default=None,
+            help='Only comments from this year'),
+        make_option('--term', type='int', dest='term', default=None,
+            help='Only comments from this term (1 = Fall, 2 = Spring)'),
+        make_option('--limit', type='int', dest='limit', default=20,
+            help='Most comments to show'),
+    )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = search.rebuild_index()
+            self.stdout.write('Indexed {0} comments'.format(count))
+        if not args:
+            return
+        try:
+            results = search.search_comments(' '.join(args),
+                options['field'], options['year'], options['term'],
+                options['limit'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        for r in results:
+            self.stdout.write('{0:8.3f}  {1} {2}-{3} #{4}: {5}'.format(
+                r['score'], r['field'], r['year'], r['term'],
+                r['course_instance_id'], r['snippet']))
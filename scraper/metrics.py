@@ -0,0 +1,180 @@
+################################################################################
+# Run metrics: the counters of counters.py plus timers.  Every timer keeps     #
+# the number of calls, the total and longest seconds and a histogram of how    #
+# long the calls took, so a run shows where its time went: downloading,        #
+# parsing or saving.  summary() is logged when a run finishes, and a           #
+# MetricsFile writes everything in Prometheus' text format every few seconds   #
+# while the run is going, for node_exporter's textfile collector (or cat).     #
+################################################################################
+
+from contextlib import contextmanager
+import os
+import re
+import threading
+import time
+
+from counters import Counters
+
+# Upper bounds, in seconds, of the histogram buckets of every timer.  Calls
+# slower than the last go in one more bucket.
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+class Metrics(Counters):
+    def __init__(self):
+        Counters.__init__(self)
+        self.timers = {}
+        self.started = time.time()
+
+    # Records a call to the stage name that took seconds
+    def observe(self, name, seconds):
+        bucket = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                bucket = i
+                break
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = new_timer()
+            timer['calls'] += 1
+            timer['seconds'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            timer['buckets'][bucket] += 1
+
+    # Times the block as a call to the stage name
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    # Returns a copy of every timer: name -> dict of calls, seconds, max and
+    # buckets (calls per bucket of BUCKETS, not cumulative)
+    def timings(self):
+        with self.lock:
+            return dict((name, dict(timer, buckets=list(timer['buckets'])))
+                for name, timer in self.timers.items())
+
+    # Adds timings from another process's timings()
+    def add_timings(self, timings):
+        with self.lock:
+            for name, other in timings.items():
+                timer = self.timers.get(name)
+                if timer is None:
+                    timer = self.timers[name] = new_timer()
+                timer['calls'] += other['calls']
+                timer['seconds'] += other['seconds']
+                timer['max'] = max(timer['max'], other['max'])
+                timer['buckets'] = [x + y
+                    for x, y in zip(timer['buckets'], other['buckets'])]
+
+    def reset(self):
+        Counters.reset(self)
+        with self.lock:
+            self.timers = {}
+            self.started = time.time()
+
+    # One line per timer, the most time first: calls, total seconds, mean,
+    # median and 95th percentile milliseconds (to the bucket) and longest
+    # milliseconds
+    def summary(self):
+        timings = self.timings()
+        lines = ['{0:24} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+            'stage', 'calls', 'seconds', 'mean ms', 'p50 ms', 'p95 ms',
+            'max ms')]
+        for name in sorted(timings, key=lambda x: -timings[x]['seconds']):
+            t = timings[name]
+            lines.append(('{0:24} {1:8d} {2:10.3f} {3:9.1f} {4:>9} {5:>9} ' +
+                '{6:9.1f}').format(name, t['calls'], t['seconds'],
+                1000 * t['seconds'] / t['calls'],
+                quantile_ms(t['buckets'], 0.5),
+                quantile_ms(t['buckets'], 0.95), 1000 * t['max']))
+        return lines
+
+    # Everything in Prometheus' text exposition format, names starting with
+    # prefix: a counter per counter, a histogram of seconds labelled by stage
+    # and how long the run has been going
+    def prometheus(self, prefix='scraper'):
+        counters = self.snapshot()
+        timings = self.timings()
+        lines = [
+            '# TYPE {0}_run_seconds gauge'.format(prefix),
+            '{0}_run_seconds {1:.3f}'.format(prefix,
+                time.time() - self.started),
+        ]
+        for name in sorted(counters):
+            metric = '{0}_{1}_total'.format(prefix, metric_name(name))
+            lines.append('# TYPE {0} counter'.format(metric))
+            lines.append('{0} {1}'.format(metric, counters[name]))
+        if timings:
+            metric = prefix + '_stage_seconds'
+            lines.append('# TYPE {0} histogram'.format(metric))
+        for name in sorted(timings):
+            t = timings[name]
+            total = 0
+            for bound, n in zip(BUCKETS + ['+Inf'], t['buckets']):
+                total += n
+                lines.append('{0}_bucket{{stage="{1}",le="{2}"}} {3}'.format(
+                    metric, name, bound, total))
+            lines.append('{0}_sum{{stage="{1}"}} {2:.6f}'.format(metric, name,
+                t['seconds']))
+            lines.append('{0}_count{{stage="{1}"}} {2}'.format(metric, name,
+                t['calls']))
+        return '\n'.join(lines) + '\n'
+
+def new_timer():
+    return {'calls': 0, 'seconds': 0.0, 'max': 0.0,
+        'buckets': [0] * (len(BUCKETS) + 1)}
+
+# The bucket bound (in milliseconds) at or below which fraction q of the calls
+# fell, or '>' the last bound
+def quantile_ms(buckets, q):
+    total = 0
+    for i, n in enumerate(buckets):
+        total += n
+        if total >= q * sum(buckets):
+            if i == len(BUCKETS):
+                break
+            return '{0:g}'.format(1000 * BUCKETS[i])
+    return '>{0:g}'.format(1000 * BUCKETS[-1])
+
+def metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+# Writes metrics.prometheus() to filename every interval seconds from a
+# background thread, and once more when stopped.  Each write replaces the file
+# in one rename, so readers never see half of it.
+class MetricsFile(object):
+    def __init__(self, metrics, filename, interval=15):
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
+
+    def write(self):
+        temp = self.filename + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.metrics.prometheus())
+        os.rename(temp, self.filename)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+# The metrics of the run in progress, shared by scrape.py and writer.py
+RUN_METRICS = Metrics()
@@ -1,7 +1,11 @@
+import hashlib
+
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
+# The original ratings table, kept so migrate_ratings can copy it into
+# CourseRating and InstructorRating.  Nothing writes to it any more.
 class Rating(models.Model):
     content_type = models.ForeignKey(ContentType)
     object_id = models.PositiveIntegerField()
@@ -23,6 +27,42 @@ class Rating(models.Model):
     # class Meta:
     #     unique_together = ('object_id', 'category')
 
+# A question rated on the Q guide ("Course Overall", "Workload (hours per
+# week)", ...).  Names can be longer than MySQL will index, so they're unique
+# by their SHA-1 instead.
+class RatingCategory(models.Model):
+    name = models.CharField(max_length=1024)
+    digest = models.CharField(max_length=40, unique=True)
+
+    def __unicode__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        self.digest = category_digest(self.name)
+        super(RatingCategory, self).save(*args, **kwargs)
+
+def category_digest(name):
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return hashlib.sha1(name).hexdigest()
+
+# What's recorded for every rated category
+class RatingValues(models.Model):
+    category      = models.ForeignKey(RatingCategory)
+    value         = models.DecimalField(decimal_places=2, max_digits=5, null=True)
+    num_responses = models.PositiveIntegerField()
+    ones          = models.IntegerField()
+    twos          = models.IntegerField()
+    threes        = models.IntegerField()
+    fours         = models.IntegerField()
+    fives         = models.IntegerField()
+
+    def __unicode__(self):
+        return self.category.name + ": " + str(self.value)
+
+    class Meta:
+        abstract = True
+
 class Field(models.Model):
     abbreviation = models.CharField(max_length=255, unique=True)
     name = models.CharField(max_length=255)
@@ -54,7 +94,6 @@ class CourseInstance(models.Model):
     evaluations = models.IntegerField()
     response_rate = models.DecimalField(decimal_places=2, null=True, 
         max_digits=8, db_column='ResponseRate', blank=True)
-    ratings = generic.GenericRelation(Rating)
 
     def __unicode__(self):
         return self.course.field.__unicode__() +' '+self.course.number+': '+self.course.title
@@ -127,7 +166,6 @@ class Instructor(models.Model):
 class InstructorCourseInstanceRelation(models.Model):
     instructor = models.ForeignKey(Instructor)
     course_instance = models.ForeignKey(CourseInstance)
-    ratings = generic.GenericRelation(Rating)
 
     def __unicode__(self):
         return self.instructor.first + ' ' + self.instructor.last
@@ -135,6 +173,21 @@ class InstructorCourseInstanceRelation(models.Model):
     class Meta:
         unique_together = ('instructor', 'course_instance')
 
+# The unique index on (course_instance, category) also serves every lookup of
+# a course instance's ratings
+class CourseRating(RatingValues):
+    course_instance = models.ForeignKey(CourseInstance, related_name='ratings')
+
+    class Meta:
+        unique_together = ('course_instance', 'category')
+
+class InstructorRating(RatingValues):
+    instructor_relation = models.ForeignKey(InstructorCourseInstanceRelation,
+        related_name='ratings')
+
+    class Meta:
+        unique_together = ('instructor_relation', 'category')
+
 # class InstructorInstance(models.Model):
 #     instructor = models.ForeignKey(Instructor)
 #     course = models.ForeignKey(Course)
@@ -145,3 +198,167 @@ class InstructorCourseInstanceRelation(models.Model):
 
     # class Meta:
     #     unique_together('instructor', 'course')
+
+# Ledger of scrape runs, used by incremental scrapes to find what has already
+# been scraped
+class ScrapeRun(models.Model):
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True)
+    incremental = models.BooleanField(default=False)
+    succeeded = models.BooleanField(default=False)
+
+    def __unicode__(self):
+        return 'Run {0} ({1})'.format(self.pk, self.started)
+
+# A term every course of which was saved by a successful run
+class ScrapedTerm(models.Model):
+    year = models.IntegerField()
+    term = models.IntegerField()
+    run = models.ForeignKey(ScrapeRun)
+
+    def __unicode__(self):
+        return '{0} {1}'.format(self.year, self.term)
+
+    class Meta:
+        unique_together = ('year', 'term')
+
+# Hash of the summary page a course instance was last saved from, so
+# incremental scrapes can tell whether it changed, and the run that saved it,
+# so a resumed run can skip it
+class ScrapedCourse(models.Model):
+    qcourse_id = models.IntegerField(unique=True)
+    fingerprint = models.CharField(max_length=40)
+    run = models.ForeignKey(ScrapeRun, null=True)
+
+    def __unicode__(self):
+        return str(self.qcourse_id)
+
+# A department of a term every course of which was saved by a run, so a
+# resumed run can skip it
+class ScrapedDept(models.Model):
+    run = models.ForeignKey(ScrapeRun)
+    year = models.IntegerField()
+    term = models.IntegerField()
+    dept = models.CharField(max_length=200)
+
+    def __unicode__(self):
+        return '{0} {1} {2}'.format(self.year, self.term, self.dept)
+
+    class Meta:
+        unique_together = ('run', 'year', 'term', 'dept')
+
+# A department of a term in a sharded run.  The coordinator queues one per
+# department and worker processes, which may be on other machines, claim them
+# one at a time.
+class WorkUnit(models.Model):
+    PENDING = 'pending'
+    CLAIMED = 'claimed'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATE_CHOICES = (
+        (PENDING, 'Pending'),
+        (CLAIMED, 'Claimed'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    run = models.ForeignKey(ScrapeRun)
+    year = models.IntegerField()
+    term = models.IntegerField()
+    dept = models.CharField(max_length=200)
+    refresh = models.BooleanField(default=False)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES,
+        default=PENDING, db_index=True)
+    worker = models.CharField(max_length=255, blank=True)
+    claimed_at = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return '{0} {1} {2} ({3})'.format(self.year, self.term, self.dept,
+            self.state)
+
+    class Meta:
+        unique_together = ('run', 'year', 'term', 'dept')
+
+# Ratings of one category summed over a group of CourseRatings or
+# InstructorRatings in a term, so means and variances are a row lookup.  See
+# stats.py.
+class RatingTotals(models.Model):
+    year = models.IntegerField()
+    term = models.IntegerField()
+    category = models.ForeignKey(RatingCategory)
+    # Course instances (or instructor relations) the ratings came from
+    rated = models.IntegerField()
+    num_responses = models.IntegerField()
+    ones = models.IntegerField()
+    twos = models.IntegerField()
+    threes = models.IntegerField()
+    fours = models.IntegerField()
+    fives = models.IntegerField()
+    # Ratings with a value, and the sum of their values
+    value_count = models.IntegerField()
+    value_sum = models.FloatField()
+
+    # Responses in the histogram
+    def responses(self):
+        return self.ones + self.twos + self.threes + self.fours + self.fives
+
+    # Mean of the histogram's scores (1 to 5), or None with no responses
+    def mean(self):
+        n = self.responses()
+        if not n:
+            return None
+        return float(self.ones + 2 * self.twos + 3 * self.threes +
+            4 * self.fours + 5 * self.fives) / n
+
+    def variance(self):
+        n = self.responses()
+        if not n:
+            return None
+        squares = float(self.ones + 4 * self.twos + 9 * self.threes +
+            16 * self.fours + 25 * self.fives) / n
+        return squares - self.mean() ** 2
+
+    # Mean of the ratings' own values, which for some categories (workload)
+    # aren't on the 1 to 5 scale
+    def value_mean(self):
+        if not self.value_count:
+            return None
+        return self.value_sum / self.value_count
+
+    def __unicode__(self):
+        return '{0} {1} {2}: {3}'.format(self.year, self.term,
+            self.category.name, self.mean())
+
+    class Meta:
+        abstract = True
+
+# A course's ratings in a term, over all its instances
+class CourseStats(RatingTotals):
+    course = models.ForeignKey(Course)
+
+    class Meta:
+        unique_together = ('course', 'year', 'term', 'category')
+
+# An instructor's ratings in a term, over all the courses they taught
+class InstructorStats(RatingTotals):
+    instructor = models.ForeignKey(Instructor)
+
+    class Meta:
+        unique_together = ('instructor', 'year', 'term', 'category')
+
+# The course ratings of a field's courses in a term
+class FieldStats(RatingTotals):
+    field = models.ForeignKey(Field)
+
+    class Meta:
+        unique_together = ('field', 'year', 'term', 'category')
+
+# A refresh of the stats tables, which covered every run up to run
+class StatsRefresh(models.Model):
+    run = models.ForeignKey(ScrapeRun, null=True)
+    refreshed = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return 'Stats as of run {0} ({1})'.format(self.run_id, self.refreshed)
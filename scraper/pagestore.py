@@ -0,0 +1,186 @@
+################################################################################
+# Single-file store for downloaded Q guide pages.  Pages live in one SQLite   #
+# table keyed by path, optionally compressed, along with when they were       #
+# fetched, the HTTP status and whether they passed validation.               #
+#                                                                              #
+# Each page also keeps the ETag and Last-Modified the server sent with it and #
+# when it was last confirmed unchanged, so it can be revalidated with a       #
+# conditional GET instead of downloaded again.                                #
+################################################################################
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS pages (
+    path TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    codec TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    status INTEGER,
+    valid INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    checked_at REAL
+)'''
+
+# Columns added to SCHEMA since page stores were first made, and their types.
+# Older stores get them added when they're opened.
+ADDED_COLUMNS = [
+    ('etag', 'TEXT'),
+    ('last_modified', 'TEXT'),
+    ('checked_at', 'REAL'),
+]
+
+# What the name of a page saved one file per path looks like: a Q guide page
+# and its query string, with no directories.  Anything else in a data
+# directory (page stores, the search index, exports, benchmark corpora) isn't
+# a page.
+PAGE_FILE_REGEX = re.compile(r'^[\w\-\.]+\?[^/]*$')
+
+# Compression codecs: name -> (compress, decompress)
+CODECS = {
+    'none': (lambda x: x, lambda x: x),
+    'zlib': (lambda x: zlib.compress(x, 6), zlib.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (zstandard.ZstdCompressor().compress,
+        zstandard.ZstdDecompressor().decompress)
+
+class PageStore(object):
+    # filename - SQLite file to keep pages in
+    # codec - 'none', 'zlib' or 'zstd' (needs the zstandard package); only
+    #     affects new pages, since each page records the codec it was saved with
+    def __init__(self, filename, codec='zlib'):
+        if codec not in CODECS:
+            raise ValueError('Unknown page store codec {0}'.format(codec))
+        self.filename = filename
+        self.codec = codec
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False,
+            isolation_level=None)
+        self.conn.text_factory = str
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(SCHEMA)
+        columns = set(row[1] for row in
+            self.conn.execute('PRAGMA table_info(pages)'))
+        for name, kind in ADDED_COLUMNS:
+            if name not in columns:
+                self.conn.execute('ALTER TABLE pages ADD COLUMN {0} {1}'\
+                    .format(name, kind))
+
+    # Returns the contents of path, or None if it isn't stored or failed
+    # validation
+    def get(self, path):
+        with self.lock:
+            row = self.conn.execute('SELECT body, codec FROM pages ' +
+                'WHERE path = ? AND valid = 1', (path,)).fetchone()
+        if row is None:
+            return None
+        return CODECS[row[1]][1](str(row[0]))
+
+    # Saves contents under path, replacing whatever was there
+    #
+    # etag, last_modified - the response's validators, if it had any
+    def put(self, path, contents, status=200, valid=True, etag=None,
+            last_modified=None):
+        body = sqlite3.Binary(CODECS[self.codec][0](contents))
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO pages ' +
+                '(path, body, codec, fetched_at, status, valid, etag, ' +
+                'last_modified, checked_at) ' +
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, body, self.codec, now, status, int(valid), etag,
+                 last_modified, now))
+
+    # Returns (etag, last_modified, when it was last downloaded or confirmed
+    # unchanged) for a valid page, or None if it isn't stored or failed
+    # validation.  Either validator may be None.
+    def validators(self, path):
+        with self.lock:
+            return self.conn.execute('SELECT etag, last_modified, ' +
+                'COALESCE(checked_at, fetched_at) FROM pages ' +
+                'WHERE path = ? AND valid = 1', (path,)).fetchone()
+
+    # Records that the server confirmed path hasn't changed.  Returns False if
+    # path isn't stored.
+    def touch(self, path):
+        with self.lock:
+            cursor = self.conn.execute('UPDATE pages SET checked_at = ? ' +
+                'WHERE path = ?', (time.time(), path))
+        return cursor.rowcount > 0
+
+    # Marks a page as failing validation, so get() ignores it but the
+    # contents are kept for inspection.  Returns False if path isn't stored.
+    def invalidate(self, path):
+        with self.lock:
+            cursor = self.conn.execute('UPDATE pages SET valid = 0 ' +
+                'WHERE path = ?', (path,))
+        return cursor.rowcount > 0
+
+    def delete(self, path):
+        with self.lock:
+            self.conn.execute('DELETE FROM pages WHERE path = ?', (path,))
+
+    # Returns a dict of path, fetched_at, status, valid, etag, last_modified
+    # and checked_at for a page, or None
+    def info(self, path):
+        names = ['path', 'fetched_at', 'status', 'valid', 'etag',
+            'last_modified', 'checked_at']
+        with self.lock:
+            row = self.conn.execute('SELECT {0} FROM pages '.format(
+                ', '.join(names)) + 'WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(names, row))
+
+    # Paths of the valid pages, optionally only those starting with prefix
+    def paths(self, prefix=''):
+        with self.lock:
+            rows = self.conn.execute('SELECT path FROM pages ' +
+                'WHERE valid = 1 AND substr(path, 1, ?) = ? ORDER BY path',
+                (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # Imports the old one-file-per-page cache: the files directly in data_dir
+    # named like pages (see PAGE_FILE_REGEX).  validate is called with each
+    # page's contents and decides its valid flag.  Returns the number of pages
+    # imported.
+    def import_dir(self, data_dir, validate=lambda x: True):
+        count = 0
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                for path in sorted(os.listdir(data_dir)):
+                    filename = os.path.join(data_dir, path)
+                    if not PAGE_FILE_REGEX.match(path) or \
+                            not os.path.isfile(filename):
+                        continue
+                    with open(filename) as f:
+                        contents = f.read()
+                    body = sqlite3.Binary(CODECS[self.codec][0](contents))
+                    self.conn.execute('INSERT OR REPLACE INTO pages ' +
+                        '(path, body, codec, fetched_at, status, valid) ' +
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (path, body, self.codec, os.path.getmtime(filename),
+                         None, int(validate(contents))))
+                    count += 1
+                self.conn.execute('COMMIT')
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+        return count
@@ -0,0 +1,202 @@
+################################################################################
+# Parsers for Q guide pages.  Every XPath expression and regex is compiled    #
+# once, at import.  Each table is read in a single walk over its rows, and    #
+# each page gets at most one regex pass.  The functions only read pages;      #
+# scrape.py does the logging and the fetching and builds the course dicts.    #
+################################################################################
+
+import re
+from StringIO import StringIO
+import threading
+
+from lxml import etree
+
+COURSE_ID_REGEX = re.compile(r'\?course_id=(\d*)')
+# (FIELD) (COURSE_NUMBER) (COURSE_TITLE)
+COURSE_INFO_REGEX = re.compile(r'([\w\-\&]+)\s([\w\.\-]+):\s+(.*)')
+PROF_ID_REGEX = re.compile(r'([a-zA-Z\d]+):')
+SCORE_BAR_REGEX = re.compile(r'\.\.\/bar_1to5-([\d\.]+)\.png')
+HISTOGRAM_REGEX = re.compile(r'\.\.\/histogram\-(\d+)\-(\d+)\-(\d+)\-' +
+    r'(\d+)\-(\d+)\-\d*\.jpg')
+# A histogram image, or the empty one the Q guide sometimes serves instead
+# (whose groups are all None)
+HISTOGRAM_PAGE_REGEX = re.compile(r'\.\.\/histogram\-(?:(\d+)\-(\d+)\-' +
+    r'(\d+)\-(\d+)\-(\d+)\-\d*|\-\-\-\-\-)\.jpg')
+# Total responses, the mean, or one count of the breakdown (n=...)
+PIE_CHART_REGEX = re.compile(r'Total Responses:\s+(\d+)|Mean:\s+([\d\.]+)|' +
+    r'\(n=(\d+)\)')
+SUMMARY_STATS_REGEX = re.compile(r'Enrollment:\s*\n*\s*(\d*)\s*\n*\s*' +
+    'Evaluations:\s*\n*\s*(\d*)\s*\n*\s*' +
+    'Response Rate:\s*\n*\s*([\d\.]*)%\s*\n*\s*')
+NO_COMMENTS_REGEX = re.compile(r'The response\(s\) to this question are not' +
+    ' available\. This is due to one of the following reasons\:')
+
+DEPT_XPATH = etree.XPath('''//div[@class="displayed_courses"]
+    //span[@class="course-block-title"]''')
+LINK_XPATH = etree.XPath('//a')
+SUMMARY_STATS_XPATH = etree.XPath('//div[@id="summaryStats"]')
+TABLE_XPATH = etree.XPath('//div[@id="reportContent"]/table')
+ROW_XPATH = etree.XPath('.//tr')
+PROF_XPATH = etree.XPath(
+    '//select[@name="current_instructor_or_tf_huid_param"]/option')
+COMMENT_XPATH = etree.XPath(
+    '//div[@id="responseBlock"]/div[@class="response"]/p')
+
+# lxml parsers can't be shared between threads, so each thread gets its own
+LOCAL = threading.local()
+
+# Parses a page into an lxml tree, whose root is None if the page is empty
+def parse_html(html):
+    parser = getattr(LOCAL, 'parser', None)
+    if parser is None:
+        parser = LOCAL.parser = etree.HTMLParser()
+    return etree.parse(StringIO(html), parser)
+
+# Department names on a term's department list
+def dept_names(tree):
+    return [span.get('title') for span in DEPT_XPATH(tree)]
+
+# (course id, field, number, title) of every course on a department's course
+# list
+def course_links(tree):
+    links = []
+    for link in LINK_XPATH(tree):
+        info = COURSE_INFO_REGEX.match(link.text)
+        links.append((int(COURSE_ID_REGEX.findall(link.get('href'))[0]),
+            info.group(1), info.group(2), info.group(3)))
+    return links
+
+# (enrollment, evaluations, response rate) from a course summary page, or None
+# if the page has no data
+def summary_stats(tree):
+    divs = SUMMARY_STATS_XPATH(tree)
+    if not divs:
+        return None
+    stats = SUMMARY_STATS_REGEX.findall(divs[0].text)[0]
+    return int(stats[0]), int(stats[1]), float(stats[2])
+
+def report_tables(tree):
+    return TABLE_XPATH(tree)
+
+# Reads a table of score bars.  Returns a row dict of category,
+# num_responses, value (None if there's no score bar), scores (the five
+# counts, if the histogram is drawn in the row) and histogram_url (the page
+# with the histogram) for every row between the header and the last two.
+def standard_table_rows(table):
+    rows = []
+    for row in ROW_XPATH(table)[1:-2]:
+        cells = [cell for cell in row if cell.tag == 'td']
+        category = cells[0].find('strong').text
+        if category == 'Workload (hours per week)':
+            category = 'Workload'
+        value = None
+        scores = None
+        histogram_url = None
+        # One walk over the cells finds the score bar, the histogram link and
+        # the histogram, if newer pages draw it right in the row
+        for i, cell in enumerate(cells):
+            for element in cell.iter():
+                if not isinstance(element.tag, basestring):
+                    continue
+                if i == 2 and value is None and element.tag == 'img':
+                    value = float(SCORE_BAR_REGEX.match(element.get('src'))\
+                        .group(1))
+                elif i == 3 and histogram_url is None and \
+                        element.tag == 'a':
+                    histogram_url = element.get('href')
+                if scores is None:
+                    for attribute in element.values():
+                        match = HISTOGRAM_REGEX.search(attribute)
+                        if match:
+                            scores = match.groups()
+                            break
+        rows.append({
+            'category':      category,
+            'num_responses': int(cells[1].text),
+            'value':         value,
+            'scores':        scores,
+            'histogram_url': histogram_url,
+        })
+    return rows
+
+# Reads the first two rows of the pie chart table.  Returns a dict of
+# category, num_responses (None if the row has no responses), value and
+# scores (the five counts) for each row that has a category.
+def pie_chart_rows(table):
+    rows = []
+    for row in [row for row in table if row.tag == 'tr'][0:2]:
+        strong = row.find('.//strong')
+        if strong is None:
+            continue
+        total = None
+        mean = None
+        scores = []
+        for match in PIE_CHART_REGEX.finditer(row_text(row)):
+            if match.group(1) is not None:
+                if total is None:
+                    total = int(match.group(1))
+            elif match.group(2) is not None:
+                if mean is None:
+                    mean = float(match.group(2))
+            else:
+                scores.append(int(match.group(3)))
+        rows.append({
+            'category':      strong.text,
+            'num_responses': total,
+            'value':         mean,
+            'scores':        scores[:5],
+        })
+    return rows
+
+# The text and attribute values of an element and everything in it, in the
+# order they appear in the page, which is what the pie chart numbers are
+# spread over
+def row_text(row):
+    parts = []
+    add_text(row, parts)
+    return ' '.join(parts)
+
+# Adds an element's attribute values and text to parts, then each child's,
+# each followed by the child's tail (the text after it, which comes after
+# everything inside it)
+def add_text(element, parts):
+    if isinstance(element.tag, basestring):
+        parts.extend(element.values())
+    if element.text:
+        parts.append(element.text)
+    for child in element:
+        add_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+# (reason, number of students) for every row of the reasons table
+def reason_rows(table):
+    reasons = []
+    for row in [row for row in table if row.tag == 'tr'][1:]:
+        cells = [cell for cell in row if cell.tag == 'td']
+        reasons.append((cells[-1].text, int(cells[-2].text)))
+    return reasons
+
+# (option value, prof_id, name as "Last, First", whether it's selected) for
+# every instructor on an instructor page's select list
+def instructor_options(tree):
+    return [(option.get('value'),
+        PROF_ID_REGEX.findall(option.get('value'))[0], option.text,
+        option.get('selected') is not None) for option in PROF_XPATH(tree)]
+
+# The five counts shown on a histogram page, or None if it shows the empty
+# histogram or none at all
+def read_histogram(html):
+    scores = None
+    for match in HISTOGRAM_PAGE_REGEX.finditer(html):
+        if match.group(1) is None:
+            return None
+        if scores is None:
+            scores = match.groups()
+    return scores
+
+def has_comments(html):
+    return NO_COMMENTS_REGEX.search(html) is None
+
+def comment_texts(tree):
+    return [p.text for p in COMMENT_XPATH(tree)]
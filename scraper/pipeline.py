@@ -0,0 +1,199 @@
+################################################################################
+# Pipelined scraping.  Splits a scrape into three stages joined by bounded    #
+# queues:                                                                      #
+#                                                                              #
+#   fetch   - walks terms and departments, downloading each course's pages    #
+#   parse   - turns the pages into course dicts (fetching histograms)         #
+#   persist - saves the course dicts to the database                          #
+#                                                                              #
+# Each stage has its own thread, so downloads, lxml parsing and database      #
+# writes overlap.  A full queue blocks the stage feeding it, which keeps      #
+# memory flat however many terms are scraped.                                 #
+################################################################################
+
+import Queue
+import sys
+import threading
+import time
+import traceback
+
+from qscraper import settings
+from scrape import *
+
+# Put on a queue after a stage's last item
+DONE = object()
+
+# Raised inside a stage when a later stage has given up
+class Stopped(Exception):
+    pass
+
+# Put on a queue in place of an item when a stage fails
+class Failure(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+# Put on a queue after the last course of a department
+class DeptDone(object):
+    def __init__(self, year, term, dept):
+        self.year = year
+        self.term = term
+        self.dept = dept
+
+# Put on a queue after the last course of a term, if every department's
+# course list was fetched
+class TermDone(object):
+    def __init__(self, year, term):
+        self.year = year
+        self.term = term
+
+# Same as scrape.scrape, but runs the fetch, parse and persist stages at the
+# same time
+#
+# queue_size - most courses waiting between two stages
+def scrape_pipeline(cookie, workers=settings.SCRAPER_WORKERS,
+        per_host=settings.SCRAPER_PER_HOST,
+        queue_size=settings.SCRAPER_QUEUE_SIZE, incremental=False,
+        batch_size=settings.SCRAPER_BATCH_SIZE, transport=None, resume=False):
+    fetcher = None
+    stop = threading.Event()
+    threads = []
+    try:
+        run = start_run(incremental, resume)
+        checkpoints = Checkpoints(run)
+        plan = plan_run(run, checkpoints)
+
+        # Django connections are per thread, so the database is only used
+        # from this one: the fetch stage is handed the fingerprints it needs
+        # to spot changed courses up front, and the persist stage runs here
+        fingerprints = None
+        if any(refresh for year, term, refresh in plan):
+            fingerprints = saved_fingerprints()
+
+        fetcher = make_fetcher(cookie, workers, per_host, transport)
+        fetched = Queue.Queue(queue_size)
+        parsed = Queue.Queue(queue_size)
+        threads = [
+            start_stage(fetch_stage, fetcher, plan, checkpoints, fingerprints,
+                fetched, stop),
+            start_stage(parse_stage, fetcher, fetched, parsed, stop),
+        ]
+        persist_stage(run, CourseWriter(batch_size, run), checkpoints, parsed,
+            stop)
+
+        finish_run(run)
+        log('DONE!')
+    except CookieExpired:
+        log_error('Cookie no longer valid; run scrape --resume with a new ' +
+            'one to carry on', 'GENERAL')
+    except Exception as e:
+        log_error('{0} - {1}\n{2}'.format(e.__class__, e, traceback.format_exc()), 'GENERAL')
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        if fetcher is not None:
+            fetcher.close()
+        send_alerts()
+
+def start_stage(stage, *args):
+    t = threading.Thread(target=stage, args=args, name=stage.__name__)
+    t.daemon = True
+    t.start()
+    return t
+
+# Downloads the department lists, course lists and course pages, and queues
+# (course, pages) for the parse stage
+#
+# fingerprints - from saved_fingerprints, for the terms plan refreshes
+def fetch_stage(fetcher, plan, checkpoints, fingerprints, out, stop):
+    try:
+        dept_list_htmls = fetch_dept_lists(fetcher, plan)
+        for (year, term, refresh), dept_list_html in zip(plan, dept_list_htmls):
+            if dept_list_html is None:
+                continue
+            depts = parse_dept_list(dept_list_html)
+            failed = []
+            for dept, course_list, pages in fetch_course_lists(fetcher, depts,
+                    term, year, refresh, checkpoints, failed, fingerprints):
+                for item in zip(course_list, pages):
+                    put(out, item, stop)
+                put(out, DeptDone(year, term, dept), stop)
+            # A term with departments missing isn't finished
+            if not failed:
+                put(out, TermDone(year, term), stop)
+        put(out, DONE, stop)
+    except Stopped:
+        pass
+    except BaseException:
+        put_failure(out, stop)
+
+# Parses each course's pages into a course dict and queues it for the persist
+# stage
+def parse_stage(fetcher, inp, out, stop):
+    try:
+        counter = 1
+        while True:
+            item = get(inp, stop)
+            if item is DONE or isinstance(item, Failure):
+                put(out, item, stop)
+                return
+            if isinstance(item, (DeptDone, TermDone)):
+                put(out, item, stop)
+                continue
+            course, pages = item
+            put(out, scrape_course_data(fetcher, course, counter, pages), stop)
+            counter += 1
+    except Stopped:
+        pass
+    except BaseException:
+        put_failure(out, stop)
+
+# Saves course dicts through writer until the earlier stages are done,
+# committing at least once per department and recording finished departments
+# and terms in run's ledger.  Re-raises whatever made an earlier stage fail.
+def persist_stage(run, writer, checkpoints, inp, stop):
+    while True:
+        item = get(inp, stop)
+        if item is DONE:
+            writer.flush()
+            return
+        if isinstance(item, Failure):
+            writer.flush()
+            raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+        start = time.time()
+        if isinstance(item, DeptDone):
+            saved = writer.flush()
+            log('SAVED {0} COURSES'.format(saved), stage='persist',
+                duration=round(time.time() - start, 3))
+            checkpoints.finish_dept(item.year, item.term, item.dept)
+        elif isinstance(item, TermDone):
+            writer.flush()
+            finish_term(run, item.year, item.term)
+        elif writer.add(item):
+            log('SAVED BATCH OF COURSES', stage='persist',
+                duration=round(time.time() - start, 3))
+
+# Queue.put/get that give up once stop is set, so no stage blocks forever on
+# a stage that has died
+def put(queue, item, stop):
+    while True:
+        try:
+            queue.put(item, timeout=1)
+            return
+        except Queue.Full:
+            if stop.is_set():
+                raise Stopped()
+
+def get(queue, stop):
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Queue.Empty:
+            if stop.is_set():
+                raise Stopped()
+
+def put_failure(out, stop):
+    try:
+        put(out, Failure(sys.exc_info()), stop)
+    except Stopped:
+        pass
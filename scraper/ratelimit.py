@@ -0,0 +1,89 @@
+################################################################################
+# Adaptive rate limiting for page fetches.  Each host gets a token bucket     #
+# whose rate grows a little with every quick, successful download and is      #
+# cut when downloads get slow, fail, or come back as blank histogram pages    #
+# (the Q guide's way of saying it's being hit too hard).                      #
+################################################################################
+
+import threading
+import time
+
+class AdaptiveRateLimiter(object):
+    # rate - requests per second to start at
+    # min_rate, max_rate - bounds on the rate
+    # target_latency - seconds a download may take before the rate is eased off
+    # burst - most requests let through at once after an idle spell
+    # clock - function returning the time in seconds (tests give a fake one)
+    def __init__(self, rate=4.0, min_rate=0.5, max_rate=50.0,
+            target_latency=2.0, burst=1.0, clock=time.time):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.target_latency = target_latency
+        self.burst = float(burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.last_cut = 0
+        self.waiting = 0
+        # Moving averages, for stats()
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.cond = threading.Condition()
+
+    # Blocks until the bucket lets another request through
+    def acquire(self):
+        with self.cond:
+            self.waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    self.cond.wait((1 - self.tokens) / self.rate)
+            finally:
+                self.waiting -= 1
+
+    # Reports a request that worked and how many seconds it took
+    def success(self, latency):
+        with self.cond:
+            self.latency = 0.9 * self.latency + 0.1 * latency
+            self.error_rate = 0.9 * self.error_rate
+            if latency > self.target_latency:
+                self._cut(0.9)
+            else:
+                # Additive increase: about one more request per second for
+                # every second of quick successes
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+    # Reports a failed request or a throttled (blank) page
+    def failure(self):
+        with self.cond:
+            self.error_rate = 0.9 * self.error_rate + 0.1
+            self._cut(0.5)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'rate': round(self.rate, 2),
+                'waiting': self.waiting,
+                'latency': round(self.latency, 3),
+                'error_rate': round(self.error_rate, 3),
+            }
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst,
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Multiplicative decrease, at most once a second so that a burst of
+    # failures from requests already in flight only counts once
+    def _cut(self, factor):
+        now = self.clock()
+        if now - self.last_cut < 1:
+            return
+        self.last_cut = now
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * factor)
@@ -0,0 +1,140 @@
+################################################################################
+# Moving ratings out of the old generic Rating table.  Rating rows point at   #
+# their course instance or instructor relation through a content type and    #
+# object id, with no index on either and no way to keep a category from      #
+# being saved twice.  CourseRating and InstructorRating have a foreign key    #
+# each and a unique index on (rated row, category).                           #
+#                                                                              #
+# migrate_ratings copies the old rows over a chunk at a time.                 #
+# benchmark_ratings counts the queries and time it takes to read the same     #
+# ratings back from either schema.                                             #
+################################################################################
+
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+
+from models import *
+from writer import INSERT_BATCH, RATING_FIELDS, resolve_categories
+
+# Copies every Rating into CourseRating or InstructorRating, chunk_size rows
+# per transaction, so it can be stopped and run again.  A rating whose
+# category its course instance or relation already has is a duplicate and
+# isn't copied (the first one wins); one whose rated row is gone is an orphan.
+# Returns the number of ratings copied, duplicates and orphans.
+#
+# delete - delete each chunk of Rating rows once it's copied
+def migrate_ratings(chunk_size=5000, delete=False):
+    targets = {
+        ContentType.objects.get_for_model(CourseInstance).pk:
+            (CourseInstance, CourseRating, 'course_instance'),
+        ContentType.objects.get_for_model(InstructorCourseInstanceRelation).pk:
+            (InstructorCourseInstanceRelation, InstructorRating,
+                'instructor_relation'),
+    }
+    counts = {'copied': 0, 'duplicates': 0, 'orphans': 0}
+    category_ids = {}
+    last_pk = 0
+    while True:
+        with transaction.commit_on_success():
+            rows = list(Rating.objects.filter(pk__gt=last_pk).order_by('pk')\
+                .values_list('pk', 'content_type', 'object_id', 'category',
+                *RATING_FIELDS)[:chunk_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            resolve_categories(set(row[3] for row in rows), category_ids)
+
+            for content_type, (rated_model, model, key) in targets.items():
+                chunk = [row for row in rows if row[1] == content_type]
+                object_ids = set(row[2] for row in chunk)
+                rated = set(rated_model.objects.filter(pk__in=object_ids)\
+                    .values_list('pk', flat=True))
+                saved = set(model.objects.filter(**{key + '__in': rated})\
+                    .values_list(key, 'category'))
+                new = []
+                for row in chunk:
+                    object_id = row[2]
+                    category_id = category_ids[row[3]]
+                    if object_id not in rated:
+                        counts['orphans'] += 1
+                    elif (object_id, category_id) in saved:
+                        counts['duplicates'] += 1
+                    else:
+                        saved.add((object_id, category_id))
+                        values = dict(zip(RATING_FIELDS, row[4:]))
+                        values[key + '_id'] = object_id
+                        new.append(model(category_id=category_id, **values))
+                model.objects.bulk_create(new, INSERT_BATCH)
+                counts['copied'] += len(new)
+            counts['orphans'] += len([row for row in rows
+                if row[1] not in targets])
+
+            if delete:
+                Rating.objects.filter(pk__in=[row[0] for row in rows]).delete()
+    return counts
+
+# Reads the ratings of the newest instances course instances, and of their
+# instructors, from the old Rating table and from the new tables, one
+# instance at a time and all at once.  Returns [(what was read, rows,
+# queries, seconds)], the seconds being the best of repeat tries.
+def benchmark_ratings(instances=100, repeat=3):
+    cinst_ids = list(CourseInstance.objects.order_by('-pk')\
+        .values_list('pk', flat=True)[:instances])
+    irel_ids = list(InstructorCourseInstanceRelation.objects.filter(
+        course_instance__in=cinst_ids).values_list('pk', flat=True))
+    cinst_ct = ContentType.objects.get_for_model(CourseInstance)
+    irel_ct = ContentType.objects.get_for_model(
+        InstructorCourseInstanceRelation)
+
+    cases = [
+        ('course ratings, Rating, one at a time',
+            lambda: [list(Rating.objects.filter(content_type=cinst_ct,
+                object_id=pk)) for pk in cinst_ids]),
+        ('course ratings, CourseRating, one at a time',
+            lambda: [list(CourseRating.objects.filter(course_instance=pk)\
+                .select_related('category')) for pk in cinst_ids]),
+        ('course ratings, Rating, all at once',
+            lambda: [list(Rating.objects.filter(content_type=cinst_ct,
+                object_id__in=cinst_ids))]),
+        ('course ratings, CourseRating, all at once',
+            lambda: [list(CourseRating.objects.filter(
+                course_instance__in=cinst_ids).select_related('category'))]),
+        ('instructor ratings, Rating, one at a time',
+            lambda: [list(Rating.objects.filter(content_type=irel_ct,
+                object_id=pk)) for pk in irel_ids]),
+        ('instructor ratings, InstructorRating, one at a time',
+            lambda: [list(InstructorRating.objects.filter(
+                instructor_relation=pk).select_related('category'))
+                for pk in irel_ids]),
+        ('instructor ratings, Rating, all at once',
+            lambda: [list(Rating.objects.filter(content_type=irel_ct,
+                object_id__in=irel_ids))]),
+        ('instructor ratings, InstructorRating, all at once',
+            lambda: [list(InstructorRating.objects.filter(
+                instructor_relation__course_instance__in=cinst_ids)\
+                .select_related('category'))]),
+    ]
+    results = []
+    for name, read in cases:
+        best = None
+        for i in range(repeat):
+            lists, queries, seconds = count_queries(read)
+            best = seconds if best is None else min(best, seconds)
+        results.append((name, sum(len(x) for x in lists), queries, best))
+    return results
+
+# Calls fn and returns what it returned, the number of queries it made and
+# the seconds it took
+def count_queries(fn):
+    debug = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        before = len(connection.queries)
+        start = time.time()
+        result = fn()
+        seconds = time.time() - start
+        return result, len(connection.queries) - before, seconds
+    finally:
+        connection.use_debug_cursor = debug
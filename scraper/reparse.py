@@ -0,0 +1,162 @@
+################################################################################
+# Offline reparsing.  Walks the terms, departments and courses in the page    #
+# store and parses every course again in a pool of processes, so lxml work    #
+# uses every core.  The parsed course dicts stream back to this process in    #
+# order and are saved through a CourseWriter.  Nothing is downloaded: a page  #
+# missing from the store leaves its course unsaved and is reported as a miss. #
+################################################################################
+
+import logging
+from multiprocessing import Pool
+import os
+import traceback
+
+from django.db import connection
+
+from qscraper import settings
+from scrape import *
+
+# Courses sent to a parsing process at a time
+CHUNK_SIZE = 8
+# Start of the names of the parsing processes' log files
+PARSER_LOG_PREFIX = 'reparse-'
+
+# Stands in for a Fetcher with pages from the page store only.  Paths that
+# aren't stored are collected in .missing.
+class StoreFetcher(object):
+    def __init__(self, store):
+        self.store = store
+        self.missing = []
+
+    def get(self, path, refresh=False, validate=None, context=None):
+        contents = self.store.get(path)
+        if contents is not None and validate is not None and \
+                not validate(contents):
+            contents = None
+        if contents is None:
+            COUNTERS.add('pages_missing')
+            self.missing.append(path)
+            log_warning('Page not in the page store (path: {0})'.format(path),
+                'GENERAL', 'reparse')
+        return contents
+
+    def get_all(self, paths, refresh=False, validate=None, context=None):
+        return [self.get(path, refresh, validate) for path in paths]
+
+    def with_context(self, context):
+        return self
+
+    def stats(self):
+        return {}
+
+# Parses every course in the page store again with processes processes and
+# saves them over what's in the database.  Terms with no pages missing are
+# recorded in the run ledger.  Returns the run's counters, or None if it
+# failed.
+#
+# rebuild - empty the database first, so it ends up holding exactly what the
+#     page store does
+# misses - file to list the paths missing from the page store in, one per line
+def reparse(processes=settings.SCRAPER_PROCESSES,
+        batch_size=settings.SCRAPER_BATCH_SIZE, rebuild=False, misses=None):
+    pool = None
+    try:
+        if rebuild:
+            truncate_db()
+        COUNTERS.reset()
+        # Each parsing process logs under its pid, so without this every
+        # reparse would leave another set of files behind
+        remove_logs(PARSER_LOG_PREFIX)
+        abandon_unfinished_runs()
+        run = ScrapeRun.objects.create(incremental=not rebuild)
+        writer = CourseWriter(batch_size, run)
+        store = get_page_store()
+        fetcher = StoreFetcher(store)
+        missing = fetcher.missing
+        incomplete = set()
+
+        # Forked processes mustn't share the database connection
+        connection.close()
+        pool = Pool(processes, init_parser, (store.filename,
+            logging.getLevelName(LOGGER.getEffectiveLevel())))
+        courses = enumerate(stored_courses(fetcher, incomplete), 1)
+        for course, counts, timings, course_missing in \
+                pool.imap(parse_course, courses, CHUNK_SIZE):
+            for name, n in counts.items():
+                COUNTERS.add(name, n)
+            COUNTERS.add_timings(timings)
+            if course_missing:
+                missing.extend(course_missing)
+                incomplete.add((course['year'], course['term']))
+            saved = writer.add(course)
+            if saved:
+                COUNTERS.add('courses_saved', saved)
+                log('SAVED BATCH OF COURSES', stage='persist')
+        saved = writer.flush()
+        COUNTERS.add('courses_saved', saved)
+        log('SAVED {0} COURSES'.format(saved), stage='persist')
+        pool.close()
+        pool.join()
+        pool = None
+
+        for year, term in get_yearterms():
+            if (year, term) not in incomplete:
+                finish_term(run, year, term)
+        if misses is not None:
+            with open(misses, 'w') as f:
+                for path in missing:
+                    f.write(path + '\n')
+        errors = COUNTERS.get('parse_errors')
+        if errors:
+            log_error('{0} courses failed to parse; see the '.format(errors) +
+                'reparse-*.log files', 'GENERAL', 'reparse')
+        finish_run(run)
+        log('DONE!')
+        return COUNTERS.snapshot()
+    except Exception as e:
+        log_error('{0} - {1}\n{2}'.format(e.__class__, e, traceback.format_exc()), 'GENERAL')
+    finally:
+        if pool is not None:
+            pool.terminate()
+        send_alerts()
+
+# Yields a course dict for every course on the course lists in the page store,
+# newest term first.  Terms with a list page missing are added to incomplete.
+def stored_courses(fetcher, incomplete):
+    for year, term in get_yearterms():
+        dept_list_html = fetcher.get(dept_list_path(year, term))
+        if dept_list_html is None:
+            incomplete.add((year, term))
+            continue
+        for dept in parse_dept_list(dept_list_html):
+            course_list_html = fetcher.get(course_list_path(dept, term, year))
+            if course_list_html is None:
+                incomplete.add((year, term))
+                continue
+            for course in parse_course_list(course_list_html, term, year) or []:
+                yield course
+
+# Runs in each parsing process before its first course
+def init_parser(page_store, log_level):
+    # SQLite connections and the log writer thread don't survive a fork
+    use_page_store(page_store)
+    configure_logging(log_level,
+        '{0}{1}.'.format(PARSER_LOG_PREFIX, os.getpid()))
+    disable_alerts()
+
+# Parses one (counter, course dict) in a parsing process.  Returns the course
+# dict, the counters it bumped, its stage timings and the paths it found
+# missing.
+def parse_course(item):
+    counter, course = item
+    COUNTERS.reset()
+    fetcher = StoreFetcher(get_page_store())
+    try:
+        course = scrape_course_data(fetcher, course, counter,
+            fetcher.get_all(course_page_paths(course['id'])))
+    except Exception as e:
+        log_error('{0} - {1}\n{2}'.format(e.__class__, e, traceback.format_exc()), course['id'], 'reparse')
+        COUNTERS.add('parse_errors')
+        course['no_data'] = True
+        course.pop('fingerprint', None)
+    return course, COUNTERS.snapshot(), COUNTERS.timings(), fetcher.missing
@@ -0,0 +1,77 @@
+################################################################################
+# Retry policy and dead letters for page fetches.  The Fetcher retries a      #
+# failed path after an exponentially growing, jittered delay without tying    #
+# up a worker, and gives up on it after a fixed number of attempts.  Paths it #
+# gives up on go to the dead letters so they can be replayed later.           #
+################################################################################
+
+import json
+import os
+import random
+import threading
+import time
+
+# Raised when a page downloads fine but its contents are unusable, like a
+# histogram page with no histogram
+class InvalidPage(Exception):
+    pass
+
+class RetryPolicy(object):
+    # base_delay - seconds to wait before the first retry
+    # max_delay - longest wait between two attempts
+    # max_attempts - attempts at a path before it goes to the dead letters
+    # jitter - fraction of each delay that is randomized, so retries of many
+    #     paths that failed together don't all fire at once
+    def __init__(self, base_delay=2, max_delay=120, max_attempts=6,
+            jitter=0.5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+
+    # Seconds to wait after the given number of failed attempts
+    def delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def gave_up(self, attempts):
+        return attempts >= self.max_attempts
+
+# Paths that failed every attempt, kept one JSON object per line so a later
+# run can replay them.  Each entry has the path, the last error, the number
+# of attempts, when it gave up and the context it was fetched for (the
+# course dict basics, or None).
+class DeadLetters(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    def add(self, path, error, attempts, context=None):
+        entry = {
+            'path': path,
+            'error': '{0} - {1}'.format(error.__class__.__name__, error),
+            'attempts': attempts,
+            'time': time.time(),
+            'context': context,
+        }
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def entries(self):
+        with self.lock:
+            if not os.path.exists(self.filename):
+                return []
+            with open(self.filename) as f:
+                return [json.loads(line) for line in f if line.strip()]
+
+    # Returns every entry and empties the list.  Paths that fail again while
+    # being replayed are added back by the Fetcher.
+    def take(self):
+        with self.lock:
+            if not os.path.exists(self.filename):
+                return []
+            with open(self.filename) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            open(self.filename, 'w').close()
+        return entries
@@ -7,17 +7,36 @@
 
 from django.db import DatabaseError, IntegrityError
 from django.core import mail
-from lxml import etree
+from django.utils import timezone
 
+import hashlib
+import httplib
+import json
+import logging
 import os
 import re
-from StringIO import StringIO
-import sys
+import sqlite3
+import threading
 import time
 import traceback
 import urllib2
 
+from alerts import AlertDigest
+from checkpoint import Checkpoints, abandon_unfinished_runs, \
+    get_resumable_run
+from fetch import Fetcher
+from metrics import MetricsFile, RUN_METRICS
 from models import *
+from pagestore import PageStore
+import parse
+from ratelimit import AdaptiveRateLimiter
+from retry import DeadLetters, RetryPolicy
+import scrapelog
+from search import get_search_index
+from stats import refresh_stats
+from transport import FixtureTransport, HTTPSTransport, UrllibTransport
+from views import invalidate_api_cache
+from writer import CourseWriter, REASONS
 from qscraper import settings
 
 # Set up some constants
@@ -26,148 +45,516 @@ LOG_DIR = 'scraper/log/'
 ERROR_LOG = 'error.log'
 WARNING_LOG = 'warning.log'
 OUTPUT_LOG = 'output.log'
+JSON_LOG = 'output.jsonl'
 BASE_URL = "https://webapps.fas.harvard.edu/course_evaluation_reports/fas/"
-COURSE_ID_REGEX = re.compile(r'\?course_id=(\d*)')
-# (FIELD) (COURSE_NUMBER) (COURSE_TITLE)
-COURSE_INFO_REGEX = re.compile(r'([\w\-\&]+)\s([\w\.\-]+):\s+(.*)')
 DEPT_REGEX = re.compile(r'list\?dept=(.*?)#')
-PROF_ID_REGEX = re.compile(r'([a-zA-Z\d]+):')
-SCORE_BAR_REGEX = re.compile(r'\.\.\/bar_1to5-([\d\.]+)\.png')
-HISTOGRAM_REGEX = re.compile(r'\.\.\/histogram\-(\d+)\-(\d+)\-(\d+)\-' + 
-    r'(\d+)\-(\d+)\-\d*\.jpg')
-FAILED_HISTOGRAM_REGEX = re.compile(r'(\.\.\/histogram\-\-\-\-\-\-\.jpg)')
 PIN_LOGIN_REGEX = re.compile(r'Harvard University PIN Login')
 
-TOTAL_RESPONSES_REGEX = re.compile(r'Total Responses:\s+(\d+)')
-MEAN_REGEX = re.compile(r'Mean:\s+([\d\.]+)')
-BREAKDOWN_REGEX = re.compile(r'\(n=(\d+)\)')
-SUMMARY_STATS_REGEX = re.compile(r'Enrollment:\s*\n*\s*(\d*)\s*\n*\s*' + 
-    'Evaluations:\s*\n*\s*(\d*)\s*\n*\s*' + 
-    'Response Rate:\s*\n*\s*([\d\.]*)%\s*\n*\s*')
-NO_COMMENTS_REGEX = re.compile(r'The response\(s\) to this question are not' + 
-    ' available\. This is due to one of the following reasons\:')
-
-EMAIL_MESSAGE = '''Your scraper failed :(.  Here's the error message: 
+EMAIL_MESSAGE = '''Your scraper failed :(.  Here are the error messages: 
 {0}
+
 Enjoy your day!
 Love, 
 
 Josh'''
 
-# Main scraping script.  Creates opener, iterates through years/terms, 
+# Raised when the Q guide shows the PIN login instead of a page
+class CookieExpired(Exception):
+    pass
+
+LOGGER = logging.getLogger(scrapelog.LOGGER_NAME)
+LOG_WRITER = None
+ALERTS = None
+# Guards setting up LOG_WRITER and ALERTS
+LOG_LOCK = threading.Lock()
+
+# Counters and stage timers (see metrics.py) for the current run, logged by
+# finish_run and written to settings.SCRAPER_METRICS_FILE while it's going.
+# Stages are timed under these names:
+#
+# fetch - downloading a page, successful or not
+# page_store.get, page_store.put - reading and saving stored pages
+# parse.* - each parser in parse.py
+# persist.batch - saving a batch of courses in one transaction, including
+#     the persist.* steps inside it (see CourseWriter._save)
+# persist.index - adding a saved batch's comments to the search index
+#
+# Counters besides those below: pages_cached, pages_downloaded,
+# bytes_downloaded, fetch_failures and fetch_gave_up, and for refreshed pages
+# (see get_data_from_path), pages_not_modified (a 304 from the server) and
+# pages_fresh (not revalidated, per settings.SCRAPER_PAGE_TTLS).
+#
+# histograms_inline - breakdowns read off the summary page, each one a
+#     histogram page that didn't have to be fetched
+# histograms_fetched - histogram pages fetched
+# histograms_shared - breakdowns taken from a histogram page another rating
+#     of the same course (usually another instructor's) had already fetched
+# histograms_failed - histogram pages given up on
+COUNTERS = RUN_METRICS
+
+# Main scraping script.  Creates fetcher, iterates through years/terms, 
 # and calls scrape_course_list on each department listed
-def scrape(cookie):
+#
+# workers - number of pages downloaded at the same time
+# per_host - most simultaneous requests to the Q guide host
+# incremental - keep the database and only scrape terms and courses that are
+#     new or changed since they were last saved
+# batch_size - most courses saved in one transaction
+# transport - where pages come from (see transport.py); defaults to
+#     make_transport(cookie)
+# resume - carry on with the last run that didn't finish instead of starting
+#     a new one, skipping whatever it already saved
+def scrape(cookie, workers=settings.SCRAPER_WORKERS,
+        per_host=settings.SCRAPER_PER_HOST, incremental=False,
+        batch_size=settings.SCRAPER_BATCH_SIZE, transport=None, resume=False):
+    fetcher = None
     try:
-        # Clear the database
-        truncate_db()
-        clear_logs()
+        run = start_run(incremental, resume)
+        checkpoints = Checkpoints(run)
 
-        # Set up cookies
-        opener = urllib2.build_opener()
-        opener.addheaders.append(('Cookie', 'JSESSIONID=' + cookie))
+        fetcher = make_fetcher(cookie, workers, per_host, transport)
+        writer = CourseWriter(batch_size, run)
 
-        # Just one year for now
-        years = range(2006, 2013)
-        years.reverse()
-        # Term 1 = Fall, term 2 = Spring
-        terms = [1, 2]
+        plan = plan_run(run, checkpoints)
+        dept_list_htmls = fetch_dept_lists(fetcher, plan)
 
         counter = 1
         # For each term
-        for year in years:
-            for term in terms:
-                path = "list?yearterm={0}_{1}".format(year, term) 
-                dept_list_html = get_data_from_path(opener, path)
-
-                # Get department names from HTML
-                tree = etree.parse(StringIO(dept_list_html), etree.HTMLParser())
-                dept_xpath = '''//div[@class="displayed_courses"]
-                                //span[@class="course-block-title"]'''
-                depts_elts = tree.xpath(dept_xpath)
-                depts = map(lambda x: x.get('title'), depts_elts)
-
-                # Get course list
-                counter = scrape_course_list(opener, depts, term, year,
-                    counter)
+        for (year, term, refresh), dept_list_html in zip(plan, dept_list_htmls):
+            if dept_list_html is None:
+                continue
+
+            # Get department names from HTML
+            depts = parse_dept_list(dept_list_html)
 
+            # Get course list
+            failed = []
+            counter = scrape_course_list(fetcher, writer, depts, term, year,
+                counter, refresh, checkpoints, failed)
+            # Leave the term out of the ledger so the next run revisits the
+            # departments whose lists failed
+            if not failed:
+                finish_term(run, year, term)
+
+        finish_run(run)
         log('DONE!')
+    except CookieExpired:
+        log_error('Cookie no longer valid; run scrape --resume with a new ' +
+            'one to carry on', 'GENERAL')
     except Exception as e:
         log_error('{0} - {1}\n{2}'.format(e.__class__, e, traceback.format_exc()), 'GENERAL')
+    finally:
+        if fetcher is not None:
+            fetcher.close()
+        send_alerts()
+
+# Replays the dead letters.  Every course that had a page given up on is
+# scraped and saved again, and terms whose list pages were given up on are
+# dropped from the run ledger so the next incremental scrape revisits them.
+# Paths that fail again go back in the dead letters.
+def replay_failed(cookie, workers=settings.SCRAPER_WORKERS,
+        per_host=settings.SCRAPER_PER_HOST,
+        batch_size=settings.SCRAPER_BATCH_SIZE, transport=None):
+    fetcher = None
+    try:
+        COUNTERS.reset()
+        entries = get_dead_letters().take()
+        log('REPLAYING {0} FAILED PATHS'.format(len(entries)))
+        courses = {}
+        terms = set()
+        paths = []
+        for entry in entries:
+            context = entry['context']
+            if context is None:
+                paths.append(entry['path'])
+            elif 'id' in context:
+                courses[context['id']] = context
+            else:
+                terms.add((context['year'], context['term']))
+        for year, term in terms:
+            ScrapedTerm.objects.filter(year=year, term=term).delete()
+
+        fetcher = make_fetcher(cookie, workers, per_host, transport)
+        fetcher.get_all(paths, True)
+        writer = CourseWriter(batch_size)
+        for counter, course in enumerate(courses.values()):
+            writer.add(scrape_course_data(fetcher, course, counter + 1))
+        writer.flush()
+        log_metrics()
+        log('DONE!')
+    except Exception as e:
+        log_error('{0} - {1}\n{2}'.format(e.__class__, e, traceback.format_exc()), 'GENERAL')
+    finally:
+        if fetcher is not None:
+            fetcher.close()
+        send_alerts()
+
+# Sets up the pool of threads that download pages
+def make_fetcher(cookie, workers, per_host, transport=None):
+    if transport is None:
+        transport = make_transport(cookie)
+    policy = RetryPolicy(settings.SCRAPER_RETRY_BASE_DELAY,
+        settings.SCRAPER_RETRY_MAX_DELAY, settings.SCRAPER_RETRY_ATTEMPTS,
+        settings.SCRAPER_RETRY_JITTER)
+    return Fetcher(
+        lambda path, refresh: get_data_from_path(transport, path, refresh),
+        BASE_URL, workers, per_host, policy, get_dead_letters(),
+        log_fetch_failure,
+        # Shard workers share the page store file, so it can be locked by
+        # another process for longer than sqlite3 waits
+        retry_on=(IOError, httplib.HTTPException, sqlite3.OperationalError),
+        cached=get_stored_page,
+        limiter=lambda: AdaptiveRateLimiter(settings.SCRAPER_RATE,
+            settings.SCRAPER_MIN_RATE, settings.SCRAPER_MAX_RATE,
+            settings.SCRAPER_TARGET_LATENCY),
+        on_invalid=lambda path: get_page_store().invalidate(path))
+
+# Builds the transport named by kind (settings.SCRAPER_TRANSPORT by default):
+# 'https' for pooled keep-alive connections, 'urllib' for a plain urllib2
+# opener, or 'fixture' to serve pages from fixtures (a directory or page store
+# file) with latency seconds of pretend delay per page
+def make_transport(cookie, kind=None, fixtures=None, latency=0,
+        pool_size=settings.SCRAPER_POOL_SIZE):
+    kind = kind or settings.SCRAPER_TRANSPORT
+    if kind == 'https':
+        return HTTPSTransport(BASE_URL, cookie, pool_size)
+    if kind == 'urllib':
+        return UrllibTransport(BASE_URL, cookie)
+    if kind == 'fixture':
+        return FixtureTransport(fixtures, latency)
+    raise ValueError('Unknown transport {0}'.format(kind))
+
+def get_dead_letters():
+    return DeadLetters(settings.SCRAPER_DEAD_LETTERS)
+
+def log_fetch_failure(path, error, attempts, gave_up):
+    COUNTERS.add('fetch_failures')
+    msg = '{0} - {1} (path: {2}, attempt {3})'.format(error.__class__,
+        error, path, attempts)
+    if gave_up:
+        COUNTERS.add('fetch_gave_up')
+        log_error(msg + ': giving up', 'GENERAL', 'fetch')
+    else:
+        log_warning(msg + ': trying again', 'GENERAL', 'fetch')
+
+# Clears out the database and logs for a new run, or finds the run to resume
+def start_run(incremental, resume=False):
+    COUNTERS.reset()
+    if resume:
+        run = get_resumable_run()
+        if run is None:
+            raise ValueError('There is no unfinished run to resume')
+        log('RESUMING RUN {0} FROM {1}'.format(run.pk, run.started))
+        return run
+
+    # Clear the database
+    if not incremental:
+        truncate_db()
+    clear_logs()
+    abandoned = abandon_unfinished_runs()
+    if abandoned:
+        log('GAVE UP ON {0} UNFINISHED RUNS'.format(abandoned))
+    return ScrapeRun.objects.create(incremental=incremental)
+
+# plan_yearterms for run, without the terms it already finished
+def plan_run(run, checkpoints):
+    plan = []
+    for year, term, refresh in plan_yearterms(run.incremental):
+        if checkpoints.term_done(year, term):
+            log('SKIPPING {0} TERM {1}: ALREADY SAVED'.format(year, term))
+        else:
+            plan.append((year, term, refresh))
+    return plan
+
+# (year, term) pairs to scrape, newest first.  Term 1 = Fall, term 2 = Spring
+def get_yearterms():
+    years = range(2006, 2013)
+    years.reverse()
+    terms = [1, 2]
+    return [(year, term) for year in years for term in terms]
+
+# Decides which terms to scrape.  Returns (year, term, refresh) tuples, where
+# refresh means stored pages may be out of date and must be revalidated (see
+# get_data_from_path).  Pages of the other terms are used as stored forever.
+# A full scrape does every term.  An incremental scrape skips terms a previous
+# run finished, except for the newest settings.SCRAPER_OPEN_TERMS terms, which
+# can still change.
+def plan_yearterms(incremental):
+    yearterms = get_yearterms()
+    if not incremental:
+        return [(year, term, False) for year, term in yearterms]
+
+    open_terms = yearterms[:settings.SCRAPER_OPEN_TERMS]
+    done = set(ScrapedTerm.objects.values_list('year', 'term'))
+    plan = []
+    for year, term in yearterms:
+        if (year, term) in open_terms:
+            plan.append((year, term, True))
+        elif (year, term) not in done:
+            plan.append((year, term, False))
+        else:
+            log('SKIPPING {0} TERM {1}: ALREADY SCRAPED'.format(year, term))
+    return plan
+
+# Department lists for every term are independent, so get them at once.
+# Returns them in the same order as plan.
+def fetch_dept_lists(fetcher, plan):
+    htmls = {}
+    for refresh in [False, True]:
+        yearterms = [(year, term) for year, term, r in plan if r == refresh]
+        paths = map(lambda x: dept_list_path(*x), yearterms)
+        htmls.update(zip(yearterms, fetcher.get_all(paths, refresh,
+            context=map(term_context, yearterms))))
+    return [htmls[(year, term)] for year, term, refresh in plan]
+
+# Dead letter context for the list pages of a term
+def term_context(yearterm):
+    return {'year': yearterm[0], 'term': yearterm[1]}
+
+# Records in the run ledger that every course of a term has been saved
+def finish_term(run, year, term):
+    ScrapedTerm.objects.filter(year=year, term=term).delete()
+    ScrapedTerm.objects.create(year=year, term=term, run=run)
+
+def finish_run(run):
+    run.finished = timezone.now()
+    run.succeeded = True
+    run.save()
+    log_metrics()
+    if settings.SCRAPER_REFRESH_STATS:
+        yearterms = refresh_stats()
+        log('REFRESHED STATS OF {0} TERMS'.format(len(yearterms)),
+            stage='stats')
+    invalidate_api_cache(run)
+
+def dept_list_path(year, term):
+    return "list?yearterm={0}_{1}".format(year, term) 
+
+def course_list_path(dept, term, year):
+    return 'guide_dept?dept={0}&term={1}&year={2}'\
+        .format(urllib2.quote(dept, ''), term, year)
+
+# Gets department names from a term's department list
+def parse_dept_list(dept_list_html):
+    with COUNTERS.timer('parse.dept_list'):
+        return parse.dept_names(parse.parse_html(dept_list_html))
+
+# Turns a department's course list into course dicts with rudimentary info.
+# Returns None if the page has no data.
+def parse_course_list(course_list_html, term, year):
+    with COUNTERS.timer('parse.course_list'):
+        tree = parse.parse_html(course_list_html)
+        # If there's no data
+        if tree.getroot() is None:
+            return None
+        links = parse.course_links(tree)
+    # Put data in dict, append to list
+    course_list = []
+    for course_id, field, number, title in links:
+        course_list.append({
+            'id': course_id,
+            'field': field,
+            'number': number,
+            'title': title,
+            'year': year,
+            'term': term
+        })
+    return course_list
 
 # Save info about every course in a semester.  Scrapes rudimentary info
 # about the course, then passes it to scrape_course_data to find the rest
 # of the data
 # 
-# opener - What it uses to download course info
-#  - print output?
+# fetcher - What it uses to download course info
+# writer - CourseWriter that saves the courses
 # depts - Departments to scrape 
 # term - Spring or Fall?
 # year - Which year?
 # counter - How many courses have been scraped? Just used in output
-def scrape_course_list(opener, depts, term, year, counter):
-    course_list = []
-    for dept in depts:
-        # Get HTML with course list
-        path = 'guide_dept?dept={0}&term={1}&year={2}'\
-            .format(urllib2.quote(dept, ''), term, year)
-        
-        course_list_html = get_data_from_path(opener, path)
-
-        # Parse with lxml
-        tree = etree.parse(StringIO(course_list_html), etree.HTMLParser())
-        # If there's no data
-        if tree.getroot() is None:
-            return counter
-        courses = tree.xpath('//a')
-        # Put data in dict, append to list
-        for course in courses:
-            course_id = COURSE_ID_REGEX.findall(course.get('href'))[0]
-            info = COURSE_INFO_REGEX.match(course.text)
-            course_dict = {
-                'id': int(course_id),
-                'field': info.group(1),
-                'number': info.group(2),
-                'title': info.group(3),
-                'year': year,
-                'term': term
-            }
-            course_dict = scrape_course_data(opener, course_dict, 
-                counter)
+# refresh - Download pages again and skip courses that haven't changed?
+# checkpoints - Checkpoints of the run, to skip what it already saved
+# failed - list to add the departments whose course lists failed to
+def scrape_course_list(fetcher, writer, depts, term, year, counter,
+        refresh=False, checkpoints=None, failed=None):
+    for dept, course_list, pages in fetch_course_lists(fetcher, depts, term,
+            year, refresh, checkpoints, failed):
+        for course_dict, course_pages in zip(course_list, pages):
+            course_dict = scrape_course_data(fetcher, course_dict, 
+                counter, course_pages)
             counter += 1
-            save_course(course_dict)
+            start = time.time()
+            if writer.add(course_dict):
+                log('SAVED BATCH OF COURSES', stage='persist',
+                    duration=round(time.time() - start, 3))
+        # One transaction per department
+        start = time.time()
+        saved = writer.flush()
+        log('SAVED {0} COURSES'.format(saved), stage='persist',
+            duration=round(time.time() - start, 3))
+        if checkpoints is not None:
+            checkpoints.finish_dept(year, term, dept)
     return counter
 
+# Downloads every department's course list at once, then for each department
+# downloads the pages of all its courses as one batch.  Yields
+# (dept, course_list, pages) per department, where pages[i] holds the
+# contents of course_page_paths for course_list[i].  With refresh, only
+# courses that changed since they were last saved are yielded.  Departments
+# and courses checkpoints says are saved are left out.  Departments whose
+# course list couldn't be downloaded or has no data are skipped and added to
+# failed, if given.  fingerprints are passed on to fetch_changed_courses.
+def fetch_course_lists(fetcher, depts, term, year, refresh=False,
+        checkpoints=None, failed=None, fingerprints=None):
+    if checkpoints is not None:
+        depts = [dept for dept in depts
+            if not checkpoints.dept_done(year, term, dept)]
+    paths = map(lambda x: course_list_path(x, term, year), depts)
+    course_list_htmls = fetcher.get_all(paths, refresh,
+        context=term_context((year, term)))
+
+    for dept, course_list_html in zip(depts, course_list_htmls):
+        course_list = None
+        if course_list_html is not None:
+            course_list = parse_course_list(course_list_html, term, year)
+            if course_list is None:
+                log_warning('NO DATA IN COURSE LIST OF {0}'.format(dept),
+                    'GENERAL', 'fetch')
+        if course_list is None:
+            if failed is not None:
+                failed.append(dept)
+            continue
+        if checkpoints is not None:
+            course_list = [c for c in course_list
+                if not checkpoints.course_done(c['id'])]
+
+        if refresh:
+            changed, pages = fetch_changed_courses(fetcher, course_list,
+                fingerprints)
+            yield dept, changed, pages
+        else:
+            yield dept, course_list, fetch_course_pages(fetcher, course_list)
+        log('FETCH STATS: ' + json.dumps(fetcher.stats()), stage='fetch')
+
+# Downloads course_page_paths()[first:] for every course as one batch and
+# returns them grouped by course
+def fetch_course_pages(fetcher, course_list, refresh=False, first=0):
+    n = len(COURSE_PAGES) - first
+    paths = []
+    contexts = []
+    for course_dict in course_list:
+        paths = paths + course_page_paths(course_dict['id'])[first:]
+        contexts = contexts + [course_context(course_dict)] * n
+    pages = fetcher.get_all(paths, refresh, context=contexts)
+    return [pages[i * n:(i + 1) * n] for i in range(len(course_list))]
+
+# Downloads every course's summary again and keeps only the courses whose
+# summary differs from the one they were last saved from, along with fresh
+# copies of their other pages.  Returns (course_list, pages) like
+# fetch_course_lists.
+#
+# fingerprints - from saved_fingerprints, if already loaded; otherwise the
+#     courses' fingerprints are read from the database
+def fetch_changed_courses(fetcher, course_list, fingerprints=None):
+    paths = map(lambda x: course_page_paths(x['id'])[0], course_list)
+    summaries = fetcher.get_all(paths, True,
+        context=map(course_context, course_list))
+    if fingerprints is None:
+        fingerprints = saved_fingerprints(map(lambda x: x['id'],
+            course_list))
+
+    changed = []
+    changed_summaries = []
+    for course_dict, summary in zip(course_list, summaries):
+        if summary is None or \
+                fingerprints.get(course_dict['id']) == fingerprint(summary):
+            continue
+        course_dict['refresh'] = True
+        changed.append(course_dict)
+        changed_summaries.append(summary)
+    log('{0} OF {1} COURSES CHANGED'.format(len(changed), len(course_list)))
+
+    rest = fetch_course_pages(fetcher, changed, True, 1)
+    return changed, [[summary] + others
+        for summary, others in zip(changed_summaries, rest)]
+
+# Fingerprint of the summary page each saved course was last saved from, by
+# Q guide course id: of the courses in course_ids, or of every saved course
+def saved_fingerprints(course_ids=None):
+    scraped = ScrapedCourse.objects.all()
+    if course_ids is not None:
+        scraped = scraped.filter(qcourse_id__in=course_ids)
+    return dict(scraped.values_list('qcourse_id', 'fingerprint'))
+
+# Dead letter context for a course: enough of the course dict to scrape it
+# again on its own
+def course_context(course):
+    return dict((key, course[key])
+        for key in ['id', 'field', 'number', 'title', 'year', 'term'])
+
+# Identifies the version of a page a course was saved from
+def fingerprint(html):
+    return hashlib.sha1(html).hexdigest()
+
+# Pages scrape_course_data needs for every course, in the order it takes them
+COURSE_PAGES = [
+    'new_course_summary.html?course_id={0}',
+    'view_comments.html?course_id={0}',
+    'inst-tf_summary.html?sect_num=&course_id={0}',
+]
+
+def course_page_paths(course_id):
+    return map(lambda x: x.format(course_id), COURSE_PAGES)
+
 # Scrapes data about a course (including ratings), adds them to the course dict,
 # then returns that course dict
-def scrape_course_data(opener, course, counter):
+#
+# pages - contents of course_page_paths(course['id']), if already downloaded
+def scrape_course_data(fetcher, course, counter, pages=None):
+    start = time.time()
+    course = parse_course_data(fetcher, course, counter, pages)
+    log('SCRAPED COURSE', course_id=course['id'], stage='parse',
+        duration=round(time.time() - start, 3))
+    return course
+
+def parse_course_data(fetcher, course, counter, pages=None):
     log('\n{0}. SCRAPING {1} {2}: {3} ({4})'.format(counter, 
-        course['field'], course['number'], course['title'], course['id']))
+        course['field'], course['number'], course['title'], course['id']),
+        course_id=course['id'], stage='parse')
+    # Pages under a course that changed can't be taken from the page store
+    refresh = course.get('refresh', False)
+    fetcher = fetcher.with_context(course_context(course))
+
     # Get HTML with course data
-    path = 'new_course_summary.html?course_id={0}'.format(course['id'])
+    if pages is None:
+        pages = fetcher.get_all(course_page_paths(course['id']), refresh)
+    if None in pages:
+        # It's in the dead letters; don't save part of it
+        course['no_data'] = True
+        log_error('COULD NOT DOWNLOAD COURSE PAGES', course['id'])
+        return course
+    course_html, comments_html, profs_html = pages
+    course['fingerprint'] = fingerprint(course_html)
 
-    course_html = get_data_from_path(opener, path)
     # Parse with lxml
-    tree = etree.parse(StringIO(course_html), etree.HTMLParser())
+    with COUNTERS.timer('parse.html'):
+        tree = parse.parse_html(course_html)
 
     # Get summary stats
-    try:
-        stats_text = tree.xpath('//div[@id="summaryStats"]')[0].text
-    except IndexError:
+    with COUNTERS.timer('parse.summary'):
+        stats = parse.summary_stats(tree)
+        tables = parse.report_tables(tree)
+    if stats is None:
         course['no_data'] = True
         log_warning('NO DATA FOUND', course['id'])
         return course
-
-    stats = SUMMARY_STATS_REGEX.findall(stats_text)[0]
-    course['enrollment'] = int(stats[0])
-    course['evaluations'] = int(stats[1])
-    course['response_rate'] = float(stats[2])
+    course['enrollment'], course['evaluations'], course['response_rate'] = \
+        stats
 
     # #reportContent has many tables; the last two must be treated separately
-    tables = tree.xpath('//div[@id="reportContent"]/table')
     course['ratings'] = []
     for table in tables[:-2]:
         course['ratings'] = course['ratings'] + \
-            parse_standard_table(opener, table, course['id'])
+            parse_standard_table(fetcher, table, course['id'], refresh)
     if len(tables) > 1:
         course['ratings'] = course['ratings'] + \
             parse_pie_charts(tables[-2])
@@ -176,94 +563,155 @@ def scrape_course_data(opener, course, counter):
         course['reasons'] = parse_reasons(tables[-1])
     else:
         course['reasons'] = {}
-    course['comments'] = get_comments(opener, course)
-    course['profs'] = get_profs(opener, course['id'])
+    course['comments'] = get_comments(fetcher, course, comments_html)
+    course['profs'] = get_profs(fetcher, course['id'], profs_html, refresh)
+    if course['profs'] is None:
+        # Don't save a course with instructors missing, and don't let an
+        # incremental scrape think it's done
+        course['no_data'] = True
+        del course['fingerprint']
 
     return course
 
-def get_profs(opener, course_id):
-    PROF_XPATH = '//select[@name="current_instructor_or_tf_huid_param"]/option' 
-    TABLE_XPATH = '//div[@id="reportContent"]/table'
-    path = 'inst-tf_summary.html?sect_num=&course_id={0}'.format(course_id)
-    html = get_data_from_path(opener, path)
-    tree = etree.parse(StringIO(html), etree.HTMLParser())
-    prof_list = tree.xpath(PROF_XPATH)
+# Gets each instructor's name and ratings.  The instructor page shows one
+# instructor at a time, picked with current_instructor_or_tf_huid_param, so
+# the other instructors' pages are fetched together and every histogram they
+# link to is fetched once however many instructors share it.  Returns None if
+# an instructor page couldn't be downloaded.
+#
+# html - the instructor page as first shown, if already downloaded
+def get_profs(fetcher, course_id, html=None, refresh=False):
+    if html is None:
+        html = fetcher.get(instructor_path(course_id), refresh)
+        if html is None:
+            return None
+    with COUNTERS.timer('parse.html'):
+        tree = parse.parse_html(html)
+    with COUNTERS.timer('parse.instructors'):
+        prof_list = parse.instructor_options(tree)
     if not prof_list:
         log_warning('Course has no instructors', course_id)
+
+    # The page as downloaded shows the selected instructor (the first, if no
+    # option is marked selected), so only the others need fetching
+    selected = 0
+    for i, (value, prof_id, name, is_selected) in enumerate(prof_list):
+        if is_selected:
+            selected = i
+    paths = [instructor_path(course_id, value)
+        for value, prof_id, name, is_selected in prof_list]
+    others = [path for i, path in enumerate(paths) if i != selected]
+    downloaded = dict(zip(others, fetcher.get_all(others, refresh)))
+
     prof_data = []
-    for prof_node in prof_list:
+    pending = []
+    for i, (value, prof_id, name, is_selected) in enumerate(prof_list):
         prof = {}
-        prof['prof_id'] = PROF_ID_REGEX.findall(prof_node.attrib['value'])[0]
-        names = prof_node.text.split(',')
+        prof['prof_id'] = prof_id
+        names = name.split(',')
         if len(names) > 2:
             log_warning('More than one comma in instructor name', course_id)
         prof['first'] = names[1].strip()
         prof['last'] = names[0].strip()
-        log('FOUND INSTRUCTOR {0} {1} ({2})'.format(prof['first'], prof['last'], prof['prof_id']))
-        tables = tree.xpath(TABLE_XPATH)
+        log_debug('FOUND INSTRUCTOR {0} {1} ({2})'.format(prof['first'], prof['last'], prof['prof_id']))
+        if i == selected:
+            prof_tree = tree
+        elif downloaded[paths[i]] is None:
+            log_error('COULD NOT DOWNLOAD INSTRUCTOR PAGE ({0})'.format(
+                paths[i]), course_id)
+            return None
+        else:
+            with COUNTERS.timer('parse.html'):
+                prof_tree = parse.parse_html(downloaded[paths[i]])
+        with COUNTERS.timer('parse.instructors'):
+            tables = parse.report_tables(prof_tree)
         if not tables:
             log_warning('NO DATA FOUND FOR {0} {1} ({2})'.format(
                 prof['first'], prof['last'], prof['prof_id']), course_id)
-            prof['ratings'] = []
-        else:
-            for table in tables:
-                prof['ratings'] = parse_standard_table(opener, table, course_id)
+        prof['ratings'] = []
+        for table in tables:
+            ratings, table_pending = read_standard_table(table)
+            prof['ratings'] = prof['ratings'] + ratings
+            pending = pending + table_pending
         prof_data.append(prof)
 
+    add_score_breakdowns(fetcher, pending, course_id, refresh)
     return prof_data
 
+# Path of a course's instructor page, showing the instructor picked by value
+# (an option of the instructor select list) or the default one
+def instructor_path(course_id, value=None):
+    path = 'inst-tf_summary.html?sect_num=&course_id={0}'.format(course_id)
+    if value is not None:
+        path = path + '&current_instructor_or_tf_huid_param=' + \
+            urllib2.quote(value, '')
+    return path
 
-def parse_standard_table(opener, table, course_id):
-    log('PARSING NEW TABLE')
-    # Find rows
-    rows = table.xpath('.//tr')
-    ratings = []
-    for row in rows[1:-2]:
-        rating = {}
-        cells = row.xpath('./td')
+def parse_standard_table(fetcher, table, course_id, refresh=False):
+    ratings, pending = read_standard_table(table)
+    add_score_breakdowns(fetcher, pending, course_id, refresh)
+    return ratings
 
-        # Get category
-        rating['category'] = cells[0].xpath('./strong')[0].text
-        if rating['category'] == 'Workload (hours per week)':
-            rating['category'] = 'Workload'
-        log_msg = rating['category'] + ': '
+# Reads the ratings out of a table of score bars.  Returns the ratings and a
+# list of (rating, histogram url) for the ones whose breakdown has to be
+# fetched from a histogram page.
+def read_standard_table(table):
+    log_debug('PARSING NEW TABLE')
+    ratings = []
+    pending = []
+    with COUNTERS.timer('parse.standard_table'):
+        rows = parse.standard_table_rows(table)
+    for row in rows:
+        log_msg = row['category'] + ': '
+        if row['value'] is None:
+            log_debug(log_msg + 'None')
+            continue
+        rating = {
+            'category':      row['category'],
+            'num_responses': row['num_responses'],
+            'value':         row['value'],
+        }
+        log_debug(log_msg + str(rating['value']))
+        ratings.append(rating)
 
-        rating['num_responses'] = int(cells[1].text)
-        if not cells[2].xpath('.//img'):
-            rating['value']  = None
-            rating['ones']   = 0
-            rating['twos']   = 0
-            rating['threes'] = 0
-            rating['fours']  = 0
-            rating['fives']  = 0
-            log(log_msg + 'None')
+        # Newer pages draw the histogram right in the row, which saves
+        # fetching its page
+        if row['scores']:
+            set_score_breakdown(rating, row['scores'])
+            COUNTERS.add('histograms_inline')
             continue
-        img_src = cells[2].xpath('.//img')[0].get('src')
-        rating['value'] = float(SCORE_BAR_REGEX.match(img_src).group(1))
-        log(log_msg + str(rating['value']))
-        histogram_url = cells[3].xpath('.//a')[0].get('href')
+        pending.append((rating, row['histogram_url']))
+    return ratings, pending
 
-        add_score_breakdown(opener, rating, histogram_url, course_id)
-        ratings.append(rating)
-    return ratings
+# Downloads the histogram pages of pending (from read_standard_table) all at
+# once, each distinct page only once, and fills in the breakdowns
+def add_score_breakdowns(fetcher, pending, course_id, refresh=False):
+    if not pending:
+        return
+    histogram_urls = []
+    for rating, histogram_url in pending:
+        if histogram_url not in histogram_urls:
+            histogram_urls.append(histogram_url)
+    histograms = dict(zip(histogram_urls,
+        fetcher.get_all(histogram_urls, refresh, valid_histogram)))
+    COUNTERS.add('histograms_fetched', len(histogram_urls))
+    COUNTERS.add('histograms_shared', len(pending) - len(histogram_urls))
+    for rating, histogram_url in pending:
+        add_score_breakdown(fetcher, rating, histogram_url, course_id,
+            histograms[histogram_url], fetched=True)
 
 def parse_pie_charts(table):
     # 0 and 2 are the only two rows with actual data in them
-    log('PARSING NEW TABLE')
+    log_debug('PARSING NEW TABLE')
     ratings = []
-    for row in table.xpath('tr')[0:2]:
+    with COUNTERS.timer('parse.pie_charts'):
+        rows = parse.pie_chart_rows(table)
+    for row in rows:
         rating = {}
-        if not row.xpath('.//strong'):
-            continue
-
-        rating['category'] = row.xpath('.//strong')[0].text
+        rating['category'] = row['category']
         log_msg = rating['category'] + ': '
-        row_html = etree.tostring(row)
 
-        try:
-            rating['num_responses'] = \
-                int(TOTAL_RESPONSES_REGEX.findall(row_html)[0])
-        except IndexError:
+        if row['num_responses'] is None:
             rating['num_responses'] = 0
             rating['value']  = None
             rating['ones']   = 0
@@ -271,13 +719,14 @@ def parse_pie_charts(table):
             rating['threes'] = 0
             rating['fours']  = 0
             rating['fives']  = 0
-            log(log_msg + 'None')
+            log_debug(log_msg + 'None')
             continue
 
-        rating['value'] = float(MEAN_REGEX.findall(row_html)[0])
-        breakdown = BREAKDOWN_REGEX.findall(row_html)
+        rating['num_responses'] = row['num_responses']
+        rating['value'] = row['value']
+        breakdown = row['scores']
 
-        log(log_msg + str(map(lambda x: int(x), list(breakdown))))
+        log_debug(log_msg + str(breakdown))
 
         rating['ones']   = int(breakdown[0])
         rating['twos']   = int(breakdown[1])
@@ -290,246 +739,207 @@ def parse_pie_charts(table):
 
 # Parses reasons for taking curse
 def parse_reasons(table):
-    log('PARSING REASONS')
+    log_debug('PARSING REASONS')
     reasons = {}
-    for row in table.xpath('tr')[1:]:
-        reason = row.xpath('td')[-1].text
-        log_msg = reason + ': '
-        reasons[reason] = int(row.xpath('td')[-2].text)
-        log(log_msg + str(reasons[reason]))
+    with COUNTERS.timer('parse.reasons'):
+        rows = parse.reason_rows(table)
+    for reason, number in rows:
+        reasons[reason] = number
+        log_debug(reason + ': ' + str(number))
 
     return reasons
 
 # Adds the score breakdown to the rating dict
-def add_score_breakdown(opener, rating, histogram_url, course_id):
-    html = get_data_from_path(opener, histogram_url)
-    if FAILED_HISTOGRAM_REGEX.findall(html) or len(HISTOGRAM_REGEX.findall(html)) == 0 :
-        uncache(histogram_url)
+#
+# html - contents of histogram_url, if already downloaded
+# fetched - whether the Fetcher was already asked for histogram_url, in which
+#     case html is None only if it gave up, and the page isn't tried again
+def add_score_breakdown(fetcher, rating, histogram_url, course_id, html=None,
+        fetched=False):
+    if html is None and not fetched:
+        html = fetcher.get(histogram_url, validate=valid_histogram)
+    scores = None if html is None else read_histogram(html)
+    if scores is None:
+        # The Fetcher gave up on it; it can be replayed from the dead letters
         log_error("Score breakdown page unexpectedly displays no breakdown " +\
                   "(path: {0})".format(histogram_url), course_id)
-        time.sleep(60) # wait 1 minute before trying again
-        add_score_breakdown(opener, rating, histogram_url, course_id)
-        return
-    if not HISTOGRAM_REGEX.findall(html)[0]:
-        uncache(histogram_url)
-        log_error("Histogram regex failed to parse histogram " +\
-                  "(path: {0})".format(histogram_url), course_id)
-        time.sleep(60) # wait 1 minute before trying again
-        add_score_breakdown(opener, rating, histogram_url, course_id)
+        COUNTERS.add('histograms_failed')
+        rating['ones']   = 0
+        rating['twos']   = 0
+        rating['threes'] = 0
+        rating['fours']  = 0
+        rating['fives']  = 0
         return
-    scores = HISTOGRAM_REGEX.findall(html)[0]
-    log(str(map(lambda x: int(x), list(scores))))
+    set_score_breakdown(rating, scores)
+
+# Sets the rating's counts from the five numbers of a histogram image name
+def set_score_breakdown(rating, scores):
+    log_debug(str(map(lambda x: int(x), list(scores))))
     rating['ones']   = int(scores[0])
     rating['twos']   = int(scores[1])
     rating['threes'] = int(scores[2])
     rating['fours']  = int(scores[3])
     rating['fives']  = int(scores[4])
 
-def get_comments(opener, course):
-    log('GETTING COMMENTS')
+# Whether a histogram page actually shows a histogram.  The Q guide sometimes
+# serves one without, in which case it's downloaded again after a while.
+def valid_histogram(html):
+    return read_histogram(html) is not None
+
+def read_histogram(html):
+    with COUNTERS.timer('parse.histogram'):
+        return parse.read_histogram(html)
+
+def get_comments(fetcher, course, comments_html=None):
+    log_debug('GETTING COMMENTS')
     path = 'view_comments.html?course_id={0}'.format(course['id'])
-    comments_html = get_data_from_path(opener, path)
-    if NO_COMMENTS_REGEX.findall(comments_html):
+    if comments_html is None:
+        comments_html = fetcher.get(path)
+    with COUNTERS.timer('parse.comments'):
+        has_comments = parse.has_comments(comments_html)
+    if not has_comments:
         if course['year'] >= 2007:
             log_warning('No comments found for course taught after 2007', course['id'])
         else:
-            log('NO COMMENTS')
+            log_debug('NO COMMENTS')
         return []
-    log('GETTING COMMENTS WITH &qid=1487')
+    log_debug('GETTING COMMENTS WITH &qid=1487')
     path = path + '&qid=1487'
-    comments_html = get_data_from_path(opener, path)
-    tree = etree.parse(StringIO(comments_html), etree.HTMLParser())
-    comments_xpath = '//div[@id="responseBlock"]/div[@class="response"]/p'
-    return map(lambda x: x.text, tree.xpath(comments_xpath))
-
-def save_course(course):
-    # STEP 0: Throw out courses with no data
-    if 'no_data' in course.keys() and course['no_data']:
-        log('NO DATA TO SAVE FOR COURSE')
-        return
+    comments_html = fetcher.get(path, course.get('refresh', False))
+    if comments_html is None:
+        log_error('COULD NOT DOWNLOAD COMMENTS', course['id'])
+        return []
+    with COUNTERS.timer('parse.comments'):
+        return parse.comment_texts(parse.parse_html(comments_html))
 
-    # STEP 1: Save Field
-    log_msg = 'SAVING FIELD {0}... '.format(course['field'])
-    f = None
-    try:
-        f = Field(abbreviation=course['field'], name='')
-        f.save()
-        log(log_msg + 'FIELD SAVED')
-    except DatabaseError as e:
-        log(str(e))
-        f = Field.objects.filter(abbreviation=course['field'])[0]
-        log(log_msg + 'FIELD ALREADY EXISTS')
-
-
-    # STEP 2: Save Course
-    log_msg = 'SAVING COURSE... '
-    c = None
-    try:
-        c = Course(
-            field         = f,
-            number        = course['number'],
-            title         = course['title'],
-        )
-        c.save()
-        log(log_msg + 'COURSE SAVED')
-    except DatabaseError as e:
-        log(str(e))
-        c = Course.objects.get(field=f, number=course['number'])
-        log(log_msg + 'COURSE ALREADY EXISTS')
-
-    cinst = None
-    log_msg = 'SAVING COURSE INSTANCE... '
-    try:
-        cinst = CourseInstance(
-            course        = c,
-            qcourse_id     = course['id'],
-            year          = course['year'],
-            term          = course['term'],
-            enrollment    = course['enrollment'],
-            evaluations   = course['evaluations'],
-            response_rate = course['response_rate']
-        )
-        cinst.save()
-        log(log_msg + 'COURSE INSTANCE SAVED')
-    except DatabaseError as e:
-        log(str(e))
-        cinst = Course.objects.get(course_id=course['id'])
-        log(log_msg + 'COURSE INSTANCE ALREADY EXISTS')
-
-    # STEP 3: Save Comments
-    for comment in course['comments']:
-        log_msg = 'SAVING COMMENT... '
-        try:
-            Comment(course=cinst, comment=comment).save()
-            log(log_msg + 'COMMENT SAVED')
-        except DatabaseError as e:
-            log(str(e))
-            log(log_msg + 'COMMENT ALREADY EXISTS')
-
-    # Save Ratings
-    for r in course['ratings']:
-        save_rating(cinst, r)
-            
-    # Save Profs
-    for p in course['profs']:
-        log_msg = 'SAVING INSTRUCTOR {0} {1} ({2})... '.format(p['first'], p['last'], p['prof_id'])
-        try:
-            i = Instructor(
-                prof_id = p['prof_id'],
-                first = p['first'],
-                last = p['last']
-            )
-            i.save()
-            log(log_msg + 'INSTRUCTOR SAVED')
-        except DatabaseError as e:
-            log(str(e))
-            log(log_msg + 'INSTRUCTOR ALREADY EXISTS')
-            i = Instructor.objects.filter(course=c, prof_id=p['prof_id'])[0]
-        log_msg = 'SAVING INSTRUCTOR COURSE INSTANCE RELATION... ' 
-        try:
-            irel = InstructorCourseInstanceRelation(
-                course_instance = cinst,
-                instructor = i,
-            )
-            irel.save()
-            log(log_msg + 'INSTRUCTOR COURSE INSTANCE RELATION SAVED')
-        except DatabaseError as e:
-            log(str(e))
-            log(log_msg + 'INSTRUCTOR COURSE INSTANCE RELATION ALREADY EXISTS')
-            irel = InstructorCourseInstanceRelation.objects.get(
-                course_instance=cinst, instructor=i)
-        for r in p['ratings']:
-            save_rating(irel, r)
-
-    reasons_dict = {
-        'Elective':
-            'Elective',
-        'Concentration or Department Requirement':
-            'Concentration or Department Requirement',
-        'Secondary Field or Language Citation Requirement':
-            'Secondary Field or Language Citation Requirement',
-        'Undergraduate Core or General Education Requirement':
-            'Undergraduate Core or General Education Requirement',
-        'Expository Writing Requirement':
-            'Expository Writing Requirement',
-        'Foreign Language Requirement':
-            'Foreign Language Requirement',
-        'Pre-Med Requirement':
-            'Pre-Med Requirement',
-        'Undergraduate Core Requirement': 
-            'Undergraduate Core or General Education Requirement',
-        'Concentration/Program Requirement':
-            'Concentration or Department Requirement'
-    }
-
-    for r in course['reasons'].keys():
-        log_msg = 'SAVING REASON {0}... '.format(reasons_dict[r])
-        try:
-            Reason(course=cinst, reason=reasons_dict[r], 
-                number=course['reasons'][r]).save()
-            log(log_msg + 'REASON SAVED')
-        except DatabaseError as e:
-            log(str(e))
-            log(log_msg + 'REASON ALREADY EXISTS')
-
-def save_rating(rated_object, rating):
-    log_msg = 'SAVING RATING {0}... '.format(rating['category'])
-    try:
-        Rating(
-            rated_object  = rated_object,
-            category      = rating['category'],
-            value         = rating['value'],
-            num_responses = rating['num_responses'],
-            ones          = rating['ones'],
-            twos          = rating['twos'],
-            threes        = rating['threes'],
-            fours         = rating['fours'],
-            fives         = rating['fives']
-        ).save()
-        log(log_msg + 'RATING SAVED')
-    except DatabaseError as e:
-        log(str(e))
-        log(log_msg + 'RATING ALREADY EXISTS')
-
-# Gets data from file in DATA_DIR, or downloads and saves it
-def get_data_from_path(opener, path):
-    try:
-        contents = open(DATA_DIR + path).read()
-        if PIN_LOGIN_REGEX.findall(contents):
-            raise IOError
-    except IOError:
-        url = BASE_URL + path
-        try:
-            contents = opener.open(url).read()
-        except urllib2.URLError as e:
-            log_error('{0} - {1}: trying again'.format(e.__class__, e), 'GENERAL')
-            return get_data_from_path(opener, path)
-        contents = contents.decode('utf-8')\
-            .encode('ascii', 'ignore')
-
-        # Check to see if cookie is still good
-        if PIN_LOGIN_REGEX.findall(contents):
-            log_error('Cookie no longer valid', 'GENERAL')
-            mail.send_mail('scraper failed', 'Your cookie expried.', 
-                settings.FROM_EMAIL, settings.ALERT_RECIPIENTS, fail_silently=True)
-            sys.exit(1)
-            return
-
-        # Save contents
-        f = open(DATA_DIR + path, 'w')
-        f.write(contents)
-        f.close()
-        
+# Gets data from the page store, or downloads and saves it.  Called from the
+# Fetcher's worker threads, so several paths may be in here at once.
+#
+# refresh - the stored copy may be out of date.  Unless page_ttl says it was
+#     checked recently enough, it's revalidated with a conditional GET and
+#     only downloaded again if the server says it changed.
+def get_data_from_path(transport, path, refresh=False):
+    store = get_page_store()
+    contents = get_stored_page(path, refresh)
+    if contents is not None:
+        return contents
+    validators = store.validators(path) if refresh else None
+
+    if validators is not None and validators[:2] != (None, None):
+        status, contents, etag, last_modified = download(transport, path,
+            *validators[:2])
+        if status == 304:
+            COUNTERS.add('pages_not_modified')
+            store.touch(path)
+            with COUNTERS.timer('page_store.get'):
+                contents = store.get(path)
+            if contents is not None:
+                return contents
+            # It was invalidated in the meantime
+            status, contents, etag, last_modified = download(transport, path)
+    else:
+        status, contents, etag, last_modified = download(transport, path)
+    COUNTERS.add('pages_downloaded')
+    COUNTERS.add('bytes_downloaded', len(contents))
+    contents = contents.decode('utf-8')\
+        .encode('ascii', 'ignore')
+
+    # Check to see if cookie is still good.  Not worth retrying, so the
+    # Fetcher hands it straight back to the scrape, which stops and leaves
+    # the run to be resumed.
+    if PIN_LOGIN_REGEX.findall(contents):
+        raise CookieExpired('Cookie no longer valid (path: {0})'\
+            .format(path))
+
+    # Save contents.  Only pages that got past the PIN login check make it
+    # here, so the store never has to re-check them.
+    with COUNTERS.timer('page_store.put'):
+        store.put(path, contents, status, etag=etag,
+            last_modified=last_modified)
+    return contents
+
+# transport.get, timed.  Transport errors are retried by the Fetcher.
+def download(transport, path, etag=None, last_modified=None):
+    with COUNTERS.timer('fetch'):
+        return transport.get(path, etag, last_modified)
+
+# Seconds a stored page stays fresh after it was downloaded or last
+# revalidated: the first of settings.SCRAPER_PAGE_TTLS whose prefix path
+# starts with, 0 (revalidate every time) if none does, or None for forever
+def page_ttl(path):
+    for prefix, ttl in settings.SCRAPER_PAGE_TTLS:
+        if path.startswith(prefix):
+            return ttl
+    return 0
+
+# Whether a page last checked at checked_at can be used without revalidating
+def page_is_fresh(path, checked_at):
+    ttl = page_ttl(path)
+    return ttl is None or time.time() - checked_at < ttl
+
+# The stored copy of path, or None if it has to be downloaded.  The Fetcher
+# asks here before it takes a rate limiter token, so pages served from the
+# store never count against the Q guide's rate.
+#
+# refresh - only return the stored copy if page_ttl says it was checked
+#     recently enough not to be revalidated
+def get_stored_page(path, refresh=False):
+    store = get_page_store()
+    if refresh:
+        validators = store.validators(path)
+        if validators is None or not page_is_fresh(path, validators[2]):
+            return None
+    with COUNTERS.timer('page_store.get'):
+        contents = store.get(path)
+    if contents is not None:
+        COUNTERS.add('pages_cached')
+        if refresh:
+            COUNTERS.add('pages_fresh')
     return contents
 
+# Makes get_data_from_path download path again next time
 def uncache(path):
-    try:
-        os.remove(DATA_DIR + path)
-    except OSError:
-        log_warning('Tried to delete nonexistant file', 'GENERAL')
+    if not get_page_store().invalidate(path):
+        log_warning('Tried to uncache a page that was never stored', 'GENERAL')
+
+PAGE_STORE = None
+PAGE_STORE_LOCK = threading.Lock()
+
+# Points the scraper at a different page store file, e.g. ':memory:' to
+# benchmark with a cold cache
+def use_page_store(filename):
+    global PAGE_STORE
+    with PAGE_STORE_LOCK:
+        PAGE_STORE = PageStore(filename, settings.PAGE_STORE_CODEC)
+
+# Opens settings.PAGE_STORE the first time it's needed
+def get_page_store():
+    global PAGE_STORE
+    with PAGE_STORE_LOCK:
+        if PAGE_STORE is None:
+            PAGE_STORE = PageStore(settings.PAGE_STORE,
+                settings.PAGE_STORE_CODEC)
+        return PAGE_STORE
+
+# Copies pages saved one file per path in DATA_DIR into the page store,
+# leaving out everything else kept there (the page store itself, the search
+# index, exports and benchmark corpora).  Pages showing the PIN login are
+# imported but marked invalid.
+def import_data_dir(data_dir=DATA_DIR):
+    return get_page_store().import_dir(data_dir,
+        lambda x: not PIN_LOGIN_REGEX.search(x))
 
 def truncate_db():
+    CourseStats.objects.all().delete()
+    InstructorStats.objects.all().delete()
+    FieldStats.objects.all().delete()
+    StatsRefresh.objects.all().delete()
+    if settings.SEARCH_INDEX is not None:
+        get_search_index().clear()
     Rating.objects.all().delete()
+    CourseRating.objects.all().delete()
+    InstructorRating.objects.all().delete()
+    RatingCategory.objects.all().delete()
     Reason.objects.all().delete()
     Comment.objects.all().delete()
     InstructorCourseInstanceRelation.objects.all().delete()
@@ -537,27 +947,103 @@ def truncate_db():
     CourseInstance.objects.all().delete()
     Course.objects.all().delete()
     Field.objects.all().delete()
+    ScrapedCourse.objects.all().delete()
+    ScrapedTerm.objects.all().delete()
+    ScrapedDept.objects.all().delete()
 
 def clear_logs():
-    for log_name in [OUTPUT_LOG, ERROR_LOG, WARNING_LOG]:
-        open(LOG_DIR + log_name, 'w').close()
+    get_log_writer().clear()
+
+# Deletes the log files in LOG_DIR whose names start with prefix, such as the
+# ones an earlier reparse's parsing processes left
+def remove_logs(prefix):
+    if not os.path.isdir(LOG_DIR):
+        return
+    for filename in os.listdir(LOG_DIR):
+        if filename.startswith(prefix):
+            os.remove(os.path.join(LOG_DIR, filename))
+
+# Logs the run's counters and where its time went
+def log_metrics():
+    log('RUN COUNTERS: ' + json.dumps(COUNTERS.snapshot(), sort_keys=True))
+    log('RUN TIMINGS:\n' + '\n'.join(COUNTERS.summary()), stage='metrics')
+
+# Starts writing the run's metrics to filename every
+# settings.SCRAPER_METRICS_INTERVAL seconds.  Returns the MetricsFile to stop
+# at the end, or None if there's no filename.
+def start_metrics_file(filename=settings.SCRAPER_METRICS_FILE):
+    if not filename:
+        return None
+    return MetricsFile(COUNTERS, filename,
+        settings.SCRAPER_METRICS_INTERVAL).start()
 
 # LOGGING UTILITIES
-def log(msg):
-    with open(LOG_DIR + OUTPUT_LOG, 'a') as f:
-        f.write(msg + '\n') 
-
-def log_error(msg, course_id):
-    msg = 'ERROR: ' + str(course_id) + ': ' + msg # + '; EXITING NOW'
-    log(msg)
-    with open(LOG_DIR + ERROR_LOG, 'a') as f:
-        f.write(msg + '\n') 
-    mail.send_mail('scraper failed', EMAIL_MESSAGE.format(msg), 
-        settings.FROM_EMAIL, settings.ALERT_RECIPIENTS, fail_silently=True)
-
-
-def log_warning(msg, course_id):
-    msg = 'WARNING: ' + str(course_id) + ': ' + msg
-    log(msg)
-    with open(LOG_DIR + WARNING_LOG, 'a') as f:
-        f.write(msg + '\n') 
+# Messages are queued and written out by a background thread (see
+# scrapelog.py).  Besides its message, each can record the course it's about,
+# the stage it came from and how many seconds something took.
+def log(msg, level=logging.INFO, course_id=None, stage=None, duration=None):
+    get_log_writer()
+    if LOGGER.isEnabledFor(level):
+        LOGGER.log(level, msg, extra={'course_id': course_id, 'stage': stage,
+            'duration': duration})
+
+# Per-row parsing details; left out unless SCRAPER_LOG_LEVEL is DEBUG
+def log_debug(msg, course_id=None):
+    log(msg, logging.DEBUG, course_id)
+
+def log_error(msg, course_id, stage=None):
+    log(msg, logging.ERROR, course_id, stage)
+    # Mailed with the others in the next digest
+    get_alerts().add(msg, course_id)
+
+
+def log_warning(msg, course_id, stage=None):
+    log(msg, logging.WARNING, course_id, stage)
+
+def send_alert(subject, body):
+    mail.send_mail(subject, EMAIL_MESSAGE.format(body), settings.FROM_EMAIL,
+        settings.ALERT_RECIPIENTS, fail_silently=True)
+
+# Starts the thread that mails error digests the first time it's needed
+def get_alerts():
+    global ALERTS
+    with LOG_LOCK:
+        if ALERTS is None:
+            ALERTS = AlertDigest(send_alert, settings.SCRAPER_ALERT_INTERVAL,
+                settings.SCRAPER_ALERT_SAMPLES)
+        return ALERTS
+
+# Stops errors from being mailed, for processes whose parent reports them
+def disable_alerts():
+    global ALERTS
+    with LOG_LOCK:
+        ALERTS = AlertDigest(lambda subject, body: None)
+
+# Mails any errors still waiting for a digest, at the end of a run
+def send_alerts():
+    with LOG_LOCK:
+        alerts = ALERTS
+    if alerts is not None:
+        alerts.flush()
+
+# Sends log messages at level (a name like 'INFO'; settings.SCRAPER_LOG_LEVEL
+# by default) and above to the log files, with prefix in front of their names
+# so processes sharing LOG_DIR can each have their own
+def configure_logging(level=None, prefix=''):
+    global LOG_WRITER
+    with LOG_LOCK:
+        LOG_WRITER = _configure_logging(level, prefix)
+
+# Sets up logging the first time it's needed
+def get_log_writer():
+    global LOG_WRITER
+    with LOG_LOCK:
+        if LOG_WRITER is None:
+            LOG_WRITER = _configure_logging()
+        return LOG_WRITER
+
+def _configure_logging(level=None, prefix=''):
+    level = scrapelog.parse_level(level or settings.SCRAPER_LOG_LEVEL)
+    scrapelog.configure(LOG_DIR, prefix + OUTPUT_LOG, prefix + WARNING_LOG,
+        prefix + ERROR_LOG, prefix + JSON_LOG, level)
+    return scrapelog.get_writer()
@@ -0,0 +1,161 @@
+################################################################################
+# Buffered logging for the scraper.  Messages go through the stdlib logging  #
+# module to a handler that only queues them; a background thread writes them #
+# to log files that stay open for the whole run, so logging a line costs a    #
+# queue put instead of an open, a write and a close.                          #
+#                                                                              #
+# Each record can carry a course_id, the stage it came from and a duration    #
+# in seconds.  Besides the plain-text logs, every record is written as one    #
+# JSON object per line so runs can be analysed without parsing messages.     #
+################################################################################
+
+import json
+import logging
+import os
+import Queue
+import threading
+
+LOGGER_NAME = 'scraper'
+
+# Fields a record may carry besides its message
+FIELDS = ['course_id', 'stage', 'duration']
+
+# The old plain-text format: just the message, with warnings and errors
+# prefixed by their level and course id
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        msg = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            msg = '{0}: {1}: {2}'.format(record.levelname,
+                getattr(record, 'course_id', None), msg)
+        return msg
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, sort_keys=True)
+
+# Passes records from minimum up to maximum level, so warning.log can get
+# warnings only
+class LevelFilter(logging.Filter):
+    def __init__(self, minimum, maximum=logging.CRITICAL):
+        logging.Filter.__init__(self)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def filter(self, record):
+        return self.minimum <= record.levelno <= self.maximum
+
+# Logging handler that hands records to a writer thread.  Each target is a
+# (filename, formatter, level filter or None) the records are written to.
+class BufferedWriter(logging.Handler):
+    def __init__(self, targets):
+        logging.Handler.__init__(self)
+        self.targets = []
+        for filename, formatter, level_filter in targets:
+            self.targets.append([filename, open(filename, 'a'), formatter,
+                level_filter])
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._write,
+            name='log-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        # Messages are formatted on the writer thread, so pin down anything
+        # that could change before then
+        record.msg = record.getMessage()
+        record.args = None
+        self.queue.put(record)
+
+    # Blocks until everything logged so far is written out
+    def flush(self):
+        self.queue.join()
+
+    # Empties the log files, after writing out what's already queued
+    def clear(self):
+        self.queue.put('clear')
+        self.queue.join()
+
+    def close(self):
+        # logging.shutdown closes every handler again at exit
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.queue.join()
+            self.thread.join()
+        logging.Handler.close(self)
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    for target in self.targets:
+                        target[1].close()
+                    return
+                elif item == 'clear':
+                    for target in self.targets:
+                        target[1].close()
+                        target[1] = open(target[0], 'w')
+                else:
+                    self._write_record(item)
+                # Hit the disk once the queue runs dry rather than per line
+                if self.queue.empty():
+                    for target in self.targets:
+                        target[1].flush()
+            except Exception:
+                self.handleError(item)
+            finally:
+                self.queue.task_done()
+
+    def _write_record(self, record):
+        for filename, f, formatter, level_filter in self.targets:
+            if level_filter is None or level_filter.filter(record):
+                f.write(formatter.format(record) + '\n')
+
+# Sends the scraper's log messages at level and above to a BufferedWriter
+# writing output_log (everything), warning_log (warnings only), error_log
+# (errors and worse) and json_log (everything, as JSON lines) under log_dir.
+# Replaces the writer of an earlier call.  Returns the logger.
+def configure(log_dir, output_log, warning_log, error_log, json_log,
+        level=logging.DEBUG):
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        if isinstance(handler, BufferedWriter):
+            logger.removeHandler(handler)
+            handler.close()
+    text = TextFormatter()
+    writer = BufferedWriter([
+        (os.path.join(log_dir, output_log), text, None),
+        (os.path.join(log_dir, warning_log), text,
+            LevelFilter(logging.WARNING, logging.WARNING)),
+        (os.path.join(log_dir, error_log), text, LevelFilter(logging.ERROR)),
+        (os.path.join(log_dir, json_log), JsonFormatter(), None),
+    ])
+    logger.addHandler(writer)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+# Returns the BufferedWriter configure set up, or None
+def get_writer():
+    for handler in logging.getLogger(LOGGER_NAME).handlers:
+        if isinstance(handler, BufferedWriter):
+            return handler
+    return None
+
+# Turns a level name like 'INFO' into a logging level
+def parse_level(name):
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError('Unknown log level {0}'.format(name))
+    return level
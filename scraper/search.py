@@ -0,0 +1,233 @@
+################################################################################
+# Full-text search over course comments.  Comments are indexed in an SQLite    #
+# FTS4 table (porter-stemmed) in settings.SEARCH_INDEX, next to a plain table  #
+# of each comment's course instance, field, year and term for filtering.       #
+# Matches are ranked by BM25, computed from FTS4's matchinfo.                  #
+#                                                                              #
+# The CourseWriter re-indexes the comments of every course instance it saves   #
+# once its transaction commits.  manage.py search_index --rebuild indexes      #
+# everything from scratch, e.g. after a sharded run with workers on other      #
+# machines, whose index files this one never sees.                             #
+################################################################################
+
+import math
+import sqlite3
+import struct
+import threading
+
+from models import *
+from qscraper import settings
+
+SCHEMA = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS comment_text
+        USING fts4(comment, tokenize=porter)''',
+    # comment_id is also the docid of the comment's comment_text row
+    '''CREATE TABLE IF NOT EXISTS comment_info (
+        comment_id INTEGER PRIMARY KEY,
+        course_instance_id INTEGER NOT NULL,
+        field TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        term INTEGER NOT NULL
+    )''',
+    '''CREATE INDEX IF NOT EXISTS comment_info_course
+        ON comment_info (course_instance_id)''',
+    '''CREATE INDEX IF NOT EXISTS comment_info_term
+        ON comment_info (field, year, term)''',
+]
+
+# Comments read from the database at a time when rebuilding
+CHUNK_SIZE = 5000
+
+class CommentIndex(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        # Other processes (shard workers) may be writing to the same file
+        self.conn = sqlite3.connect(filename, timeout=60,
+            check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.create_function('bm25', 1, bm25)
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+
+    # Replaces the comments of the course instances cinst_ids with rows of
+    # (comment id, course instance id, field, year, term, comment)
+    def replace(self, cinst_ids, rows):
+        cinst_ids = list(cinst_ids)
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                for i in range(0, len(cinst_ids), 500):
+                    chunk = cinst_ids[i:i + 500]
+                    where = 'course_instance_id IN ({0})'.format(
+                        ', '.join('?' * len(chunk)))
+                    self.conn.execute('DELETE FROM comment_text WHERE docid ' +
+                        'IN (SELECT comment_id FROM comment_info WHERE ' +
+                        where + ')', chunk)
+                    self.conn.execute('DELETE FROM comment_info WHERE ' +
+                        where, chunk)
+                self._insert(rows)
+                self.conn.execute('COMMIT')
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    # Adds rows like replace's without removing anything
+    def add(self, rows):
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self._insert(rows)
+                self.conn.execute('COMMIT')
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def _insert(self, rows):
+        rows = list(rows)
+        self.conn.executemany('INSERT OR REPLACE INTO comment_info ' +
+            '(comment_id, course_instance_id, field, year, term) ' +
+            'VALUES (?, ?, ?, ?, ?)', [row[:5] for row in rows])
+        self.conn.executemany('INSERT INTO comment_text (docid, comment) ' +
+            'VALUES (?, ?)', [(row[0], row[5]) for row in rows])
+
+    # Returns the comments matching query (FTS4 syntax: words, "phrases",
+    # OR, -word, prefix*), best first, as dicts of comment_id,
+    # course_instance_id, field, year, term, score and snippet (the matching
+    # words in [brackets]).  Raises ValueError if query can't be parsed.
+    def search(self, query, field=None, year=None, term=None, limit=20,
+            offset=0):
+        filters = []
+        args = [query]
+        for name, value in [('field', field), ('year', year), ('term', term)]:
+            if value is not None:
+                filters.append(' AND i.{0} = ?'.format(name))
+                args.append(value)
+        with self.lock:
+            try:
+                rows = self.conn.execute('SELECT i.comment_id, ' +
+                    'i.course_instance_id, i.field, i.year, i.term, m.score ' +
+                    'FROM (SELECT docid, ' +
+                    "bm25(matchinfo(comment_text, 'pcnalx')) AS score " +
+                    'FROM comment_text WHERE comment_text MATCH ?) AS m ' +
+                    'JOIN comment_info i ON i.comment_id = m.docid' +
+                    ''.join(filters) +
+                    ' ORDER BY m.score DESC, i.comment_id LIMIT ? OFFSET ?',
+                    args + [limit, offset]).fetchall()
+                # Snippets only for the page of results
+                snippets = {}
+                if rows:
+                    ids = [row[0] for row in rows]
+                    snippets = dict(self.conn.execute('SELECT docid, ' +
+                        "snippet(comment_text, '[', ']', '...', -1, 16) " +
+                        'FROM comment_text WHERE comment_text MATCH ? ' +
+                        'AND docid IN ({0})'.format(', '.join('?' * len(ids))),
+                        [query] + ids).fetchall())
+            except sqlite3.OperationalError as e:
+                raise ValueError('Bad search query {0!r}: {1}'.format(query,
+                    e))
+        columns = ['comment_id', 'course_instance_id', 'field', 'year',
+            'term', 'score']
+        results = []
+        for row in rows:
+            result = dict(zip(columns, row))
+            result['snippet'] = snippets.get(row[0], '')
+            results.append(result)
+        return results
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM comment_info')\
+                .fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM comment_text')
+            self.conn.execute('DELETE FROM comment_info')
+
+    # Merges the FTS4 index segments, which makes queries faster after a lot
+    # of small updates
+    def optimize(self):
+        with self.lock:
+            self.conn.execute("INSERT INTO comment_text (comment_text) " +
+                "VALUES ('optimize')")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Okapi BM25 from FTS4's matchinfo(..., 'pcnalx'): phrases, columns, rows,
+# average tokens per column, this row's tokens per column, then hits in this
+# row, hits in all rows and rows with hits for every phrase and column
+def bm25(matchinfo, k1=1.2, b=0.75):
+    info = struct.unpack('@{0}I'.format(len(matchinfo) // 4), str(matchinfo))
+    phrases, columns, rows = info[:3]
+    average = info[3:3 + columns]
+    length = info[3 + columns:3 + 2 * columns]
+    hits = info[3 + 2 * columns:]
+    score = 0.0
+    for i in range(phrases):
+        for j in range(columns):
+            row_hits, all_hits, docs = hits[3 * (i * columns + j):
+                3 * (i * columns + j) + 3]
+            if not row_hits:
+                continue
+            # Words in most comments would get a negative weight
+            idf = max(math.log((rows - docs + 0.5) / (docs + 0.5)), 0.01)
+            norm = 1 - b + b * float(length[j]) / (average[j] or 1)
+            score += idf * row_hits * (k1 + 1) / (row_hits + k1 * norm)
+    return score
+
+SEARCH_INDEX = None
+SEARCH_INDEX_LOCK = threading.Lock()
+
+def use_search_index(filename):
+    global SEARCH_INDEX
+    with SEARCH_INDEX_LOCK:
+        SEARCH_INDEX = CommentIndex(filename)
+
+# Opens settings.SEARCH_INDEX the first time it's needed
+def get_search_index():
+    global SEARCH_INDEX
+    with SEARCH_INDEX_LOCK:
+        if SEARCH_INDEX is None:
+            SEARCH_INDEX = CommentIndex(settings.SEARCH_INDEX)
+        return SEARCH_INDEX
+
+# Searches the comments; see CommentIndex.search
+def search_comments(query, field=None, year=None, term=None, limit=20,
+        offset=0):
+    return get_search_index().search(query, field, year, term, limit, offset)
+
+# Re-indexes the comments of course instances cinst_ids from the database.
+# Does nothing if settings.SEARCH_INDEX is None.
+def index_course_instances(cinst_ids):
+    if settings.SEARCH_INDEX is None or not cinst_ids:
+        return
+    get_search_index().replace(cinst_ids, comment_rows(
+        Comment.objects.filter(course__in=cinst_ids)))
+
+# Indexes every comment in the database from scratch.  Returns the number
+# indexed.
+def rebuild_index(chunk_size=CHUNK_SIZE):
+    index = get_search_index()
+    index.clear()
+    count = 0
+    last_pk = 0
+    while True:
+        rows = list(comment_rows(Comment.objects.filter(pk__gt=last_pk)\
+            .order_by('pk'))[:chunk_size])
+        if not rows:
+            break
+        index.add(rows)
+        count += len(rows)
+        last_pk = rows[-1][0]
+    index.optimize()
+    return count
+
+# Rows for CommentIndex.replace from a queryset of Comments
+def comment_rows(comments):
+    return comments.values_list('id', 'course',
+        'course__course__field__abbreviation', 'course__year', 'course__term',
+        'comment')
@@ -0,0 +1,229 @@
+################################################################################
+# Sharded scraping.  A scrape splits into (year, term, department) units that #
+# don't depend on each other.  A coordinator queues them in the WorkUnit      #
+# table and starts worker processes.  Each worker claims one unit at a time,  #
+# scrapes it and saves it into the shared database.  Workers on other         #
+# machines can join by running `scrape --worker --run <id>` against the same  #
+# database.                                                                    #
+#                                                                              #
+# Claims are atomic UPDATEs, so no two workers get the same unit.  Workers    #
+# save through a locking CourseWriter, so Field, Course and Instructor rows   #
+# are never created twice.  A claim that is older than                        #
+# settings.SCRAPER_CLAIM_TIMEOUT (its worker died) goes back in the queue.    #
+################################################################################
+
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from qscraper import settings
+from scrape import *
+from writer import INSERT_BATCH
+
+# Seconds between looks at the work queue
+POLL_INTERVAL = 5
+
+# Queues a unit per department for a new or resumed run, starts processes
+# local workers with spawn (a function taking the run and a worker number and
+# returning a Popen), and waits until every unit is done.  Terms whose units
+# are all done are recorded in the ledger; the run only finishes if every
+# unit did.
+def coordinate(cookie, processes, spawn, workers=settings.SCRAPER_WORKERS,
+        per_host=settings.SCRAPER_PER_HOST, incremental=False, transport=None,
+        resume=False):
+    fetcher = None
+    procs = []
+    try:
+        run = start_run(incremental, resume)
+        checkpoints = Checkpoints(run)
+        plan = plan_run(run, checkpoints)
+
+        fetcher = make_fetcher(cookie, workers, per_host, transport)
+        enqueue_plan(run, fetcher, plan, checkpoints)
+        fetcher.close()
+        fetcher = None
+
+        procs = [spawn(run, i) for i in range(processes)]
+        log('STARTED {0} WORKERS FOR RUN {1}'.format(processes, run.pk),
+            stage='coordinate')
+        counts = wait_for_units(run, procs)
+
+        for year, term, refresh in plan:
+            if not WorkUnit.objects.filter(run=run, year=year, term=term)\
+                    .exclude(state=WorkUnit.DONE).exists():
+                finish_term(run, year, term)
+        unfinished = sum(n for state, n in counts.items()
+            if state != WorkUnit.DONE)
+        if unfinished:
+            log_error('{0} units not done; '.format(unfinished) +
+                'run scrape --coordinator --resume to try them again',
+                'GENERAL', 'coordinate')
+        else:
+            finish_run(run)
+            log('DONE!')
+    except CookieExpired:
+        log_error('Cookie no longer valid; run scrape --resume with a new ' +
+            'one to carry on', 'GENERAL')
+    except Exception as e:
+        log_error('{0} - {1}\n{2}'.format(e.__class__, e, traceback.format_exc()), 'GENERAL')
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+        if fetcher is not None:
+            fetcher.close()
+        send_alerts()
+
+# Claims and scrapes units of run until none are left
+#
+# name - identifies this worker in WorkUnit.worker
+def work(cookie, run_id, name, workers=settings.SCRAPER_WORKERS,
+        per_host=settings.SCRAPER_PER_HOST,
+        batch_size=settings.SCRAPER_BATCH_SIZE, transport=None):
+    fetcher = None
+    try:
+        run = ScrapeRun.objects.get(pk=run_id)
+        checkpoints = Checkpoints(run)
+        fetcher = make_fetcher(cookie, workers, per_host, transport)
+        writer = CourseWriter(batch_size, run, lock=True)
+
+        counter = 1
+        while True:
+            unit = claim_unit(run, name)
+            if unit is None:
+                if not unit_counts(run).get(WorkUnit.CLAIMED):
+                    break
+                # Another worker may die and leave its unit to be reclaimed
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            log('SCRAPING {0} TERM {1} {2}'.format(unit.year, unit.term,
+                unit.dept), stage='shard')
+            failed = []
+            try:
+                counter = scrape_course_list(fetcher, writer, [unit.dept],
+                    unit.term, unit.year, counter, unit.refresh, checkpoints,
+                    failed)
+            except CookieExpired:
+                release_unit(unit)
+                raise
+            except Exception as e:
+                log_error('{0} - {1}\n{2}'.format(e.__class__, e,
+                    traceback.format_exc()), 'GENERAL', 'shard')
+                fail_unit(unit, e)
+            else:
+                if failed:
+                    fail_unit(unit, IOError('No course list for {0}'.format(
+                        unit.dept)))
+                else:
+                    finish_unit(unit)
+        log_metrics()
+        log('DONE!')
+    except CookieExpired:
+        log_error('Cookie no longer valid; run scrape --coordinator ' +
+            '--resume with a new one to carry on', 'GENERAL')
+    except Exception as e:
+        log_error('{0} - {1}\n{2}'.format(e.__class__, e, traceback.format_exc()), 'GENERAL')
+    finally:
+        if fetcher is not None:
+            fetcher.close()
+        send_alerts()
+
+# Queues a unit for every department of the planned terms that run hasn't
+# saved yet, and puts units an earlier coordinator of run left unfinished
+# back in the queue
+def enqueue_plan(run, fetcher, plan, checkpoints):
+    existing = set(WorkUnit.objects.filter(run=run)\
+        .values_list('year', 'term', 'dept'))
+    units = []
+    for (year, term, refresh), dept_list_html in \
+            zip(plan, fetch_dept_lists(fetcher, plan)):
+        if dept_list_html is None:
+            continue
+        for dept in parse_dept_list(dept_list_html):
+            if (year, term, dept) not in existing and \
+                    not checkpoints.dept_done(year, term, dept):
+                units.append(WorkUnit(run=run, year=year, term=term,
+                    dept=dept, refresh=refresh))
+    WorkUnit.objects.bulk_create(units, INSERT_BATCH)
+    WorkUnit.objects.filter(run=run).exclude(state=WorkUnit.DONE)\
+        .update(state=WorkUnit.PENDING, worker='', claimed_at=None)
+    log('QUEUED {0} UNITS'.format(len(units)), stage='coordinate')
+
+# Polls the queue until no unit is pending or claimed, or every local worker
+# in procs has exited.  Returns the number of units in each state.
+def wait_for_units(run, procs):
+    while True:
+        refresh_snapshot()
+        release_stale(run)
+        counts = unit_counts(run)
+        if not counts.get(WorkUnit.PENDING) and \
+                not counts.get(WorkUnit.CLAIMED):
+            return counts
+        if procs and all(proc.poll() is not None for proc in procs):
+            log_warning('Every worker exited with units left', 'GENERAL',
+                'coordinate')
+            return counts
+        log('UNITS: ' + json.dumps(counts, sort_keys=True),
+            stage='coordinate')
+        time.sleep(POLL_INTERVAL)
+
+# Returns a pending unit of run, claimed for worker, or None
+def claim_unit(run, worker):
+    while True:
+        refresh_snapshot()
+        pks = list(WorkUnit.objects.filter(run=run, state=WorkUnit.PENDING)\
+            .order_by('pk').values_list('pk', flat=True)[:1])
+        if not pks:
+            return None
+        # Only one worker's UPDATE can match; the others try the next unit
+        if WorkUnit.objects.filter(pk=pks[0], state=WorkUnit.PENDING)\
+                .update(state=WorkUnit.CLAIMED, worker=worker,
+                claimed_at=timezone.now(), attempts=F('attempts') + 1):
+            return WorkUnit.objects.get(pk=pks[0])
+
+def finish_unit(unit):
+    WorkUnit.objects.filter(pk=unit.pk).update(state=WorkUnit.DONE)
+
+def fail_unit(unit, error):
+    WorkUnit.objects.filter(pk=unit.pk).update(state=WorkUnit.FAILED,
+        error='{0} - {1}'.format(error.__class__.__name__, error))
+
+# Puts a claimed unit back in the queue
+def release_unit(unit):
+    WorkUnit.objects.filter(pk=unit.pk).update(state=WorkUnit.PENDING,
+        worker='', claimed_at=None)
+
+# Puts units claimed longer than settings.SCRAPER_CLAIM_TIMEOUT ago back in
+# the queue, or fails them if they've been claimed
+# settings.SCRAPER_CLAIM_ATTEMPTS times already, so a unit that kills every
+# worker that takes it isn't handed out forever
+def release_stale(run):
+    cutoff = timezone.now() - timedelta(seconds=settings.SCRAPER_CLAIM_TIMEOUT)
+    stale = WorkUnit.objects.filter(run=run, state=WorkUnit.CLAIMED,
+        claimed_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=settings.SCRAPER_CLAIM_ATTEMPTS)\
+        .update(state=WorkUnit.FAILED, error='Claimed {0} times'.format(
+        settings.SCRAPER_CLAIM_ATTEMPTS) + ' without finishing')
+    released = stale.update(state=WorkUnit.PENDING, worker='',
+        claimed_at=None)
+    if failed:
+        log_error('Gave up on {0} units'.format(failed) +
+            ' whose workers kept dying', 'GENERAL', 'coordinate')
+    if released:
+        log_warning('Released {0} stale units'.format(released), 'GENERAL',
+            'coordinate')
+
+def unit_counts(run):
+    return dict(WorkUnit.objects.filter(run=run).values_list('state')\
+        .annotate(Count('pk')).order_by())
+
+# Ends the connection's current transaction, which only reads, so the next
+# query sees what other processes have committed since
+def refresh_snapshot():
+    transaction.commit_unless_managed()
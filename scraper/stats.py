@@ -0,0 +1,100 @@
+################################################################################
+# Precomputed rating statistics.  CourseStats, InstructorStats and FieldStats #
+# hold each category's ratings summed per course, instructor and field per    #
+# term (histogram counts, responses and values), so trends and averages are   #
+# read from a few rows instead of aggregated from every rating through        #
+# CourseInstance, Course and Field.                                           #
+#                                                                              #
+# Stats are rebuilt a term at a time with one GROUP BY per table.  A refresh  #
+# remembers the last run it covered; the next one only rebuilds the terms     #
+# that runs since then saved courses in.                                      #
+################################################################################
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from export import changed_terms, exported_run
+from models import *
+from writer import INSERT_BATCH
+
+SUMMED = ['num_responses', 'ones', 'twos', 'threes', 'fours', 'fives']
+
+# Stats tables: (model, its foreign key, function taking a year and term and
+# returning the ratings to sum, lookup of the foreign key's value in them)
+TABLES = [
+    (CourseStats, 'course',
+        lambda year, term: CourseRating.objects.filter(
+            course_instance__year=year, course_instance__term=term),
+        'course_instance__course'),
+    (InstructorStats, 'instructor',
+        lambda year, term: InstructorRating.objects.filter(
+            instructor_relation__course_instance__year=year,
+            instructor_relation__course_instance__term=term),
+        'instructor_relation__instructor'),
+    (FieldStats, 'field',
+        lambda year, term: CourseRating.objects.filter(
+            course_instance__year=year, course_instance__term=term),
+        'course_instance__course__field'),
+]
+
+# Rebuilds the stats of the terms changed since the last refresh, or of every
+# term if full.  Returns the (year, term)s rebuilt.
+def refresh_stats(full=False):
+    last = StatsRefresh.objects.order_by('-pk')[:1]
+    if full or not last:
+        return refresh_all()
+    yearterms = changed_terms(last[0].run_id)
+
+    # Runs still going may save more, so they're looked at again next time
+    run = exported_run()
+    for year, term in yearterms:
+        refresh_term(year, term)
+    StatsRefresh.objects.create(run_id=run)
+    return yearterms
+
+# Empties the stats tables and rebuilds every term in one transaction, so
+# readers never see them empty or half rebuilt, and a failure leaves the old
+# stats in place.  commit_on_success commits on the way out even when nested,
+# so this can't go through refresh_term.
+@transaction.commit_on_success
+def refresh_all():
+    yearterms = changed_terms(None)
+    run = exported_run()
+    for model, key, ratings, lookup in TABLES:
+        model.objects.all().delete()
+    for year, term in yearterms:
+        rebuild_term(year, term)
+    StatsRefresh.objects.create(run_id=run)
+    return yearterms
+
+# Replaces a term's rows in every stats table, in one transaction
+@transaction.commit_on_success
+def refresh_term(year, term):
+    rebuild_term(year, term)
+
+def rebuild_term(year, term):
+    for model, key, ratings, lookup in TABLES:
+        model.objects.filter(year=year, term=term).delete()
+        model.objects.bulk_create([model(year=year, term=term, **values)
+            for values in sum_ratings(ratings(year, term), lookup, key)],
+            INSERT_BATCH)
+
+# Yields the field values of a stats row for each (lookup, category) in
+# ratings, with the value of lookup named key
+def sum_ratings(ratings, lookup, key):
+    # Aliases can't be the names of fields of the rating models
+    sums = dict(('sum_' + name, Sum(name)) for name in SUMMED)
+    rows = ratings.values(lookup, 'category').annotate(rated=Count('pk'),
+        value_count=Count('value'), value_sum=Sum('value'), **sums)\
+        .order_by()
+    for row in rows:
+        values = {
+            key + '_id':   row[lookup],
+            'category_id': row['category'],
+            'rated':       row['rated'],
+            'value_count': row['value_count'],
+            'value_sum':   float(row['value_sum'] or 0),
+        }
+        for name in SUMMED:
+            values[name] = row['sum_' + name] or 0
+        yield values
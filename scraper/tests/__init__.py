@@ -0,0 +1,17 @@
+# Django 1.5's test runner only looks in scraper.tests, so every test module
+# is pulled in here
+from test_alerts import *
+from test_export import *
+from test_fetch import *
+from test_metrics import *
+from test_pagestore import *
+from test_parse import *
+from test_pipeline import *
+from test_ratings import *
+from test_reparse import *
+from test_scrape import *
+from test_search import *
+from test_shard import *
+from test_stats import *
+from test_views import *
+from test_writer import *
@@ -0,0 +1,66 @@
+################################################################################
+# Helpers shared by the scraper's tests.  The scraper reads qscraper.settings  #
+# directly rather than django.conf.settings, so override_settings can't reach  #
+# it; the test cases here patch the module instead and put it back after each  #
+# test.  They also turn off the search index unless a test asks for one, send  #
+# the scraper's logs to a scratch directory and keep alerts from being mailed. #
+################################################################################
+
+import logging
+import shutil
+import tempfile
+
+from django.test import TestCase, TransactionTestCase
+
+from scraper import scrape, scrapelog
+from qscraper import settings
+
+class ScraperTestMixin(object):
+    def setUp(self):
+        self.patch_settings(SEARCH_INDEX=None)
+        log_dir = self.scratch_dir()
+        self.addCleanup(self.restore_logging, scrape.LOG_DIR)
+        scrape.LOG_DIR = log_dir
+        scrape.configure_logging('DEBUG')
+        scrape.disable_alerts()
+
+    def restore_logging(self, log_dir):
+        writer = scrapelog.get_writer()
+        if writer is not None:
+            logging.getLogger(scrapelog.LOGGER_NAME).removeHandler(writer)
+            writer.close()
+        scrape.LOG_DIR = log_dir
+        scrape.LOG_WRITER = None
+        if scrape.ALERTS is not None:
+            scrape.ALERTS.close()
+        scrape.ALERTS = None
+
+    # Sets attributes of qscraper.settings until the end of the test
+    def patch_settings(self, **values):
+        for name, value in values.items():
+            self.addCleanup(setattr, settings, name, getattr(settings, name))
+            setattr(settings, name, value)
+
+    # A directory removed at the end of the test
+    def scratch_dir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return directory
+
+class ScraperTestCase(ScraperTestMixin, TestCase):
+    pass
+
+# For tests that need real commits and rollbacks, which TestCase turns off
+class ScraperTransactionTestCase(ScraperTestMixin, TransactionTestCase):
+    pass
+
+# A clock for Fetchers and rate limiters that only moves when told to
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
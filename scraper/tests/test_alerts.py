@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.test.utils import override_settings
+
+from scraper import scrape
+from scraper.alerts import AlertDigest, LocalSMTPServer
+
+from base import ScraperTestCase
+
+TIMEOUT = 10
+
+FETCH_ERROR = ("<class 'urllib2.URLError'> - <urlopen error timed out> " +
+    "(path: {0}, attempt 6): giving up")
+HISTOGRAM_ERROR = ('Score breakdown page unexpectedly displays no ' +
+    'breakdown (path: histogram.html?course_id=1001&q=0)')
+
+# Errors mailed through scrape.send_alert and Django's SMTP backend to a
+# LocalSMTPServer
+class AlertDigestTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.server = LocalSMTPServer().start()
+        self.addCleanup(self.server.stop)
+        smtp = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.port)
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+        self.patch_settings(FROM_EMAIL='scraper@example.com',
+            ALERT_RECIPIENTS=['ops@example.com'])
+        self.threads = []
+        self.sending = threading.Event()
+        self.sending.set()
+        self.digest = AlertDigest(self.send, interval=600, samples=2)
+        self.addCleanup(self.digest.close)
+
+    def send(self, subject, body):
+        self.threads.append(threading.current_thread().name)
+        self.sending.wait(TIMEOUT)
+        scrape.send_alert(subject, body)
+
+    def wait_for_messages(self, n):
+        deadline = time.time() + TIMEOUT
+        while len(self.server.messages) < n and time.time() < deadline:
+            time.sleep(0.01)
+        return self.server.messages
+
+    # The first error goes out at once; the ones after it wait out the
+    # interval (or a flush) and come as one digest, counted by kind
+    def test_errors_are_grouped_into_rate_limited_digests(self):
+        self.digest.add('Cookie no longer valid', 'GENERAL')
+        first, = self.wait_for_messages(1)
+        self.assertEqual(first['Subject'], 'scraper: 1 error')
+        self.assertEqual(first['To'], 'ops@example.com')
+
+        for path in ['a', 'b', 'c']:
+            self.digest.add(FETCH_ERROR.format(path), 'GENERAL')
+        self.digest.add(HISTOGRAM_ERROR, 1001)
+        time.sleep(0.2)
+        self.assertEqual(len(self.server.messages), 1)
+
+        self.digest.flush()
+        second = self.wait_for_messages(2)[1]
+        self.assertEqual(second['Subject'], 'scraper: 4 errors')
+        body = second.get_payload()
+        self.assertIn('     3  urllib2.URLError\n', body)
+        self.assertIn('     1  Score breakdown page unexpectedly displays ' +
+            'no breakdown\n', body)
+        self.assertIn('First 2:\nGENERAL: ' + FETCH_ERROR.format('a') +
+            '\nGENERAL: ' + FETCH_ERROR.format('b') + '\n', body)
+        self.assertNotIn(HISTOGRAM_ERROR, body)
+
+    # Logging an error never waits on SMTP
+    def test_digests_are_sent_off_the_scrape_thread(self):
+        self.sending.clear()
+        start = time.time()
+        for i in range(20):
+            self.digest.add(FETCH_ERROR.format(i), 'GENERAL')
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.server.messages, [])
+        self.sending.set()
+        self.digest.flush()
+        # The first error may have gone out on its own before the rest came
+        self.assertEqual(sum(int(message['Subject'].split()[1])
+            for message in self.server.messages), 20)
+        self.assertEqual(set(self.threads), set(['alerts']))
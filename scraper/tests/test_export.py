@@ -0,0 +1,166 @@
+import csv
+import gzip
+import json
+import os
+import unittest
+
+from django.core.exceptions import FieldError
+from django.utils import timezone
+
+from scraper import export, fixtures, scrape
+from scraper.checkpoint import get_resumable_run
+from scraper.models import *
+from scraper.writer import CourseWriter
+
+from base import ScraperTestCase
+
+class ExportedRunTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.patch_settings(SCRAPER_REFRESH_STATS=False)
+
+    # A run that crashed and was never resumed holds back exports only until
+    # the next run starts
+    def test_new_runs_give_up_on_crashed_ones(self):
+        done = ScrapeRun.objects.create(finished=timezone.now(),
+            succeeded=True)
+        crashed = ScrapeRun.objects.create()
+        self.assertEqual(export.exported_run(), done.pk)
+
+        run = scrape.start_run(incremental=True)
+        crashed = ScrapeRun.objects.get(pk=crashed.pk)
+        self.assertIsNotNone(crashed.finished)
+        self.assertFalse(crashed.succeeded)
+        self.assertEqual(get_resumable_run(), run)
+        self.assertEqual(export.exported_run(), crashed.pk)
+
+        scrape.finish_run(run)
+        self.assertEqual(export.exported_run(), run.pk)
+
+    def test_resuming_keeps_the_run_open(self):
+        crashed = ScrapeRun.objects.create()
+        self.assertEqual(scrape.start_run(True, resume=True), crashed)
+        self.assertIsNone(ScrapeRun.objects.get(pk=crashed.pk).finished)
+
+# The rows of a gzipped CSV export file, header first
+def read_csv(filename):
+    with gzip.open(filename) as f:
+        return list(csv.reader(f))
+
+class ExportTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.out_dir = self.scratch_dir()
+        # Four courses, each in a term of its own
+        self.courses = fixtures.course_dicts(4, comments=3)
+        self.yearterms = sorted(set((course['year'], course['term'])
+            for course in self.courses), reverse=True)
+        self.assertEqual(len(self.yearterms), 4)
+        self.first_run = self.save(self.courses)
+
+    # Saves courses in a finished run and returns it
+    def save(self, courses):
+        run = ScrapeRun.objects.create()
+        writer = CourseWriter(run=run)
+        for course in courses:
+            writer.add(course)
+        writer.flush()
+        run.finished = timezone.now()
+        run.succeeded = True
+        run.save()
+        return run
+
+    def filename(self, table, year, term, ext='csv.gz'):
+        return os.path.join(self.out_dir, table,
+            '{0}-{1}.{2}'.format(year, term, ext))
+
+    def test_writes_a_file_per_table_and_term(self):
+        # Small chunks, so tables take more than one
+        self.assertEqual(export.export(self.out_dir, 'csv', chunk_size=2),
+            self.yearterms)
+        for name, rows, columns in export.TABLES:
+            self.assertEqual(sorted(os.listdir(os.path.join(self.out_dir,
+                name))), sorted('{0}-{1}.csv.gz'.format(year, term)
+                for year, term in self.yearterms))
+            for year, term in self.yearterms:
+                rows = read_csv(self.filename(name, year, term))
+                self.assertEqual(rows[0],
+                    [column for column, lookup, dtype in columns])
+
+        for course in self.courses:
+            year, term = course['year'], course['term']
+            rows = read_csv(self.filename('course_instances', year, term))
+            self.assertEqual(len(rows), 2)
+            header, row = rows
+            row = dict(zip(header, row))
+            self.assertEqual((row['qcourse_id'], row['title'], row['year'],
+                row['enrollment']), (str(course['id']), course['title'],
+                str(year), str(course['enrollment'])))
+            comments = read_csv(self.filename('comments', year, term))[1:]
+            self.assertEqual(sorted(row[2] for row in comments),
+                sorted(course['comments']))
+            ratings = read_csv(self.filename('course_ratings', year, term))
+            self.assertEqual(len(ratings) - 1, len(course['ratings']))
+
+        with open(os.path.join(self.out_dir, export.SCHEMA_FILE)) as f:
+            schema = json.load(f)
+        self.assertEqual(sorted(schema), sorted(name
+            for name, rows, columns in export.TABLES))
+        self.assertEqual(schema['comments'], [['id', 'int'],
+            ['course_instance_id', 'int'], ['comment', 'str']])
+        self.assertEqual(export.read_state(self.out_dir),
+            {'run': self.first_run.pk, 'format': 'csv'})
+
+    # The next export only rewrites the terms a newer run saved courses in
+    def test_incremental_exports_write_changed_terms(self):
+        export.export(self.out_dir, 'csv')
+        filenames = [self.filename(name, year, term)
+            for name, rows, columns in export.TABLES
+            for year, term in self.yearterms]
+        for filename in filenames:
+            with open(filename, 'w') as f:
+                f.write('stale')
+        self.assertEqual(export.export(self.out_dir, 'csv'), [])
+
+        changed = dict(self.courses[1], title='Renamed')
+        run = self.save([changed])
+        yearterm = (changed['year'], changed['term'])
+        self.assertEqual(export.changed_terms(self.first_run.pk), [yearterm])
+        self.assertEqual(export.export(self.out_dir, 'csv'), [yearterm])
+        for filename in filenames:
+            with open(filename) as f:
+                stale = f.read() == 'stale'
+            self.assertEqual(stale, not filename.endswith(
+                '{0}-{1}.csv.gz'.format(*yearterm)), filename)
+        rows = read_csv(self.filename('course_instances', *yearterm))
+        self.assertEqual(rows[1][rows[0].index('title')], 'Renamed')
+        self.assertEqual(export.read_state(self.out_dir)['run'], run.pk)
+
+        # Unless a full export is asked for, or the format changes
+        self.assertEqual(export.export(self.out_dir, 'csv', full=True),
+            self.yearterms)
+
+    def test_failed_writes_leave_no_file(self):
+        filename = self.filename('comments', 2012, 1)
+        os.makedirs(os.path.dirname(filename))
+        with self.assertRaises(FieldError):
+            export.write_table(filename, 'csv', Comment.objects.all(),
+                [('id', 'id', 'int'), ('text', 'text', 'str')], 2)
+        self.assertEqual(os.listdir(os.path.dirname(filename)), [])
+
+    @unittest.skipIf(export.pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_matches_csv(self):
+        csv_dir = self.scratch_dir()
+        export.export(csv_dir, 'csv')
+        export.export(self.out_dir, 'parquet', chunk_size=2)
+        for name, rows, columns in export.TABLES:
+            for year, term in self.yearterms:
+                table = export.pyarrow.parquet.read_table(
+                    self.filename(name, year, term, 'parquet'))
+                self.assertEqual(table.column_names,
+                    [column for column, lookup, dtype in columns])
+                rows = read_csv(os.path.join(csv_dir, name,
+                    '{0}-{1}.csv.gz'.format(year, term)))[1:]
+                self.assertEqual(table.num_rows, len(rows))
+        self.assertEqual(export.read_state(self.out_dir)['format'],
+            'parquet')
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from scraper.fetch import Fetcher
+from scraper.ratelimit import AdaptiveRateLimiter
+from scraper.retry import DeadLetters, RetryPolicy
+from scraper.transport import FixtureTransport
+
+from base import FakeClock, ScraperTestCase
+
+BASE_URL = 'https://example.com/fas/'
+
+# Seconds of real time a test waits for the Fetcher's threads
+TIMEOUT = 10
+
+# Serves pages from a directory through a FixtureTransport, failing each path
+# with the exceptions queued for it first.  Records every call as (path,
+# clock time) and the paths served.
+class FlakyPages(object):
+    def __init__(self, directory, clock):
+        self.transport = FixtureTransport(directory)
+        self.clock = clock
+        self.failures = {}
+        self.calls = []
+        self.served = set()
+        self.lock = threading.Lock()
+
+    def fail(self, path, *errors):
+        self.failures[path] = list(errors)
+
+    def __call__(self, path, refresh=False):
+        with self.lock:
+            self.calls.append((path, self.clock()))
+            errors = self.failures.get(path)
+            if errors:
+                raise errors.pop(0)
+            self.served.add(path)
+        return self.transport.get(path)[1]
+
+    def times(self, path):
+        return [t for p, t in self.calls if p == path]
+
+class FetcherTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.directory = self.scratch_dir()
+        for name in ['a', 'b', 'c']:
+            with open(os.path.join(self.directory, name + '?x=1'), 'w') as f:
+                f.write('page ' + name)
+        self.clock = FakeClock()
+        self.pages = FlakyPages(self.directory, self.clock)
+        self.dead_letters = DeadLetters(os.path.join(self.directory,
+            'dead_letters.jsonl'))
+        self.fetchers = []
+
+    def tearDown(self):
+        for fetcher in self.fetchers:
+            fetcher.close()
+
+    def fetcher(self, **kwargs):
+        options = dict(workers=1, dead_letters=self.dead_letters,
+            policy=RetryPolicy(base_delay=10, max_delay=60, max_attempts=4,
+                jitter=0), clock=self.clock)
+        options.update(kwargs)
+        fetcher = Fetcher(self.pages, BASE_URL, **options)
+        self.fetchers.append(fetcher)
+        return fetcher
+
+    # Runs fetcher.get_all(paths) in another thread, moving the clock on a
+    # second at a time whenever every path that isn't served or given up on
+    # is waiting for a retry that isn't due yet, so nothing is in the middle
+    # of a download while it moves.  Returns the results.
+    def get_all(self, fetcher, paths, **kwargs):
+        results = []
+        t = threading.Thread(target=lambda: results.append(
+            fetcher.get_all(paths, **kwargs)))
+        t.daemon = True
+        t.start()
+        deadline = time.time() + TIMEOUT
+        while t.is_alive() and time.time() < deadline:
+            with fetcher.retry_cond:
+                with self.pages.lock:
+                    pending = len(set(paths) - self.pages.served) - \
+                        len(self.dead_letters.entries())
+                if pending and len(fetcher.retries) == pending and \
+                        fetcher.retries[0][0] > self.clock():
+                    self.clock.advance(1)
+                    fetcher.retry_cond.notify_all()
+            time.sleep(0.001)
+        t.join(0)
+        self.assertFalse(t.is_alive(), 'get_all never finished')
+        return results[0]
+
+    def test_fetches_in_order(self):
+        fetcher = self.fetcher(workers=3)
+        self.assertEqual(self.get_all(fetcher, ['c?x=1', 'a?x=1', 'b?x=1']),
+            ['page c', 'page a', 'page b'])
+
+    def test_retries_the_configured_exceptions(self):
+        fetcher = self.fetcher(retry_on=(KeyError,))
+        self.pages.fail('a?x=1', KeyError('flaky'), KeyError('flaky'))
+        self.assertEqual(self.get_all(fetcher, ['a?x=1']), ['page a'])
+        self.assertEqual(len(self.pages.times('a?x=1')), 3)
+        self.assertEqual(self.dead_letters.entries(), [])
+
+    def test_other_exceptions_reach_the_caller(self):
+        fetcher = self.fetcher()
+        self.pages.fail('a?x=1', ValueError('bug'))
+        self.assertRaises(ValueError, fetcher.get_all, ['a?x=1', 'b?x=1'])
+        self.assertEqual(len(self.pages.times('a?x=1')), 1)
+
+    def test_gives_up_into_the_dead_letters(self):
+        failures = []
+        fetcher = self.fetcher(
+            on_failure=lambda *args: failures.append(args[2:]))
+        self.pages.fail('a?x=1', *[IOError('down')] * 10)
+        self.assertEqual(self.get_all(fetcher, ['a?x=1', 'b?x=1'],
+            context={'id': 7}), [None, 'page b'])
+        self.assertEqual(len(self.pages.times('a?x=1')), 4)
+        self.assertEqual(failures,
+            [(1, False), (2, False), (3, False), (4, True)])
+        entries = self.dead_letters.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['path'], 'a?x=1')
+        self.assertEqual(entries[0]['attempts'], 4)
+        self.assertEqual(entries[0]['error'], 'IOError - down')
+        self.assertEqual(entries[0]['context'], {'id': 7})
+
+    # Each retry waits twice as long as the one before, up to max_delay, and
+    # retries come off the heap in the order they're due, not the order
+    # their paths failed in
+    def test_backs_off_exponentially(self):
+        fetcher = self.fetcher(policy=RetryPolicy(base_delay=10,
+            max_delay=30, max_attempts=6, jitter=0))
+        self.pages.fail('a?x=1', *[IOError('down')] * 4)
+        self.pages.fail('b?x=1', IOError('down'))
+        self.assertEqual(self.get_all(fetcher, ['a?x=1', 'b?x=1']),
+            ['page a', 'page b'])
+        start = self.pages.times('a?x=1')[0]
+        self.assertEqual([t - start for t in self.pages.times('a?x=1')],
+            [0, 10, 30, 60, 90])
+        self.assertEqual([t - start for t in self.pages.times('b?x=1')],
+            [0, 10])
+        times = [t for path, t in self.pages.calls]
+        self.assertEqual(times, sorted(times))
+
+    def test_invalid_pages_are_retried_with_refresh(self):
+        invalid = []
+        seen = []
+        fetcher = self.fetcher(on_invalid=invalid.append,
+            policy=RetryPolicy(base_delay=0, jitter=0))
+        def validate(contents):
+            seen.append(contents)
+            return len(seen) > 1
+        self.assertEqual(self.get_all(fetcher, ['a?x=1'], validate=validate),
+            ['page a'])
+        self.assertEqual(invalid, ['a?x=1'])
+        self.assertEqual(len(self.pages.times('a?x=1')), 2)
+
+    def test_caps_requests_per_host(self):
+        in_flight = [0, 0]
+        lock = threading.Lock()
+        def slow(path, refresh=False):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+            return path
+        fetcher = Fetcher(slow, BASE_URL, workers=6, per_host=2)
+        self.fetchers.append(fetcher)
+        paths = ['p?x={0}'.format(i) for i in range(12)]
+        self.assertEqual(fetcher.get_all(paths), paths)
+        self.assertEqual(in_flight[1], 2)
+
+    def test_stored_pages_skip_the_host(self):
+        limiters = []
+        def limiter():
+            limiters.append(AdaptiveRateLimiter(burst=100, clock=self.clock))
+            return limiters[-1]
+        stored = {'a?x=1': 'stored a'}
+        fetcher = self.fetcher(cached=lambda path, refresh: stored.get(path),
+            limiter=limiter)
+        self.assertEqual(self.get_all(fetcher, ['a?x=1', 'b?x=1']),
+            ['stored a', 'page b'])
+        self.assertEqual([p for p, t in self.pages.calls], ['b?x=1'])
+        self.assertEqual(limiters[0].tokens, 99)
+
+    # A refresh still takes pages known to be current from the store, without
+    # a token or a success reported to the limiter
+    def test_fresh_pages_skip_the_host_when_refreshing(self):
+        limiters = []
+        def limiter():
+            limiters.append(AdaptiveRateLimiter(rate=8, burst=100,
+                clock=self.clock))
+            return limiters[-1]
+        fresh = {'a?x=1': 'fresh a'}
+        stale = {'b?x=1': 'stale b'}
+        def cached(path, refresh):
+            if refresh:
+                return fresh.get(path)
+            return fresh.get(path) or stale.get(path)
+        fetcher = self.fetcher(cached=cached, limiter=limiter)
+        self.assertEqual(self.get_all(fetcher, ['a?x=1', 'b?x=1'],
+            refresh=True), ['fresh a', 'page b'])
+        self.assertEqual([p for p, t in self.pages.calls], ['b?x=1'])
+        self.assertEqual(limiters[0].tokens, 99)
+        # One quick success, for the page that was downloaded
+        self.assertEqual(limiters[0].rate, 8.125)
+
+    def test_reports_to_the_rate_limiter(self):
+        limiters = []
+        def limiter():
+            limiters.append(AdaptiveRateLimiter(rate=8, burst=100,
+                clock=self.clock))
+            return limiters[-1]
+        fetcher = self.fetcher(limiter=limiter)
+        self.pages.fail('a?x=1', IOError('down'))
+        self.assertEqual(self.get_all(fetcher, ['a?x=1']), ['page a'])
+        # Halved by the failure, then one quick success adds 1 / rate
+        self.assertEqual(limiters[0].rate, 4.25)
+        # 0.1 for the failure, decayed once by the success
+        self.assertEqual(limiters[0].stats()['error_rate'], 0.09)
+
+class RetryPolicyTest(SimpleTestCase):
+    def test_delays_double_up_to_the_most(self):
+        policy = RetryPolicy(base_delay=2, max_delay=20, jitter=0)
+        self.assertEqual([policy.delay(n) for n in range(1, 7)],
+            [2, 4, 8, 16, 20, 20])
+
+    def test_jitter_only_shortens_delays(self):
+        policy = RetryPolicy(base_delay=8, max_delay=8, jitter=0.5)
+        for i in range(50):
+            self.assertTrue(4 <= policy.delay(1) <= 8)
+
+    def test_gives_up_after_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+        self.assertEqual([policy.gave_up(n) for n in range(1, 5)],
+            [False, False, True, True])
+
+class AdaptiveRateLimiterTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = AdaptiveRateLimiter(rate=4, min_rate=1, max_rate=6,
+            target_latency=2, burst=2, clock=self.clock)
+
+    def test_failure_halves_the_rate(self):
+        self.clock.advance(5)
+        self.limiter.failure()
+        self.assertEqual(self.limiter.rate, 2)
+        self.clock.advance(5)
+        self.limiter.failure()
+        self.assertEqual(self.limiter.rate, 1)
+        # Never below min_rate
+        self.clock.advance(5)
+        self.limiter.failure()
+        self.assertEqual(self.limiter.rate, 1)
+
+    # Failures of requests that were already in flight count once
+    def test_failures_within_a_second_cut_once(self):
+        self.clock.advance(5)
+        self.limiter.failure()
+        self.clock.advance(0.5)
+        self.limiter.failure()
+        self.assertEqual(self.limiter.rate, 2)
+
+    def test_quick_success_raises_the_rate(self):
+        self.limiter.success(0.1)
+        self.assertEqual(self.limiter.rate, 4.25)
+        for i in range(20):
+            self.limiter.success(0.1)
+        self.assertEqual(self.limiter.rate, 6)
+
+    def test_slow_success_eases_off(self):
+        self.clock.advance(5)
+        self.limiter.success(3)
+        self.assertAlmostEqual(self.limiter.rate, 3.6)
+
+    def test_tokens_refill_at_the_rate(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.assertEqual(self.limiter.tokens, 0)
+        self.clock.advance(0.25)
+        self.limiter.acquire()
+        self.assertEqual(self.limiter.tokens, 0)
+        # The bucket holds at most burst tokens
+        self.clock.advance(60)
+        self.limiter._refill()
+        self.assertEqual(self.limiter.tokens, 2)
@@ -0,0 +1,65 @@
+import os
+import time
+
+from django.test import SimpleTestCase
+
+from scraper.metrics import BUCKETS, Metrics, MetricsFile
+
+from base import ScraperTestCase
+
+# Seconds of real time a test waits for the MetricsFile's thread
+TIMEOUT = 10
+
+def some_metrics():
+    metrics = Metrics()
+    metrics.add('pages_downloaded', 3)
+    metrics.add('page_store.get')
+    for seconds in [0.002, 0.02, 0.02, 60]:
+        metrics.observe('fetch', seconds)
+    return metrics
+
+class PrometheusTest(SimpleTestCase):
+    def test_text_format(self):
+        lines = some_metrics().prometheus().splitlines()
+        self.assertEqual(lines[0], '# TYPE scraper_run_seconds gauge')
+        self.assertRegexpMatches(lines[1], r'^scraper_run_seconds \d+\.\d{3}$')
+        # Bucket counts are cumulative
+        buckets = ['scraper_stage_seconds_bucket{{stage="fetch",le="{0}"}} {1}'
+            .format(bound, n) for bound, n in zip(BUCKETS + ['+Inf'],
+            [0, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 4])]
+        self.assertEqual(lines[2:], [
+            # Names that aren't valid metric names are made valid
+            '# TYPE scraper_page_store_get_total counter',
+            'scraper_page_store_get_total 1',
+            '# TYPE scraper_pages_downloaded_total counter',
+            'scraper_pages_downloaded_total 3',
+            '# TYPE scraper_stage_seconds histogram',
+        ] + buckets + [
+            'scraper_stage_seconds_sum{stage="fetch"} 60.042000',
+            'scraper_stage_seconds_count{stage="fetch"} 4',
+        ])
+
+    def test_no_histogram_without_timers(self):
+        metrics = Metrics()
+        metrics.add('pages_cached')
+        text = metrics.prometheus(prefix='qscraper')
+        self.assertTrue(text.endswith('\nqscraper_pages_cached_total 1\n'))
+        self.assertNotIn('histogram', text)
+
+class MetricsFileTest(ScraperTestCase):
+    def test_writes_while_running_and_when_stopped(self):
+        directory = self.scratch_dir()
+        filename = os.path.join(directory, 'scraper.prom')
+        metrics = some_metrics()
+        metrics_file = MetricsFile(metrics, filename, interval=0.01).start()
+        deadline = time.time() + TIMEOUT
+        while not os.path.exists(filename):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        metrics.add('pages_downloaded', 2)
+        metrics_file.stop()
+        self.assertFalse(metrics_file.thread.is_alive())
+        with open(filename) as f:
+            self.assertIn('\nscraper_pages_downloaded_total 5\n', f.read())
+        # Every write is renamed into place
+        self.assertEqual(os.listdir(directory), ['scraper.prom'])
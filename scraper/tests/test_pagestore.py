@@ -0,0 +1,40 @@
+import os
+
+from scraper.pagestore import PageStore
+
+from base import ScraperTestCase
+
+class ImportDirTest(ScraperTestCase):
+    # The old cache sits in scraper/data/ next to the page store, the search
+    # index, exports and benchmark corpora, none of which are pages
+    def test_imports_only_page_files(self):
+        data_dir = self.scratch_dir()
+        def write(path, contents='<html></html>'):
+            with open(os.path.join(data_dir, path), 'w') as f:
+                f.write(contents)
+        pages = ['guide_dept?dept=Math&term=Fall&year=2012',
+            'histogram.html?course_id=1001&qid=0',
+            'list?yearterm=2012_1',
+            'new_course_summary.html?course_id=1001']
+        for path in pages:
+            write(path, path)
+        for path in ['pages.db', 'pages.db-wal', 'comments.db',
+                'export_state.json', 'README']:
+            write(path)
+        for path in ['export', 'bench', 'dir?looks=like_a_page']:
+            os.mkdir(os.path.join(data_dir, path))
+        write(os.path.join('bench', 'list?yearterm=2012_1'), 'bench')
+
+        store = PageStore(os.path.join(self.scratch_dir(), 'pages.db'))
+        self.addCleanup(store.close)
+        self.assertEqual(store.import_dir(data_dir,
+            validate=lambda x: not x.startswith('histogram')), len(pages))
+        valid = [path for path in pages if not path.startswith('histogram')]
+        self.assertEqual(store.paths(), valid)
+        for path in valid:
+            self.assertEqual(store.get(path), path)
+        # Pages failing validation are kept, but get() ignores them
+        self.assertIsNone(store.get(pages[1]))
+        self.assertEqual(store.info(pages[1])['valid'], 0)
+        for path in ['pages.db', 'README', 'dir?looks=like_a_page']:
+            self.assertIsNone(store.info(path))
@@ -0,0 +1,280 @@
+import os
+import re
+from StringIO import StringIO
+
+from lxml import etree
+
+from scraper import fixtures, parse, scrape
+
+from base import ScraperTestCase
+
+# The parsers as they were before parse.py, with the logging taken out.  The
+# new ones have to read every page the same way.
+
+TOTAL_RESPONSES_REGEX = re.compile(r'Total Responses:\s+(\d+)')
+MEAN_REGEX = re.compile(r'Mean:\s+([\d\.]+)')
+BREAKDOWN_REGEX = re.compile(r'\(n=(\d+)\)')
+FAILED_HISTOGRAM_REGEX = re.compile(r'(\.\.\/histogram\-\-\-\-\-\-\.jpg)')
+
+def old_tree(html):
+    return etree.parse(StringIO(html), etree.HTMLParser())
+
+def old_dept_list(html):
+    return map(lambda x: x.get('title'), old_tree(html).xpath(
+        '''//div[@class="displayed_courses"]
+        //span[@class="course-block-title"]'''))
+
+def old_course_list(html, term, year):
+    tree = old_tree(html)
+    if tree.getroot() is None:
+        return None
+    course_list = []
+    for course in tree.xpath('//a'):
+        info = parse.COURSE_INFO_REGEX.match(course.text)
+        course_list.append({
+            'id': int(parse.COURSE_ID_REGEX.findall(course.get('href'))[0]),
+            'field': info.group(1),
+            'number': info.group(2),
+            'title': info.group(3),
+            'year': year,
+            'term': term
+        })
+    return course_list
+
+def old_summary_stats(tree):
+    try:
+        stats_text = tree.xpath('//div[@id="summaryStats"]')[0].text
+    except IndexError:
+        return None
+    stats = parse.SUMMARY_STATS_REGEX.findall(stats_text)[0]
+    return int(stats[0]), int(stats[1]), float(stats[2])
+
+def old_tables(tree):
+    return tree.xpath('//div[@id="reportContent"]/table')
+
+# Returns the ratings and the histogram urls still to be fetched
+def old_standard_table(table):
+    ratings = []
+    pending = []
+    for row in table.xpath('.//tr')[1:-2]:
+        rating = {}
+        cells = row.xpath('./td')
+        rating['category'] = cells[0].xpath('./strong')[0].text
+        if rating['category'] == 'Workload (hours per week)':
+            rating['category'] = 'Workload'
+        rating['num_responses'] = int(cells[1].text)
+        if not cells[2].xpath('.//img'):
+            continue
+        img_src = cells[2].xpath('.//img')[0].get('src')
+        rating['value'] = float(
+            parse.SCORE_BAR_REGEX.match(img_src).group(1))
+        ratings.append(rating)
+        scores = parse.HISTOGRAM_REGEX.findall(etree.tostring(row))
+        if scores:
+            scrape.set_score_breakdown(rating, scores[0])
+            continue
+        pending.append(cells[3].xpath('.//a')[0].get('href'))
+    return ratings, pending
+
+def old_pie_charts(table):
+    ratings = []
+    for row in table.xpath('tr')[0:2]:
+        rating = {}
+        if not row.xpath('.//strong'):
+            continue
+        rating['category'] = row.xpath('.//strong')[0].text
+        row_html = etree.tostring(row)
+        try:
+            rating['num_responses'] = \
+                int(TOTAL_RESPONSES_REGEX.findall(row_html)[0])
+        except IndexError:
+            continue
+        rating['value'] = float(MEAN_REGEX.findall(row_html)[0])
+        scrape.set_score_breakdown(rating,
+            BREAKDOWN_REGEX.findall(row_html))
+        ratings.append(rating)
+    return ratings
+
+def old_reasons(table):
+    reasons = {}
+    for row in table.xpath('tr')[1:]:
+        reasons[row.xpath('td')[-1].text] = int(row.xpath('td')[-2].text)
+    return reasons
+
+def old_instructor_options(tree):
+    return [(option.get('value'),
+        parse.PROF_ID_REGEX.findall(option.attrib['value'])[0], option.text,
+        option.get('selected') is not None) for option in tree.xpath(
+        '//select[@name="current_instructor_or_tf_huid_param"]/option')]
+
+def old_histogram(html):
+    if FAILED_HISTOGRAM_REGEX.search(html) or \
+            parse.HISTOGRAM_REGEX.search(html) is None:
+        return None
+    return parse.HISTOGRAM_REGEX.findall(html)[0]
+
+def old_comments(html):
+    if parse.NO_COMMENTS_REGEX.findall(html):
+        return None
+    return map(lambda x: x.text, old_tree(html).xpath(
+        '//div[@id="responseBlock"]/div[@class="response"]/p'))
+
+# Pages with markup the generated corpus doesn't have: rows with no score bar
+# or no responses, numbers nested in extra tags, and broken histograms
+
+ODD_SUMMARY = fixtures.page(
+    '<div id="summaryStats">Enrollment:\n  40\n  Evaluations:\n  20\n' +
+    '  Response Rate:\n  50.00%\n</div><div id="reportContent">' +
+    '<table><tr><th>Category</th></tr>' +
+    '<tr><td><strong>Course Overall</strong></td><td>20</td>' +
+    '<td><div><img src="../bar_1to5-4.25.png" alt="4.25"></div></td>' +
+    '<td><a href="histogram.html?course_id=1&q=0"><span>view</span></a>' +
+    '</td></tr>' +
+    '<tr><td><strong>Section</strong></td><td>0</td><td>n/a</td>' +
+    '<td></td></tr>' +
+    '<tr><td><strong>Workload (hours per week)</strong></td><td>18</td>' +
+    '<td><img src="../bar_1to5-3.00.png"></td><td><p><img title="x" ' +
+    'src="../histogram-1-2-3-4-8-18.jpg"></p></td></tr>' +
+    '<tr><td>Scale</td></tr><tr><td>Legend</td></tr></table>' +
+    '<table><tr><td><strong>Difficulty</strong></td><td>\n' +
+    '  <span>Total Responses: 19</span><br>\n  <span>Mean:\n  3.21</span>' +
+    '</td><td><div><span>1 (n=1)</span> <span>2 (n=3)</span></div>' +
+    '<span>3 (n=9)</span>\n<span>4 (n=4)</span><span>5 (n=2)</span>' +
+    '</td></tr><tr><td><strong>Compared to Other Courses</strong></td>' +
+    '<td>No responses</td></tr></table>' +
+    '<table><tr><th>Reasons</th></tr>' +
+    '<tr><td></td><td>12</td><td>Elective</td></tr>' +
+    '<tr><td>x</td><td>3</td><td>Pre-Med Requirement</td></tr></table>' +
+    '</div>')
+ODD_HISTOGRAMS = [
+    fixtures.page('<img src="../histogram------.jpg">'),
+    fixtures.page('<p>Not available</p>'),
+    fixtures.page('<div><img alt="" src="../histogram-0-0-1-5-2-8.jpg">' +
+        '</div>'),
+]
+ODD_INSTRUCTORS = fixtures.page(
+    '<select name="current_instructor_or_tf_huid_param">' +
+    '<option value="ABC123:0">Adams, Ann</option>' +
+    '<option value="DEF456:1" selected="selected">Baker, Ben, Jr.</option>' +
+    '</select>')
+
+class ParseTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        directory = self.scratch_dir()
+        fixtures.write_corpus(directory, [(2012, 1), (2011, 2)], depts=2,
+            courses=6, instructors=3, comments=4, inline=0.5)
+        self.pages = {}
+        for path in os.listdir(directory):
+            with open(os.path.join(directory, path)) as f:
+                self.pages[path] = f.read()
+
+    # Pages of the corpus whose paths start with prefix
+    def corpus(self, prefix):
+        pages = [html for path, html in sorted(self.pages.items())
+            if path.startswith(prefix)]
+        self.assertTrue(pages)
+        return pages
+
+    def assertStandardTablesMatch(self, tables, old):
+        self.assertEqual(len(tables), len(old))
+        for table, old_table in zip(tables, old):
+            ratings, pending = scrape.read_standard_table(table)
+            self.assertEqual((ratings, [url for rating, url in pending]),
+                old_standard_table(old_table))
+
+    def assertSummaryMatches(self, html):
+        tree = parse.parse_html(html)
+        self.assertEqual(parse.summary_stats(tree),
+            old_summary_stats(old_tree(html)))
+        tables = parse.report_tables(tree)
+        old = old_tables(old_tree(html))
+        self.assertEqual(len(tables), len(old))
+        self.assertStandardTablesMatch(tables[:-2], old[:-2])
+        self.assertEqual(scrape.parse_pie_charts(tables[-2]),
+            old_pie_charts(old[-2]))
+        self.assertEqual(scrape.parse_reasons(tables[-1]),
+            old_reasons(old[-1]))
+
+    def test_dept_lists(self):
+        for html in self.corpus('list?'):
+            self.assertEqual(scrape.parse_dept_list(html),
+                old_dept_list(html))
+
+    def test_course_lists(self):
+        for html in self.corpus('guide_dept?'):
+            self.assertEqual(scrape.parse_course_list(html, 1, 2012),
+                old_course_list(html, 1, 2012))
+        self.assertIsNone(scrape.parse_course_list('', 1, 2012))
+
+    def test_summary_pages(self):
+        for html in self.corpus('new_course_summary'):
+            self.assertSummaryMatches(html)
+        self.assertSummaryMatches(ODD_SUMMARY)
+
+    def test_summary_page_without_data(self):
+        tree = parse.parse_html(fixtures.page('<p>No data</p>'))
+        self.assertIsNone(parse.summary_stats(tree))
+        self.assertEqual(parse.report_tables(tree), [])
+
+    def test_odd_rows(self):
+        tables = parse.report_tables(parse.parse_html(ODD_SUMMARY))
+        self.assertEqual([(row['category'], row['value'], row['scores'],
+                row['histogram_url'])
+            for row in parse.standard_table_rows(tables[0])], [
+            ('Course Overall', 4.25, None, 'histogram.html?course_id=1&q=0'),
+            ('Section', None, None, None),
+            ('Workload', 3.0, ('1', '2', '3', '4', '8'), None),
+        ])
+        self.assertEqual(parse.pie_chart_rows(tables[1]), [
+            {'category': 'Difficulty', 'num_responses': 19, 'value': 3.21,
+                'scores': [1, 3, 9, 4, 2]},
+            {'category': 'Compared to Other Courses', 'num_responses': None,
+                'value': None, 'scores': []},
+        ])
+
+    # The numbers after a tag come after the text inside it, however deeply
+    # it's nested
+    def test_row_text_keeps_document_order(self):
+        table = parse.parse_html('<table><tr><td><strong>Difficulty' +
+            '</strong></td><td><span><b>Total Responses:</b></span> 12<br>' +
+            '<span><b>Mean:</b></span> 3.5</td><td><span><i>1</i> (n=2)' +
+            '</span> 2 (n=3) <span>3 (n=4)</span> 4 (n=1) <span>5 (n=2)' +
+            '</span></td></tr></table>').getroot().find('.//table')
+        text = parse.row_text(table.find('tr'))
+        self.assertLess(text.index('Total Responses:'), text.index('12'))
+        self.assertLess(text.index('Mean:'), text.index('3.5'))
+        self.assertEqual(parse.pie_chart_rows(table), [
+            {'category': 'Difficulty', 'num_responses': 12, 'value': 3.5,
+                'scores': [2, 3, 4, 1, 2]},
+        ])
+
+    def test_instructor_pages(self):
+        for html in self.corpus('inst-tf_summary'):
+            tree = parse.parse_html(html)
+            self.assertEqual(parse.instructor_options(tree),
+                old_instructor_options(old_tree(html)))
+            self.assertStandardTablesMatch(parse.report_tables(tree),
+                old_tables(old_tree(html)))
+        self.assertEqual(
+            parse.instructor_options(parse.parse_html(ODD_INSTRUCTORS)),
+            old_instructor_options(old_tree(ODD_INSTRUCTORS)))
+
+    def test_histograms(self):
+        for html in self.corpus('histogram.html') + ODD_HISTOGRAMS:
+            self.assertEqual(scrape.read_histogram(html), old_histogram(html))
+            self.assertEqual(scrape.valid_histogram(html),
+                old_histogram(html) is not None)
+        self.assertEqual([scrape.read_histogram(html)
+            for html in ODD_HISTOGRAMS], [None, None,
+            ('0', '0', '1', '5', '2')])
+
+    def test_comments(self):
+        pages = self.corpus('view_comments')
+        self.assertIn(None, map(old_comments, pages))
+        for html in pages:
+            texts = old_comments(html)
+            self.assertEqual(parse.has_comments(html), texts is not None)
+            if texts is not None:
+                self.assertEqual(
+                    parse.comment_texts(parse.parse_html(html)), texts)
@@ -0,0 +1,46 @@
+import os
+import threading
+
+from django.db.backends.signals import connection_created
+
+from scraper import fixtures, pipeline, scrape
+from scraper.models import *
+from scraper.transport import FixtureTransport
+
+from base import ScraperTestCase
+
+class PipelineTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        directory = self.scratch_dir()
+        fixtures.write_corpus(directory, scrape.get_yearterms(), depts=1,
+            courses=2, instructors=1, comments=2, inline=1)
+        self.transport = FixtureTransport(directory)
+        self.addCleanup(setattr, scrape, 'PAGE_STORE', scrape.PAGE_STORE)
+        scrape.use_page_store(':memory:')
+        self.patch_settings(SCRAPER_REFRESH_STATS=False,
+            SCRAPER_DEAD_LETTERS=os.path.join(directory, 'dead_letters'),
+            SCRAPER_RATE=1000.0, SCRAPER_MAX_RATE=1000.0)
+        self.threads = []
+        connection_created.connect(self.connected)
+        self.addCleanup(connection_created.disconnect, self.connected)
+
+    def connected(self, sender, **kwargs):
+        self.threads.append(threading.current_thread().name)
+
+    def scrape(self):
+        pipeline.scrape_pipeline('', workers=2, per_host=2, incremental=True,
+            transport=self.transport)
+
+    # Changed courses are spotted without the fetch stage opening a database
+    # connection of its own
+    def test_only_the_main_thread_uses_the_database(self):
+        self.scrape()
+        self.scrape()
+        self.assertEqual(
+            list(ScrapeRun.objects.values_list('succeeded', flat=True)),
+            [True, True])
+        self.assertEqual(CourseInstance.objects.count(),
+            2 * len(scrape.get_yearterms()))
+        self.assertNotIn('fetch_stage', self.threads)
+        self.assertNotIn('parse_stage', self.threads)
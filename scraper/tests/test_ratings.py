@@ -0,0 +1,70 @@
+from StringIO import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+
+from scraper import fixtures
+from scraper.models import *
+from scraper.writer import CourseWriter
+
+from base import ScraperTestCase
+
+class MigrateRatingsTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        writer = CourseWriter()
+        writer.add(fixtures.course_dicts(1)[0])
+        writer.flush()
+        self.cinst = CourseInstance.objects.get()
+        self.relation = InstructorCourseInstanceRelation.objects.filter(
+            course_instance=self.cinst)[0]
+        self.saved_category = self.cinst.ratings.all()[0].category.name
+
+    def rating(self, rated, category, value=3.5, object_id=None):
+        return Rating.objects.create(
+            content_type=ContentType.objects.get_for_model(rated),
+            object_id=rated.pk if object_id is None else object_id,
+            category=category, value=value, num_responses=10, ones=1,
+            twos=2, threes=3, fours=3, fives=1)
+
+    def migrate(self, **options):
+        out = StringIO()
+        call_command('migrate_ratings', stdout=out, **options)
+        return out.getvalue()
+
+    # Two ratings a chunk, so the second 'Extra' is only seen to be a
+    # duplicate from the rows the chunk before saved
+    def test_duplicates_and_orphans_are_skipped(self):
+        course_ratings = self.cinst.ratings.count()
+        self.rating(self.cinst, 'New')
+        self.rating(self.cinst, self.saved_category, value=1.0)
+        self.rating(self.cinst, 'Gone', object_id=self.cinst.pk + 100)
+        self.rating(self.cinst, 'Extra', value=4.0)
+        self.rating(self.cinst.course.field, 'Not rated here')
+        self.rating(self.cinst, 'Extra', value=2.0)
+        self.rating(self.relation, 'New')
+
+        output = self.migrate(chunk_size=2)
+        self.assertIn('Copied 3 ratings', output)
+        self.assertIn('Skipped 2 duplicates and 2 orphans', output)
+        self.assertEqual(self.cinst.ratings.count(), course_ratings + 2)
+        self.assertEqual(float(self.cinst.ratings.get(
+            category__name='Extra').value), 4.0)
+        self.assertNotEqual(float(self.cinst.ratings.get(
+            category__name=self.saved_category).value), 1.0)
+        rating = InstructorRating.objects.get(
+            instructor_relation=self.relation, category__name='New')
+        self.assertEqual((rating.num_responses, rating.ones, rating.fives),
+            (10, 1, 1))
+        self.assertEqual(Rating.objects.count(), 7)
+
+        # Running it again copies nothing
+        self.assertIn('Copied 0 ratings', self.migrate())
+
+    def test_delete_removes_what_was_looked_at(self):
+        self.rating(self.cinst, 'New')
+        self.rating(self.cinst, 'Gone', object_id=self.cinst.pk + 100)
+        self.rating(self.relation, 'New')
+        self.assertIn('Copied 2 ratings', self.migrate(chunk_size=2,
+            delete=True))
+        self.assertEqual(Rating.objects.count(), 0)
@@ -0,0 +1,86 @@
+import os
+from StringIO import StringIO
+
+from django.core.management import call_command
+
+from scraper import fixtures, reparse, scrape
+from scraper.models import *
+from scraper.transport import FixtureTransport
+
+from base import ScraperTestCase
+
+# Everything saved for each course instance, in a form that doesn't depend on
+# row ids or the order rows were saved in
+def saved_courses():
+    def ratings(queryset):
+        return sorted(queryset.values_list('category__name', 'value',
+            'num_responses', 'ones', 'twos', 'threes', 'fours', 'fives'))
+    courses = {}
+    for cinst in CourseInstance.objects.select_related('course__field'):
+        instructors = []
+        for relation in InstructorCourseInstanceRelation.objects.filter(
+                course_instance=cinst).select_related('instructor'):
+            instructor = relation.instructor
+            instructors.append((instructor.prof_id, instructor.first,
+                instructor.last, ratings(InstructorRating.objects.filter(
+                instructor_relation=relation))))
+        courses[cinst.qcourse_id] = {
+            'course': (cinst.course.field.abbreviation, cinst.course.number,
+                cinst.course.title, cinst.year, cinst.term,
+                cinst.enrollment, cinst.evaluations, cinst.response_rate),
+            'comments': sorted(Comment.objects.filter(course=cinst)\
+                .values_list('comment', flat=True)),
+            'ratings': ratings(CourseRating.objects.filter(
+                course_instance=cinst)),
+            'reasons': sorted(Reason.objects.filter(course=cinst)\
+                .values_list('reason', 'number')),
+            'instructors': sorted(instructors),
+        }
+    return courses
+
+# Scrapes a fixture corpus into the database and a page store, then parses
+# the page store again offline
+class ReparseTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        directory = self.scratch_dir()
+        self.yearterms = scrape.get_yearterms()
+        fixtures.write_corpus(directory, self.yearterms, depts=1, courses=2,
+            instructors=2, comments=3, inline=0.5)
+        self.page_store = os.path.join(self.scratch_dir(), 'pages.db')
+        self.addCleanup(setattr, scrape, 'PAGE_STORE', scrape.PAGE_STORE)
+        scrape.use_page_store(self.page_store)
+        self.patch_settings(SCRAPER_REFRESH_STATS=False,
+            SCRAPER_DEAD_LETTERS=os.path.join(directory, 'dead_letters'),
+            SCRAPER_RATE=1000.0, SCRAPER_MAX_RATE=1000.0)
+        scrape.scrape('', workers=2, per_host=2,
+            transport=FixtureTransport(directory))
+        self.scraped = saved_courses()
+        self.assertEqual(len(self.scraped), 2 * len(self.yearterms))
+        self.assertTrue(all(course['ratings'] and course['instructors']
+            for course in self.scraped.values()))
+
+    def test_reparse_saves_what_the_scrape_did(self):
+        counts = reparse.reparse(processes=2, rebuild=True)
+        self.assertEqual(counts['courses_saved'], 2 * len(self.yearterms))
+        self.assertFalse(counts.get('pages_missing'))
+        self.assertFalse(counts.get('parse_errors'))
+        self.assertEqual(saved_courses(), self.scraped)
+        self.assertEqual(ScrapedTerm.objects.count(), len(self.yearterms))
+
+    def test_rebuild_from_cache_saves_what_the_scrape_did(self):
+        misses = os.path.join(self.scratch_dir(), 'misses')
+        call_command('rebuild_from_cache', processes=2,
+            page_store=self.page_store, misses=misses, stdout=StringIO())
+        self.assertEqual(saved_courses(), self.scraped)
+        with open(misses) as f:
+            self.assertEqual(f.read(), '')
+
+    # Each reparse clears out the parsing processes' logs of the last one
+    def test_parser_logs_do_not_pile_up(self):
+        stale = os.path.join(scrape.LOG_DIR, 'reparse-1.output.log')
+        open(stale, 'w').close()
+        reparse.reparse(processes=2, rebuild=True)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue([filename for filename in os.listdir(scrape.LOG_DIR)
+            if filename.startswith('reparse-')])
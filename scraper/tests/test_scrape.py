@@ -0,0 +1,237 @@
+import os
+import random
+import urllib2
+
+from django.db.models import Count
+
+from scraper import fixtures, scrape
+from scraper.checkpoint import get_resumable_run
+from scraper.fetch import Fetcher
+from scraper.models import *
+from scraper.retry import DeadLetters, RetryPolicy
+from scraper.transport import FixtureTransport
+from scraper.writer import CourseWriter
+
+from base import ScraperTestCase
+
+COURSE = {'id': 1001, 'field': 'DEPT0', 'number': '100',
+    'title': 'Course 0 of DEPT0', 'year': 2012, 'term': 1}
+PROFS = [('AAAA1111:0', 'Ann', 'Adams'), ('BBBB2222:1', 'Ben', 'Baker')]
+
+# A report table with one row per (category, mean, five counts), with the
+# histograms drawn in the rows
+def report_table(rows):
+    html = '<table><tr><th>Category</th></tr>'
+    for category, mean, scores in rows:
+        html += ('<tr><td><strong>{0}</strong></td><td>{1}</td>' +
+            '<td><img src="../bar_1to5-{2:.2f}.png"></td>' +
+            '<td><img src="../histogram-{3}-{4}-{5}-{6}-{7}-{1}.jpg"></td>' +
+            '</tr>').format(category, sum(scores), mean, *scores)
+    return html + '<tr><td>Scale</td></tr><tr><td>Legend</td></tr></table>'
+
+class ScrapeCourseTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.directory = self.scratch_dir()
+        transport = FixtureTransport(self.directory)
+        self.fetcher = Fetcher(lambda path, refresh: transport.get(path)[1],
+            scrape.BASE_URL, workers=2)
+        self.addCleanup(self.fetcher.close)
+
+    def save_page(self, path, html):
+        with open(os.path.join(self.directory, path), 'w') as f:
+            f.write(html)
+
+    def save_course_pages(self, instructor_tables):
+        course_id = COURSE['id']
+        self.save_page(
+            'new_course_summary.html?course_id={0}'.format(course_id),
+            fixtures.summary_page(random.Random(0), course_id,
+                fixtures.CATEGORIES, True, {}))
+        comments = fixtures.comments_page(['Great course.'])
+        self.save_page('view_comments.html?course_id={0}'.format(course_id),
+            comments)
+        self.save_page(
+            'view_comments.html?course_id={0}&qid=1487'.format(course_id),
+            comments)
+        path = scrape.instructor_path(course_id)
+        for i, (value, first, last) in enumerate(PROFS):
+            html = fixtures.instructor_page(PROFS, i, instructor_tables[i])
+            if i == 0:
+                self.save_page(path, html)
+            self.save_page(path + '&current_instructor_or_tf_huid_param=' +
+                urllib2.quote(value, ''), html)
+
+    # Each instructor's ratings come from their own page, not the page of
+    # whichever instructor was shown first or parsed last
+    def test_instructors_get_their_own_ratings(self):
+        self.save_course_pages([
+            report_table([('Instructor Overall', 4.5, [1, 2, 3, 4, 5]),
+                ('Effective Lectures', 4.0, [0, 1, 1, 2, 6])]),
+            report_table([('Instructor Overall', 2.0, [5, 4, 3, 2, 1]),
+                ('Effective Lectures', 1.5, [6, 2, 1, 1, 0])]),
+        ])
+        course = scrape.scrape_course_data(self.fetcher, dict(COURSE), 1)
+        writer = CourseWriter()
+        writer.add(course)
+        self.assertEqual(writer.flush(), 1)
+
+        cinst = CourseInstance.objects.get(qcourse_id=COURSE['id'])
+        relations = InstructorCourseInstanceRelation.objects.filter(
+            course_instance=cinst)
+        self.assertEqual(sorted(r.instructor.prof_id for r in relations),
+            ['AAAA1111', 'BBBB2222'])
+        ratings = dict(((r.instructor_relation.instructor.prof_id,
+            r.category.name), (float(r.value), r.ones, r.fives))
+            for r in InstructorRating.objects.filter(
+            instructor_relation__in=relations))
+        self.assertEqual(ratings, {
+            ('AAAA1111', 'Instructor Overall'): (4.5, 1, 5),
+            ('AAAA1111', 'Effective Lectures'): (4.0, 0, 6),
+            ('BBBB2222', 'Instructor Overall'): (2.0, 5, 1),
+            ('BBBB2222', 'Effective Lectures'): (1.5, 6, 0),
+        })
+
+class ScoreBreakdownTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        directory = self.scratch_dir()
+        with open(os.path.join(directory, 'histogram.html?q=1'), 'w') as f:
+            f.write(fixtures.page(
+                '<img src="../histogram-1-2-3-4-5-15.jpg">'))
+        transport = FixtureTransport(directory)
+        self.calls = []
+        def fetch(path, refresh):
+            self.calls.append(path)
+            return transport.get(path)[1]
+        self.dead_letters = DeadLetters(os.path.join(directory,
+            'dead_letters.jsonl'))
+        self.fetcher = Fetcher(fetch, scrape.BASE_URL, workers=2,
+            policy=RetryPolicy(base_delay=0, max_attempts=3, jitter=0),
+            dead_letters=self.dead_letters)
+        self.addCleanup(self.fetcher.close)
+
+    # A histogram page the Fetcher gave up on isn't fetched all over again
+    def test_missing_histograms_are_given_up_on_once(self):
+        missing = {'category': 'Materials'}
+        shared = {'category': 'Feedback'}
+        found = {'category': 'Section'}
+        scrape.add_score_breakdowns(self.fetcher, [
+            (missing, 'histogram.html?q=0'), (shared, 'histogram.html?q=0'),
+            (found, 'histogram.html?q=1')], COURSE['id'])
+        self.assertEqual(self.calls.count('histogram.html?q=0'), 3)
+        self.assertEqual(self.calls.count('histogram.html?q=1'), 1)
+        self.assertEqual([entry['path']
+            for entry in self.dead_letters.entries()], ['histogram.html?q=0'])
+        self.assertEqual((missing['ones'], shared['fives']), (0, 0))
+        self.assertEqual((found['ones'], found['fives']), (1, 5))
+
+class StoredPageTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.addCleanup(setattr, scrape, 'PAGE_STORE', scrape.PAGE_STORE)
+        scrape.use_page_store(':memory:')
+        self.patch_settings(SCRAPER_PAGE_TTLS=[('list?', None)])
+        self.store = scrape.get_page_store()
+        self.store.put('list?yearterm=2012_1', 'depts')
+        self.store.put('guide_dept?dept=X', 'courses')
+
+    # A refresh only takes pages whose TTL says they're still current
+    def test_refresh_only_gets_fresh_pages(self):
+        self.assertEqual(scrape.get_stored_page('guide_dept?dept=X'),
+            'courses')
+        self.assertIsNone(scrape.get_stored_page('guide_dept?dept=X', True))
+        self.assertEqual(scrape.get_stored_page('list?yearterm=2012_1', True),
+            'depts')
+        self.store.invalidate('list?yearterm=2012_1')
+        self.assertIsNone(
+            scrape.get_stored_page('list?yearterm=2012_1', True))
+
+    # A page the server says hasn't changed is read back from the store,
+    # timed like any other stored page
+    def test_unchanged_pages_are_read_from_the_store(self):
+        class NotModified(object):
+            def get(self, path, etag=None, last_modified=None):
+                return 304, '', etag, last_modified
+        self.store.put('guide_dept?dept=X', 'courses', etag='"v1"')
+        def reads():
+            return scrape.COUNTERS.timings().get('page_store.get',
+                {'calls': 0})['calls']
+        before = reads()
+        self.assertEqual(scrape.get_data_from_path(NotModified(),
+            'guide_dept?dept=X', refresh=True), 'courses')
+        self.assertEqual(reads(), before + 1)
+
+# A FixtureTransport that records the paths asked for, and serves the PIN
+# login page for pin, the way the Q guide does once the cookie expires
+class RecordingTransport(object):
+    def __init__(self, fixtures, pin=None):
+        self.fixtures = fixtures
+        self.pin = pin
+        self.calls = []
+
+    def get(self, path, etag=None, last_modified=None):
+        self.calls.append(path)
+        if path == self.pin:
+            return 200, fixtures.page('Harvard University PIN Login'), \
+                None, None
+        return self.fixtures.get(path, etag, last_modified)
+
+class ResumeTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        directory = self.scratch_dir()
+        self.yearterms = scrape.get_yearterms()
+        fixtures.write_corpus(directory, self.yearterms, depts=2, courses=2,
+            instructors=1, comments=1, inline=1)
+        self.fixtures = FixtureTransport(directory)
+        self.addCleanup(setattr, scrape, 'PAGE_STORE', scrape.PAGE_STORE)
+        scrape.use_page_store(':memory:')
+        self.patch_settings(SCRAPER_REFRESH_STATS=False,
+            SCRAPER_DEAD_LETTERS=os.path.join(directory, 'dead_letters'),
+            SCRAPER_RATE=1000.0, SCRAPER_MAX_RATE=1000.0)
+
+    def scrape(self, transport, resume=False):
+        scrape.scrape('', workers=2, per_host=2, transport=transport,
+            resume=resume)
+
+    # A run whose cookie expires partway through the third term carries on
+    # from the first department it hadn't saved
+    def test_resumed_runs_skip_what_was_saved(self):
+        # The first course of DEPT1 in the third term; the corpus numbers
+        # courses from 1001, two per department and four per term
+        stopped = 'new_course_summary.html?course_id=1011'
+        self.scrape(RecordingTransport(self.fixtures, stopped))
+        run = get_resumable_run()
+        self.assertIsNotNone(run)
+        self.assertEqual(sorted(ScrapedTerm.objects.values_list('year',
+            'term')), sorted(self.yearterms[:2]))
+        year, term = self.yearterms[2]
+        self.assertEqual(list(ScrapedDept.objects.filter(year=year,
+            term=term).values_list('dept', flat=True)), ['DEPT0'])
+        self.assertEqual(CourseInstance.objects.count(), 10)
+
+        # Every page the resumed run needs comes from the transport
+        scrape.use_page_store(':memory:')
+        transport = RecordingTransport(self.fixtures)
+        self.scrape(transport, resume=True)
+        run = ScrapeRun.objects.get()
+        self.assertTrue(run.succeeded)
+        for year, term in self.yearterms[:2]:
+            self.assertNotIn(scrape.dept_list_path(year, term),
+                transport.calls)
+        year, term = self.yearterms[2]
+        self.assertNotIn(scrape.course_list_path('DEPT0', term, year),
+            transport.calls)
+        self.assertIn(scrape.course_list_path('DEPT1', term, year),
+            transport.calls)
+        summaries = [int(path.split('=')[1]) for path in transport.calls
+            if path.startswith('new_course_summary.html')]
+        self.assertEqual(sorted(summaries), range(1011, 1001 + 56))
+
+        self.assertEqual(CourseInstance.objects.count(), 56)
+        # The corpus gives each course at most one comment
+        self.assertFalse(Comment.objects.values('course')\
+            .annotate(n=Count('pk')).filter(n__gt=1).exists())
+        self.assertEqual(set(ScrapedCourse.objects.values_list('run',
+            flat=True)), set([run.pk]))
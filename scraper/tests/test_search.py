@@ -0,0 +1,125 @@
+import math
+import os
+import struct
+
+from scraper import search
+
+from base import ScraperTestCase
+
+# Comments of 4, 5, 5, 2, 1 and 7 tokens, 24 in all, so FTS4's average
+# tokens per comment is a whole 4.  "great" is in two of the six, three
+# times in the second.
+COMMENTS = [
+    'the lectures were great',
+    'great great course, great lectures',
+    'the problem sets were long',
+    'long readings',
+    'boring',
+    'far too much reading every single week',
+]
+
+def bm25_term(rows, docs, length, average, hits, k1=1.2, b=0.75):
+    idf = math.log((rows - docs + 0.5) / (docs + 0.5))
+    norm = 1 - b + b * float(length) / average
+    return idf * hits * (k1 + 1) / (hits + k1 * norm)
+
+class CommentIndexTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.index = search.CommentIndex(
+            os.path.join(self.scratch_dir(), 'comments.db'))
+        self.addCleanup(self.index.close)
+
+    # Indexes COMMENTS with ids from 1, all from one course instance
+    def add_corpus(self):
+        self.index.add([(i, 1, 'CS', 2012, 1, comment)
+            for i, comment in enumerate(COMMENTS, 1)])
+
+    def matchinfo(self, query):
+        rows = self.index.conn.execute('SELECT docid, ' +
+            "matchinfo(comment_text, 'pcnalx') FROM comment_text " +
+            'WHERE comment_text MATCH ? ORDER BY docid', [query]).fetchall()
+        return dict((docid, str(info)) for docid, info in rows)
+
+    def test_matchinfo_layout(self):
+        self.add_corpus()
+        info = self.matchinfo('great')
+        self.assertEqual(sorted(info), [1, 2])
+        # Phrases, columns, rows, average and this row's tokens, then this
+        # row's hits, all hits and rows with hits
+        self.assertEqual(struct.unpack('@8I', info[1]),
+            (1, 1, 6, 4, 4, 1, 4, 2))
+        self.assertEqual(struct.unpack('@8I', info[2]),
+            (1, 1, 6, 4, 5, 3, 4, 2))
+        self.assertAlmostEqual(search.bm25(info[1]),
+            bm25_term(6, 2, 4, 4, 1))
+        self.assertAlmostEqual(search.bm25(info[2]),
+            bm25_term(6, 2, 5, 4, 3))
+
+    def test_phrases_add_up(self):
+        self.add_corpus()
+        info = self.matchinfo('great lectures')
+        self.assertEqual(sorted(info), [1, 2])
+        self.assertAlmostEqual(search.bm25(info[1]),
+            bm25_term(6, 2, 4, 4, 1) + bm25_term(6, 2, 4, 4, 1))
+        self.assertAlmostEqual(search.bm25(info[2]),
+            bm25_term(6, 2, 5, 4, 3) + bm25_term(6, 2, 5, 4, 1))
+
+    # Words in most comments get a small positive weight, not a negative one
+    def test_common_words_still_count(self):
+        self.index.add([(i, 1, 'CS', 2012, 1, 'good course')
+            for i in range(1, 5)] + [(5, 1, 'CS', 2012, 1, 'good')])
+        scores = [result['score'] for result in self.index.search('course')]
+        self.assertEqual(len(scores), 4)
+        for score in scores:
+            self.assertGreater(score, 0)
+            self.assertLess(score, 0.1)
+
+    def test_search_ranks_by_bm25(self):
+        self.add_corpus()
+        results = self.index.search('great')
+        self.assertEqual([result['comment_id'] for result in results], [2, 1])
+        self.assertAlmostEqual(results[0]['score'], bm25_term(6, 2, 5, 4, 3))
+        self.assertAlmostEqual(results[1]['score'], bm25_term(6, 2, 4, 4, 1))
+        self.assertEqual(results[1]['snippet'], 'the lectures were [great]')
+        self.assertEqual([result['comment_id']
+            for result in self.index.search('read*')], [4, 6])
+        self.assertEqual([result['comment_id']
+            for result in self.index.search('"great lectures"')], [2])
+        self.assertEqual(self.index.search('tedious'), [])
+        with self.assertRaises(ValueError):
+            self.index.search('"great lectures')
+
+    def test_filters(self):
+        rows = []
+        for i, (field, year, term) in enumerate([('CS', 2012, 1),
+                ('CS', 2012, 2), ('CS', 2011, 1), ('MATH', 2012, 1)]):
+            rows.append((2 * i + 1, i + 1, field, year, term, 'great course'))
+            rows.append((2 * i + 2, i + 1, field, year, term,
+                'great great course'))
+        self.index.add(rows)
+        def ids(**filters):
+            return sorted(result['comment_id']
+                for result in self.index.search('great', **filters))
+        self.assertEqual(ids(), range(1, 9))
+        self.assertEqual(ids(field='CS'), range(1, 7))
+        self.assertEqual(ids(year=2012), [1, 2, 3, 4, 7, 8])
+        self.assertEqual(ids(term=1), [1, 2, 5, 6, 7, 8])
+        self.assertEqual(ids(field='CS', year=2012, term=1), [1, 2])
+        self.assertEqual(ids(field='MATH', year=2011), [])
+        results = self.index.search('great', field='CS', year=2012)
+        self.assertEqual([(result['course_instance_id'], result['field'],
+            result['year'], result['term']) for result in results],
+            [(1, 'CS', 2012, 1), (2, 'CS', 2012, 2)] * 2)
+        # Paging works after filtering
+        self.assertEqual([result['comment_id'] for result in
+            self.index.search('great', field='CS', limit=2, offset=2)],
+            [6, 1])
+
+    def test_replace_drops_old_comments(self):
+        self.add_corpus()
+        self.index.add([(7, 2, 'CS', 2012, 1, 'great readings')])
+        self.index.replace([1], [(8, 1, 'CS', 2012, 1, 'dull lectures')])
+        self.assertEqual(self.index.count(), 2)
+        self.assertEqual([result['comment_id']
+            for result in self.index.search('great OR lectures')], [7, 8])
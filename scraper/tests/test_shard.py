@@ -0,0 +1,100 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from scraper import shard
+from scraper.models import *
+
+from base import ScraperTestCase
+
+# Stands in for django.utils.timezone in shard.  The first call to now()
+# runs rival, which claim_unit makes between looking for a pending unit and
+# claiming it, so rival gets in between the two like another process could.
+class RacingClock(object):
+    def __init__(self, rival):
+        self.rival = rival
+
+    def now(self):
+        rival, self.rival = self.rival, None
+        if rival is not None:
+            rival()
+        return timezone.now()
+
+class WorkQueueTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.patch_settings(SCRAPER_CLAIM_TIMEOUT=60,
+            SCRAPER_CLAIM_ATTEMPTS=3)
+        self.run = ScrapeRun.objects.create()
+
+    def add_units(self, *depts):
+        for dept in depts:
+            WorkUnit.objects.create(run=self.run, year=2012, term=1,
+                dept=dept)
+
+    # Makes worker a's claim land while worker b is in the middle of its own
+    def race(self):
+        claims = {}
+        def claim_a():
+            claims['a'] = shard.claim_unit(self.run, 'a')
+        self.addCleanup(setattr, shard, 'timezone', shard.timezone)
+        shard.timezone = RacingClock(claim_a)
+        claims['b'] = shard.claim_unit(self.run, 'b')
+        return claims
+
+    def age_claims(self, seconds):
+        WorkUnit.objects.filter(state=WorkUnit.CLAIMED).update(
+            claimed_at=timezone.now() - timedelta(seconds=seconds))
+
+    def test_one_of_two_claimers_wins_a_unit(self):
+        self.add_units('DEPT0')
+        claims = self.race()
+        self.assertEqual(claims['a'].dept, 'DEPT0')
+        self.assertIsNone(claims['b'])
+        unit = WorkUnit.objects.get()
+        self.assertEqual((unit.state, unit.worker, unit.attempts),
+            (WorkUnit.CLAIMED, 'a', 1))
+
+    def test_the_losing_claimer_takes_the_next_unit(self):
+        self.add_units('DEPT0', 'DEPT1')
+        claims = self.race()
+        self.assertEqual((claims['a'].dept, claims['b'].dept),
+            ('DEPT0', 'DEPT1'))
+        self.assertEqual(dict(WorkUnit.objects.values_list('dept', 'worker')),
+            {'DEPT0': 'a', 'DEPT1': 'b'})
+
+    def test_stale_units_are_released_and_reclaimed(self):
+        self.add_units('DEPT0', 'DEPT1')
+        shard.claim_unit(self.run, 'a')
+        self.age_claims(61)
+        shard.claim_unit(self.run, 'b')
+        shard.release_stale(self.run)
+        self.assertEqual(dict(WorkUnit.objects.values_list('dept', 'state')),
+            {'DEPT0': WorkUnit.PENDING, 'DEPT1': WorkUnit.CLAIMED})
+        unit = shard.claim_unit(self.run, 'c')
+        self.assertEqual((unit.dept, unit.worker, unit.attempts),
+            ('DEPT0', 'c', 2))
+
+    def test_failed_units_are_not_claimed_again(self):
+        self.add_units('DEPT0')
+        unit = shard.claim_unit(self.run, 'a')
+        shard.fail_unit(unit, IOError('No course list for DEPT0'))
+        self.age_claims(61)
+        shard.release_stale(self.run)
+        self.assertIsNone(shard.claim_unit(self.run, 'b'))
+        unit = WorkUnit.objects.get()
+        self.assertEqual((unit.state, unit.error),
+            (WorkUnit.FAILED, 'IOError - No course list for DEPT0'))
+        self.assertEqual(shard.unit_counts(self.run), {WorkUnit.FAILED: 1})
+
+    # A unit whose workers keep dying is given up on after
+    # SCRAPER_CLAIM_ATTEMPTS claims
+    def test_units_that_keep_going_stale_fail(self):
+        self.add_units('DEPT0')
+        for i in range(3):
+            self.assertIsNotNone(shard.claim_unit(self.run, str(i)))
+            self.age_claims(61)
+            shard.release_stale(self.run)
+        self.assertIsNone(shard.claim_unit(self.run, 'a'))
+        unit = WorkUnit.objects.get()
+        self.assertEqual((unit.state, unit.attempts), (WorkUnit.FAILED, 3))
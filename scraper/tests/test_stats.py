@@ -0,0 +1,42 @@
+from scraper import fixtures, stats
+from scraper.models import *
+from scraper.writer import CourseWriter
+
+from base import ScraperTransactionTestCase
+
+class RefreshStatsTest(ScraperTransactionTestCase):
+    def setUp(self):
+        ScraperTransactionTestCase.setUp(self)
+        writer = CourseWriter()
+        for course in fixtures.course_dicts(20):
+            writer.add(course)
+        writer.flush()
+
+    def counts(self):
+        return [model.objects.count() for model in
+            [CourseStats, InstructorStats, FieldStats, StatsRefresh]]
+
+    def test_full_refresh_covers_every_term(self):
+        yearterms = stats.refresh_stats(full=True)
+        self.assertEqual(sorted(yearterms), sorted(set(
+            CourseInstance.objects.values_list('year', 'term'))))
+        self.assertEqual(CourseStats.objects.values('course', 'year',
+            'term').distinct().count(), CourseInstance.objects.count())
+
+    # The old stats stay put until the new ones are all there
+    def test_failed_full_refresh_keeps_the_old_stats(self):
+        stats.refresh_stats(full=True)
+        before = self.counts()
+        rebuild_term = stats.rebuild_term
+        calls = []
+        def failing(year, term):
+            calls.append((year, term))
+            if len(calls) == 3:
+                raise RuntimeError('database went away')
+            rebuild_term(year, term)
+        stats.rebuild_term = failing
+        try:
+            self.assertRaises(RuntimeError, stats.refresh_stats, True)
+        finally:
+            stats.rebuild_term = rebuild_term
+        self.assertEqual(self.counts(), before)
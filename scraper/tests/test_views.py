@@ -0,0 +1,84 @@
+import json
+
+from django.core.cache import cache
+
+from scraper import bench, fixtures, scrape
+from scraper.models import *
+from scraper.writer import CourseWriter
+
+from base import ScraperTestCase
+
+class APITest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.patch_settings(SCRAPER_REFRESH_STATS=False)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.save_courses(fixtures.course_dicts(3))
+
+    def save_courses(self, courses):
+        writer = CourseWriter()
+        for course in courses:
+            writer.add(course)
+        writer.flush()
+
+    def get(self, path, **headers):
+        return self.client.get('/api/' + path, **headers)
+
+    def test_repeat_requests_get_a_304(self):
+        response = self.get('courses/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['count'], 3)
+        etag = response['ETag']
+
+        response = self.get('courses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, '')
+
+        response = self.get('courses/', HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_each_url_has_its_own_etag(self):
+        self.assertNotEqual(self.get('courses/')['ETag'],
+            self.get('courses/?per_page=1')['ETag'])
+
+    # Responses come from the cache until a run finishes
+    def test_finish_run_invalidates_the_cache(self):
+        before = self.get('courses/')
+        self.save_courses(fixtures.course_dicts(2, first_id=100))
+        cached = self.get('courses/')
+        self.assertEqual(cached.content, before.content)
+        self.assertEqual(cached['ETag'], before['ETag'])
+
+        scrape.finish_run(ScrapeRun.objects.create())
+        after = self.get('courses/')
+        self.assertEqual(json.loads(after.content)['count'], 5)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        response = self.get('courses/', HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    # A benchmark's run finishes in a cache of its own
+    def test_benchmark_runs_leave_the_cache_alone(self):
+        before = self.get('courses/')
+        self.save_courses(fixtures.course_dicts(2, first_id=100))
+        with bench.scratch_cache():
+            scrape.finish_run(ScrapeRun.objects.create())
+        after = self.get('courses/')
+        self.assertEqual(after.content, before.content)
+        self.assertEqual(after['ETag'], before['ETag'])
+
+    def test_errors_are_json_and_not_cached(self):
+        response = self.get('courses/?page=99')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content),
+            {'error': 'No such page'})
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(self.get('instances/?year=x').status_code, 400)
+
+    def test_search_without_an_index_is_unavailable(self):
+        response = self.get('comments/search/?q=great')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.content),
+            {'error': 'Comment search is turned off'})
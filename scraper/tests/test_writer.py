@@ -0,0 +1,94 @@
+from scraper import fixtures
+from scraper.models import *
+from scraper.writer import CourseWriter
+
+from base import ScraperTestCase
+
+# Every table a CourseWriter writes to
+MODELS = [Field, Course, CourseInstance, Instructor,
+    InstructorCourseInstanceRelation, Comment, Reason, CourseRating,
+    InstructorRating, RatingCategory, ScrapedCourse]
+
+class CourseWriterTest(ScraperTestCase):
+    def setUp(self):
+        ScraperTestCase.setUp(self)
+        self.courses = fixtures.course_dicts(5, comments=4)
+
+    def write(self, courses, batch_size=2):
+        writer = CourseWriter(batch_size)
+        for course in courses:
+            writer.add(course)
+        writer.flush()
+
+    def counts(self):
+        return dict((model.__name__, model.objects.count())
+            for model in MODELS)
+
+    def test_saves_courses(self):
+        self.write(self.courses)
+        self.assertEqual(CourseInstance.objects.count(), len(self.courses))
+        for course in self.courses:
+            cinst = CourseInstance.objects.get(qcourse_id=course['id'])
+            self.assertEqual(cinst.course.title, course['title'])
+            self.assertEqual(cinst.enrollment, course['enrollment'])
+            self.assertEqual(sorted(c.comment for c in cinst.comments),
+                sorted(course['comments']))
+            self.assertEqual(cinst.ratings.count(), len(course['ratings']))
+            self.assertEqual(cinst.reasons.count(), len(course['reasons']))
+
+    # Saving the same courses again, in other batches and with a new writer
+    # (so nothing comes from its caches), mustn't add any rows
+    def test_saving_twice_adds_no_rows(self):
+        self.write(self.courses)
+        before = self.counts()
+        self.write(self.courses, batch_size=3)
+        self.assertEqual(self.counts(), before)
+
+    def test_saving_again_replaces_what_hangs_off_a_course(self):
+        self.write(self.courses)
+        course = dict(self.courses[0],
+            title='Renamed',
+            enrollment=999,
+            comments=['Only this one'],
+            ratings=self.courses[0]['ratings'][:2],
+            reasons={'Elective': 7})
+        course['ratings'][0] = dict(course['ratings'][0], value=1.5,
+            num_responses=3)
+        self.write([course])
+
+        cinst = CourseInstance.objects.get(qcourse_id=course['id'])
+        self.assertEqual(cinst.course.title, 'Renamed')
+        self.assertEqual(cinst.enrollment, 999)
+        self.assertEqual([c.comment for c in cinst.comments],
+            ['Only this one'])
+        self.assertEqual(sorted((r.category.name, float(r.value),
+            r.num_responses) for r in cinst.ratings.all()),
+            sorted((r['category'], r['value'], r['num_responses'])
+                for r in course['ratings']))
+        self.assertEqual([(r.reason, r.number) for r in cinst.reasons],
+            [('Elective', 7)])
+        # The other courses are untouched
+        for other in self.courses[1:]:
+            cinst = CourseInstance.objects.get(qcourse_id=other['id'])
+            self.assertEqual(cinst.comments.count(), len(other['comments']))
+
+    def test_instructors_dropped_from_a_course_lose_their_relation(self):
+        course = dict(self.courses[0], profs=[
+            {'prof_id': 'A1', 'first': 'Ann', 'last': 'Adams', 'ratings': []},
+            {'prof_id': 'B2', 'first': 'Ben', 'last': 'Baker', 'ratings': []},
+        ])
+        self.write([course])
+        self.write([dict(course, profs=course['profs'][1:])])
+        cinst = CourseInstance.objects.get(qcourse_id=course['id'])
+        self.assertEqual([r.instructor.prof_id for r in
+            InstructorCourseInstanceRelation.objects.filter(
+            course_instance=cinst)], ['B2'])
+        # The instructor is kept for their other courses
+        self.assertEqual(Instructor.objects.filter(prof_id='A1').count(), 1)
+
+    def test_no_data_courses_only_save_a_fingerprint(self):
+        course = {'id': 42, 'no_data': True, 'fingerprint': 'f' * 40}
+        self.write([course])
+        self.assertEqual(CourseInstance.objects.count(), 0)
+        self.assertEqual(ScrapedCourse.objects.get(qcourse_id=42).fingerprint,
+            'f' * 40)
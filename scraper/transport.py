@@ -0,0 +1,208 @@
+################################################################################
+# Transports: how get_data_from_path actually gets a page.  Each has a         #
+# get(path, etag, last_modified) method returning (status, contents, etag,     #
+# last_modified) for a path relative to the base URL and raising               #
+# TransportError (an IOError, so the Fetcher retries it) when the server says  #
+# no.  Given the validators of a stored copy, it asks for the page only if     #
+# it changed, and returns status 304 and no contents if it didn't.             #
+#                                                                              #
+#   HTTPSTransport   - pooled keep-alive connections, gzip responses          #
+#   UrllibTransport  - a urllib2 opener, one connection per request           #
+#   FixtureTransport - pages from a local directory or page store, for        #
+#                      running and benchmarking the scraper offline           #
+################################################################################
+
+from email.utils import formatdate
+import hashlib
+import httplib
+import os
+import Queue
+import time
+import urllib2
+import urlparse
+import zlib
+
+from pagestore import PageStore
+
+MAX_REDIRECTS = 5
+
+class TransportError(IOError):
+    pass
+
+class HTTPSTransport(object):
+    # base_url - URL paths are relative to
+    # cookie - JSESSIONID sent to the base URL's host
+    # pool_size - most idle connections kept open per host
+    # timeout - seconds to wait on a connection
+    def __init__(self, base_url, cookie, pool_size=4, timeout=60):
+        self.base_url = base_url
+        self.host = urlparse.urlsplit(base_url).netloc
+        self.cookie = cookie
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pools = {}
+
+    def get(self, path, etag=None, last_modified=None):
+        url = self.base_url + path
+        for i in range(MAX_REDIRECTS):
+            status, response, contents = self._request(url,
+                conditional_headers(etag, last_modified))
+            location = response.getheader('location')
+            if status in (301, 302, 303, 307) and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            if status >= 400:
+                raise TransportError('HTTP {0} for {1}'.format(status, url))
+            if status == 304:
+                contents = None
+            return status, contents, response.getheader('etag'), \
+                response.getheader('last-modified')
+        raise TransportError('Too many redirects for {0}'.format(url))
+
+    def _request(self, url, extra_headers={}):
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        request_path = parts.path or '/'
+        if parts.query:
+            request_path = request_path + '?' + parts.query
+        headers = {
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+        }
+        headers.update(extra_headers)
+        if parts.netloc == self.host:
+            headers['Cookie'] = 'JSESSIONID=' + self.cookie
+
+        conn, reused = self._checkout(key)
+        try:
+            conn.request('GET', request_path, headers=headers)
+            response = conn.getresponse()
+            contents = response.read()
+        except (httplib.HTTPException, IOError):
+            conn.close()
+            if not reused:
+                raise
+            # The server may have closed an idle connection; try a fresh one
+            conn, reused = self._connect(key), False
+            try:
+                conn.request('GET', request_path, headers=headers)
+                response = conn.getresponse()
+                contents = response.read()
+            except:
+                conn.close()
+                raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+        if response.getheader('content-encoding') == 'gzip':
+            contents = zlib.decompress(contents, 16 + zlib.MAX_WBITS)
+        return response.status, response, contents
+
+    def _pool(self, key):
+        # setdefault is atomic, so threads can't end up with different pools
+        return self.pools.setdefault(key, Queue.LifoQueue(self.pool_size))
+
+    # Returns (connection, whether it was used before)
+    def _checkout(self, key):
+        try:
+            return self._pool(key).get_nowait(), True
+        except Queue.Empty:
+            return self._connect(key), False
+
+    def _checkin(self, key, conn):
+        try:
+            self._pool(key).put_nowait(conn)
+        except Queue.Full:
+            conn.close()
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+class UrllibTransport(object):
+    def __init__(self, base_url, cookie):
+        self.base_url = base_url
+        self.opener = urllib2.build_opener()
+        self.opener.addheaders.append(('Cookie', 'JSESSIONID=' + cookie))
+
+    def get(self, path, etag=None, last_modified=None):
+        request = urllib2.Request(self.base_url + path,
+            headers=conditional_headers(etag, last_modified))
+        try:
+            response = self.opener.open(request)
+        except urllib2.HTTPError as e:
+            # urllib2 counts a 304 as an error
+            if e.code != 304:
+                raise
+            return 304, None, e.info().getheader('etag'), \
+                e.info().getheader('last-modified')
+        return response.getcode(), response.read(), \
+            response.info().getheader('etag'), \
+            response.info().getheader('last-modified')
+
+# Fixture pages get an ETag made from their contents, and a Last-Modified
+# from their file's modification time if they come from a directory, like a
+# server would send
+class FixtureTransport(object):
+    # source - directory of pages saved one file per path, or a page store
+    #     file from an earlier run
+    # latency - seconds each request pretends to take
+    def __init__(self, source, latency=0):
+        self.latency = latency
+        if os.path.isdir(source):
+            self.directory = source
+            self.store = None
+        else:
+            self.directory = None
+            self.store = PageStore(source)
+
+    def get(self, path, etag=None, last_modified=None):
+        if self.latency:
+            time.sleep(self.latency)
+        modified = None
+        if self.store is not None:
+            contents = self.store.get(path)
+        else:
+            filename = os.path.join(self.directory, path)
+            try:
+                with open(filename) as f:
+                    contents = f.read()
+                modified = http_date(os.path.getmtime(filename))
+            except (IOError, OSError):
+                contents = None
+        if contents is None:
+            raise TransportError('HTTP 404 for fixture {0}'.format(path))
+        page_etag = content_etag(contents)
+        if not_modified(page_etag, modified, etag, last_modified):
+            return 304, None, page_etag, modified
+        return 200, contents, page_etag, modified
+
+# Headers asking for a page only if it doesn't match a stored copy's
+# validators
+def conditional_headers(etag, last_modified):
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+# Whether a server with a page's etag and last_modified would answer 304 to
+# the conditional headers if_none_match and if_modified_since.  If-None-Match
+# wins when both are sent.
+def not_modified(etag, last_modified, if_none_match, if_modified_since):
+    if if_none_match is not None:
+        return etag is not None and etag in [x.strip()
+            for x in if_none_match.split(',')]
+    return if_modified_since is not None and \
+        last_modified == if_modified_since
+
+def content_etag(contents):
+    return '"{0}"'.format(hashlib.sha1(contents).hexdigest())
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
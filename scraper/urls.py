@@ -0,0 +1,12 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns('scraper.views',
+    url(r'^courses/$', 'courses'),
+    url(r'^courses/(?P<course_id>\d+)/$', 'course'),
+    url(r'^instances/$', 'instances'),
+    url(r'^instances/(?P<instance_id>\d+)/$', 'instance'),
+    url(r'^instances/(?P<instance_id>\d+)/comments/$', 'instance_comments'),
+    url(r'^instructors/$', 'instructors'),
+    url(r'^instructors/(?P<instructor_id>\d+)/$', 'instructor'),
+    url(r'^comments/search/$', 'search_comments'),
+)
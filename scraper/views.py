@@ -1 +1,248 @@
-# Create your views here.
+################################################################################
+# Read-only JSON API over the scraped data (see urls.py).  Every response is  #
+# cached under the current data generation, the last run that finished, and   #
+# carries an ETag, so repeat requests are answered from the cache or with a   #
+# 304 without touching the database.  finish_run starts a new generation,     #
+# which retires everything cached before it.                                  #
+################################################################################
+
+import hashlib
+import json
+from functools import wraps
+
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Paginator
+from django.http import HttpResponse, HttpResponseNotModified
+from django.views.decorators.http import require_GET
+
+from models import *
+from qscraper import settings
+import search
+
+GENERATION_KEY = 'scraper.api.generation'
+
+# Raised by views for a response other than 200; caught by api_view
+class APIError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+# Makes a view returning a JSON-able object into a cached, ETagged GET view
+def api_view(view):
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = 'scraper.api.{0}.{1}'.format(get_generation(),
+            hashlib.sha1(request.get_full_path()).hexdigest())
+        cached = cache.get(key)
+        if cached is None:
+            try:
+                body = json.dumps(view(request, *args, **kwargs),
+                    sort_keys=True)
+            except APIError as e:
+                return json_response(json.dumps({'error': str(e)}), e.status)
+            cached = ('"{0}"'.format(hashlib.sha1(body).hexdigest()), body)
+            cache.set(key, cached, settings.SCRAPER_API_CACHE_TIMEOUT)
+        etag, body = cached
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = json_response(body)
+        response['ETag'] = etag
+        return response
+    return wrapper
+
+def json_response(body, status=200):
+    return HttpResponse(body, content_type='application/json', status=status)
+
+# The data generation: the id of the last finished run, looked up when the
+# cache doesn't have it
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        runs = ScrapeRun.objects.filter(finished__isnull=False)\
+            .order_by('-finished').values_list('pk', flat=True)[:1]
+        generation = runs[0] if runs else 0
+        cache.add(GENERATION_KEY, generation,
+            settings.SCRAPER_API_CACHE_TIMEOUT)
+    return generation
+
+# Starts a new generation once run has finished.  Only reaches a web server
+# sharing the scraper's cache (memcached, say); one with its own cache picks
+# it up when its generation key times out.
+def invalidate_api_cache(run):
+    cache.set(GENERATION_KEY, run.pk, settings.SCRAPER_API_CACHE_TIMEOUT)
+
+def int_param(request, name, default=None):
+    value = request.GET.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIError(400, '{0} must be a whole number'.format(name))
+
+# Returns one page of queryset, turned into dicts by to_dict, with the
+# total count and number of pages
+def paginate(request, queryset, to_dict):
+    per_page = min(int_param(request, 'per_page',
+        settings.SCRAPER_API_PAGE_SIZE), settings.SCRAPER_API_MAX_PAGE_SIZE)
+    if per_page < 1:
+        raise APIError(400, 'per_page must be at least 1')
+    paginator = Paginator(queryset, per_page)
+    try:
+        page = paginator.page(int_param(request, 'page', 1))
+    except EmptyPage:
+        raise APIError(404, 'No such page')
+    return {
+        'count':   paginator.count,
+        'page':    page.number,
+        'pages':   paginator.num_pages,
+        'results': [to_dict(x) for x in page.object_list],
+    }
+
+def get_or_404(queryset, pk):
+    try:
+        return queryset.get(pk=pk)
+    except queryset.model.DoesNotExist:
+        raise APIError(404, 'No such {0}'.format(
+            queryset.model._meta.verbose_name))
+
+def course_dict(course):
+    return {
+        'id':     course.pk,
+        'field':  course.field.abbreviation,
+        'number': course.number,
+        'title':  course.title,
+    }
+
+def instance_dict(cinst):
+    return {
+        'id':            cinst.pk,
+        'qcourse_id':    cinst.qcourse_id,
+        'course':        course_dict(cinst.course),
+        'year':          cinst.year,
+        'term':          cinst.term,
+        'enrollment':    cinst.enrollment,
+        'evaluations':   cinst.evaluations,
+        'response_rate': decimal_value(cinst.response_rate),
+    }
+
+def instructor_dict(instructor):
+    return {
+        'id':      instructor.pk,
+        'prof_id': instructor.prof_id,
+        'first':   instructor.first,
+        'last':    instructor.last,
+    }
+
+def rating_dict(rating):
+    return {
+        'category':      rating.category.name,
+        'value':         decimal_value(rating.value),
+        'num_responses': rating.num_responses,
+        'histogram':     [rating.ones, rating.twos, rating.threes,
+                          rating.fours, rating.fives],
+    }
+
+def decimal_value(value):
+    return None if value is None else float(value)
+
+# GET parameters: field (abbreviation), page, per_page
+@api_view
+def courses(request):
+    queryset = Course.objects.select_related('field')\
+        .order_by('field__abbreviation', 'number')
+    if request.GET.get('field'):
+        queryset = queryset.filter(field__abbreviation=request.GET['field'])
+    return paginate(request, queryset, course_dict)
+
+@api_view
+def course(request, course_id):
+    c = get_or_404(Course.objects.select_related('field'), course_id)
+    result = course_dict(c)
+    result['instances'] = [instance_dict(cinst)
+        for cinst in CourseInstance.objects.filter(course=c)\
+        .select_related('course__field').order_by('-year', '-term')]
+    return result
+
+# GET parameters: year, term, field, course (id), page, per_page
+@api_view
+def instances(request):
+    queryset = CourseInstance.objects.select_related('course__field')\
+        .order_by('-year', '-term', 'pk')
+    for name in ['year', 'term', 'course']:
+        value = int_param(request, name)
+        if value is not None:
+            queryset = queryset.filter(**{name: value})
+    if request.GET.get('field'):
+        queryset = queryset.filter(
+            course__field__abbreviation=request.GET['field'])
+    return paginate(request, queryset, instance_dict)
+
+# An instance with its ratings, reasons and instructors with their ratings
+@api_view
+def instance(request, instance_id):
+    cinst = get_or_404(CourseInstance.objects.select_related('course__field')\
+        .prefetch_related('ratings__category', 'reason_set',
+            'instructorcourseinstancerelation_set__instructor',
+            'instructorcourseinstancerelation_set__ratings__category'),
+        instance_id)
+    result = instance_dict(cinst)
+    result['ratings'] = [rating_dict(r) for r in cinst.ratings.all()]
+    result['reasons'] = dict((r.reason, r.number)
+        for r in cinst.reason_set.all())
+    result['instructors'] = [dict(instructor_dict(irel.instructor),
+        ratings=[rating_dict(r) for r in irel.ratings.all()])
+        for irel in cinst.instructorcourseinstancerelation_set.all()]
+    return result
+
+# GET parameters: page, per_page
+@api_view
+def instance_comments(request, instance_id):
+    get_or_404(CourseInstance.objects.all(), instance_id)
+    return paginate(request,
+        Comment.objects.filter(course=instance_id).order_by('pk'),
+        lambda c: {'id': c.pk, 'comment': c.comment})
+
+# GET parameters: last (start of the last name), page, per_page
+@api_view
+def instructors(request):
+    queryset = Instructor.objects.order_by('last', 'first', 'pk')
+    if request.GET.get('last'):
+        queryset = queryset.filter(last__istartswith=request.GET['last'])
+    return paginate(request, queryset, instructor_dict)
+
+# An instructor with every course instance they taught and their ratings in it
+@api_view
+def instructor(request, instructor_id):
+    i = get_or_404(Instructor.objects.all(), instructor_id)
+    result = instructor_dict(i)
+    result['instances'] = [dict(instance_dict(irel.course_instance),
+        ratings=[rating_dict(r) for r in irel.ratings.all()])
+        for irel in InstructorCourseInstanceRelation.objects.filter(
+            instructor=i).select_related('course_instance__course__field')\
+            .prefetch_related('ratings__category')\
+            .order_by('-course_instance__year', '-course_instance__term')]
+    return result
+
+# GET parameters: q (see CommentIndex.search), field, year, term, page,
+# per_page
+@api_view
+def search_comments(request):
+    if not request.GET.get('q'):
+        raise APIError(400, 'q is required')
+    per_page = min(int_param(request, 'per_page',
+        settings.SCRAPER_API_PAGE_SIZE), settings.SCRAPER_API_MAX_PAGE_SIZE)
+    page = int_param(request, 'page', 1)
+    if per_page < 1 or page < 1:
+        raise APIError(400, 'page and per_page must be at least 1')
+    if settings.SEARCH_INDEX is None:
+        raise APIError(503, 'Comment search is turned off')
+    try:
+        results = search.search_comments(request.GET['q'],
+            request.GET.get('field') or None, int_param(request, 'year'),
+            int_param(request, 'term'), per_page, (page - 1) * per_page)
+    except ValueError as e:
+        raise APIError(400, str(e))
+    return {'page': page, 'results': results}
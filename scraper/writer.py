@@ -0,0 +1,349 @@
+################################################################################
+# Batched persistence for scraped courses.  A CourseWriter collects course     #
+# dicts and saves them a batch at a time with bulk_create, inside a single    #
+# transaction per batch, instead of a query or two per row.                   #
+################################################################################
+
+from django.db import transaction
+
+from metrics import RUN_METRICS
+from models import *
+from qscraper import settings
+from search import index_course_instances
+
+# Reasons as the Q guide has named them over the years -> Reason.reason
+REASONS = {
+    'Elective':
+        'Elective',
+    'Concentration or Department Requirement':
+        'Concentration or Department Requirement',
+    'Secondary Field or Language Citation Requirement':
+        'Secondary Field or Language Citation Requirement',
+    'Undergraduate Core or General Education Requirement':
+        'Undergraduate Core or General Education Requirement',
+    'Expository Writing Requirement':
+        'Expository Writing Requirement',
+    'Foreign Language Requirement':
+        'Foreign Language Requirement',
+    'Pre-Med Requirement':
+        'Pre-Med Requirement',
+    'Undergraduate Core Requirement':
+        'Undergraduate Core or General Education Requirement',
+    'Concentration/Program Requirement':
+        'Concentration or Department Requirement'
+}
+
+# Rows per INSERT statement
+INSERT_BATCH = 500
+
+RATING_FIELDS = ['value', 'num_responses', 'ones', 'twos', 'threes', 'fours',
+    'fives']
+
+class CourseWriter(object):
+    # batch_size - courses to collect before saving them automatically
+    # run - ScrapeRun recorded with every saved course, in the same
+    #     transaction, so an interrupted run can be resumed
+    # lock - lock run's row while saving, for when other processes are saving
+    #     into the same database (see shard.py).  Otherwise two of them could
+    #     both find a Field, Course or Instructor missing and create it twice.
+    def __init__(self, batch_size=settings.SCRAPER_BATCH_SIZE, run=None,
+            lock=False):
+        self.batch_size = batch_size
+        self.run = run
+        self.lock = lock
+        self.courses = []
+        # Ids already looked up or created, so each is only queried once a run
+        self.field_ids = {}       # abbreviation -> Field id
+        self.course_ids = {}      # (field id, number) -> (Course id, title)
+        self.instructor_ids = {}  # prof_id -> Instructor id
+        self.category_ids = {}    # category name -> RatingCategory id
+
+    # Queues a course dict from scrape_course_data, saving the batch if it's
+    # full.  Returns the number of courses saved.
+    def add(self, course):
+        self.courses.append(course)
+        if len(self.courses) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    # Saves every queued course in one transaction.  Courses already in the
+    # database are updated in place and their comments, ratings, reasons and
+    # instructor relations replaced.  Returns the number of courses saved.
+    def flush(self):
+        if not self.courses:
+            return 0
+        courses = self.courses
+        self.courses = []
+        if self.lock:
+            # Rows other processes committed since this connection's last
+            # read could look missing from the snapshot it's still in
+            transaction.commit_unless_managed()
+        with RUN_METRICS.timer('persist.batch'):
+            with transaction.commit_on_success():
+                if self.lock:
+                    list(ScrapeRun.objects.select_for_update()\
+                        .filter(pk=self.run.pk))
+                cinst_ids = self._save(courses)
+        # The search index isn't part of the transaction, so it's only told
+        # about what was committed
+        with RUN_METRICS.timer('persist.index'):
+            index_course_instances(cinst_ids.values())
+        return len(cinst_ids)
+
+    # Returns a dict of Q guide course id -> CourseInstance id of the courses
+    # saved.  Each step is timed as persist.<step> in RUN_METRICS.
+    def _save(self, courses):
+        with RUN_METRICS.timer('persist.fingerprints'):
+            self._save_fingerprints(courses)
+        courses = [c for c in courses if not c.get('no_data')]
+        if not courses:
+            return {}
+
+        with RUN_METRICS.timer('persist.lookups'):
+            self._resolve_fields(courses)
+            self._resolve_courses(courses)
+            self._resolve_categories(courses)
+        with RUN_METRICS.timer('persist.course_instances'):
+            cinst_ids = self._save_course_instances(courses)
+
+        comments = []
+        reasons = []
+        ratings = []
+        for course in courses:
+            cinst_id = cinst_ids[course['id']]
+            for comment in course['comments']:
+                comments.append(Comment(course_id=cinst_id, comment=comment))
+            # Two of the Q guide's names can map to the same reason; the
+            # first wins
+            saved = set()
+            for r in course['reasons'].keys():
+                if REASONS[r] not in saved:
+                    saved.add(REASONS[r])
+                    reasons.append(Reason(course_id=cinst_id,
+                        reason=REASONS[r], number=course['reasons'][r]))
+            for category_id, values in self._ratings(course['ratings']):
+                ratings.append(CourseRating(course_instance_id=cinst_id,
+                    category_id=category_id, **values))
+        with RUN_METRICS.timer('persist.rows'):
+            Comment.objects.bulk_create(comments, INSERT_BATCH)
+            Reason.objects.bulk_create(reasons, INSERT_BATCH)
+            CourseRating.objects.bulk_create(ratings, INSERT_BATCH)
+
+        with RUN_METRICS.timer('persist.instructors'):
+            InstructorRating.objects.bulk_create(
+                self._save_profs(courses, cinst_ids), INSERT_BATCH)
+        return cinst_ids
+
+    # Remembers which summary page each course was saved from, for
+    # incremental scrapes, and which run saved it, for resuming
+    def _save_fingerprints(self, courses):
+        fingerprints = dict((c['id'], c['fingerprint'])
+            for c in courses if 'fingerprint' in c)
+        existing = dict(ScrapedCourse.objects.filter(
+            qcourse_id__in=fingerprints.keys())\
+            .values_list('qcourse_id', 'fingerprint'))
+        for qcourse_id, fingerprint in existing.items():
+            if fingerprints[qcourse_id] != fingerprint:
+                ScrapedCourse.objects.filter(qcourse_id=qcourse_id)\
+                    .update(fingerprint=fingerprints[qcourse_id])
+        if self.run is not None and existing:
+            ScrapedCourse.objects.filter(qcourse_id__in=existing.keys())\
+                .update(run=self.run)
+        ScrapedCourse.objects.bulk_create([
+            ScrapedCourse(qcourse_id=qcourse_id, fingerprint=fingerprint,
+                run=self.run)
+            for qcourse_id, fingerprint in fingerprints.items()
+            if qcourse_id not in existing], INSERT_BATCH)
+
+    def _resolve_fields(self, courses):
+        missing = set(c['field'] for c in courses) - set(self.field_ids)
+        if not missing:
+            return
+        self.field_ids.update(Field.objects.filter(abbreviation__in=missing)\
+            .values_list('abbreviation', 'id'))
+        new = missing - set(self.field_ids)
+        if new:
+            Field.objects.bulk_create([Field(abbreviation=abbreviation,
+                name='') for abbreviation in new], INSERT_BATCH)
+            self.field_ids.update(Field.objects.filter(abbreviation__in=new)\
+                .values_list('abbreviation', 'id'))
+
+    def _resolve_courses(self, courses):
+        titles = {}
+        for c in courses:
+            titles[(self.field_ids[c['field']], c['number'])] = c['title']
+        missing = set(titles) - set(self.course_ids)
+        if missing:
+            self._load_courses(missing)
+            new = missing - set(self.course_ids)
+            Course.objects.bulk_create([Course(field_id=field_id,
+                number=number, title=titles[(field_id, number)])
+                for field_id, number in new], INSERT_BATCH)
+            self._load_courses(new)
+        # Titles get edited now and then
+        for key, title in titles.items():
+            course_id, old_title = self.course_ids[key]
+            if title != old_title:
+                Course.objects.filter(pk=course_id).update(title=title)
+                self.course_ids[key] = (course_id, title)
+
+    def _load_courses(self, keys):
+        if not keys:
+            return
+        rows = Course.objects.filter(
+            field__in=set(field_id for field_id, number in keys),
+            number__in=set(number for field_id, number in keys))\
+            .values_list('field', 'number', 'id', 'title')
+        for field_id, number, course_id, title in rows:
+            if (field_id, number) in keys:
+                self.course_ids[(field_id, number)] = (course_id, title)
+
+    # Creates or updates the CourseInstance of every course and clears out
+    # what hangs off the ones that were already saved.  Returns a dict of
+    # Q guide course id -> CourseInstance id.
+    def _save_course_instances(self, courses):
+        qcourse_ids = [c['id'] for c in courses]
+        existing = dict(CourseInstance.objects.filter(
+            qcourse_id__in=qcourse_ids).values_list('qcourse_id', 'id'))
+
+        new = []
+        for c in courses:
+            values = {
+                'course_id':     self.course_ids[
+                    (self.field_ids[c['field']], c['number'])][0],
+                'year':          c['year'],
+                'term':          c['term'],
+                'enrollment':    c['enrollment'],
+                'evaluations':   c['evaluations'],
+                'response_rate': c['response_rate'],
+            }
+            if c['id'] in existing:
+                # update() only knows the foreign key by its field name
+                values['course'] = values.pop('course_id')
+                CourseInstance.objects.filter(pk=existing[c['id']])\
+                    .update(**values)
+            else:
+                new.append(CourseInstance(qcourse_id=c['id'], **values))
+
+        if existing:
+            clear_course_instances(existing.values())
+        CourseInstance.objects.bulk_create(new, INSERT_BATCH)
+        return dict(CourseInstance.objects.filter(qcourse_id__in=qcourse_ids)\
+            .values_list('qcourse_id', 'id'))
+
+    # Saves instructors and their relations to the course instances.  Returns
+    # the unsaved InstructorRatings for the relations.
+    def _save_profs(self, courses, cinst_ids):
+        self._resolve_instructors(courses)
+
+        pairs = []
+        for c in courses:
+            for p in c['profs']:
+                pair = (cinst_ids[c['id']], self.instructor_ids[p['prof_id']])
+                if pair not in pairs:
+                    pairs.append(pair)
+        InstructorCourseInstanceRelation.objects.bulk_create([
+            InstructorCourseInstanceRelation(course_instance_id=cinst_id,
+                instructor_id=instructor_id)
+            for cinst_id, instructor_id in pairs], INSERT_BATCH)
+        irel_ids = {}
+        for cinst_id, instructor_id, irel_id in \
+                InstructorCourseInstanceRelation.objects.filter(
+                course_instance__in=cinst_ids.values())\
+                .values_list('course_instance', 'instructor', 'id'):
+            irel_ids[(cinst_id, instructor_id)] = irel_id
+
+        ratings = []
+        for c in courses:
+            for p in c['profs']:
+                irel_id = irel_ids[(cinst_ids[c['id']],
+                    self.instructor_ids[p['prof_id']])]
+                for category_id, values in self._ratings(p['ratings']):
+                    ratings.append(InstructorRating(
+                        instructor_relation_id=irel_id,
+                        category_id=category_id, **values))
+        return ratings
+
+    # Yields (RatingCategory id, field values) for a list of rating dicts.  A
+    # category can appear twice when a page has more than one table; the
+    # first wins.
+    def _ratings(self, ratings):
+        seen = set()
+        for r in ratings:
+            category_id = self.category_ids[r['category']]
+            if category_id not in seen:
+                seen.add(category_id)
+                yield category_id, dict((name, r[name])
+                    for name in RATING_FIELDS)
+
+    def _resolve_categories(self, courses):
+        names = set()
+        for c in courses:
+            names.update(r['category'] for r in c['ratings'])
+            for p in c['profs']:
+                names.update(r['category'] for r in p['ratings'])
+        resolve_categories(names, self.category_ids)
+
+    def _resolve_instructors(self, courses):
+        profs = {}
+        for c in courses:
+            for p in c['profs']:
+                profs[p['prof_id']] = p
+        missing = set(profs) - set(self.instructor_ids)
+        if not missing:
+            return
+
+        # prof_id isn't unique in the table, so the first match wins
+        rows = list(Instructor.objects.filter(prof_id__in=missing)\
+            .order_by('-pk').values_list('prof_id', 'id', 'first', 'last'))
+        for prof_id, instructor_id, first, last in rows:
+            self.instructor_ids[prof_id] = instructor_id
+        for prof_id, instructor_id, first, last in rows:
+            p = profs[prof_id]
+            if self.instructor_ids[prof_id] == instructor_id and \
+                    (first, last) != (p['first'], p['last']):
+                Instructor.objects.filter(pk=instructor_id)\
+                    .update(first=p['first'], last=p['last'])
+
+        new = missing - set(self.instructor_ids)
+        if new:
+            Instructor.objects.bulk_create([Instructor(prof_id=prof_id,
+                first=profs[prof_id]['first'], last=profs[prof_id]['last'])
+                for prof_id in new], INSERT_BATCH)
+            for prof_id, instructor_id in Instructor.objects.filter(
+                    prof_id__in=new).order_by('-pk')\
+                    .values_list('prof_id', 'id'):
+                self.instructor_ids[prof_id] = instructor_id
+
+# Adds the RatingCategory id of every name in names to category_ids (a dict
+# of name -> id), creating the categories that don't exist yet
+def resolve_categories(names, category_ids):
+    missing = set(names) - set(category_ids)
+    if not missing:
+        return
+    digests = dict((category_digest(name), name) for name in missing)
+    load_categories(digests, category_ids)
+    new = [digest for digest, name in digests.items()
+        if name not in category_ids]
+    if new:
+        RatingCategory.objects.bulk_create([RatingCategory(
+            name=digests[digest], digest=digest) for digest in new],
+            INSERT_BATCH)
+        load_categories(dict((digest, digests[digest]) for digest in new),
+            category_ids)
+
+def load_categories(digests, category_ids):
+    for digest, category_id in RatingCategory.objects.filter(
+            digest__in=digests.keys()).values_list('digest', 'id'):
+        category_ids[digests[digest]] = category_id
+
+# Deletes the comments, reasons, ratings and instructor relations of course
+# instances that are about to be saved again
+def clear_course_instances(cinst_ids):
+    irel_ids = list(InstructorCourseInstanceRelation.objects.filter(
+        course_instance__in=cinst_ids).values_list('id', flat=True))
+    InstructorRating.objects.filter(instructor_relation__in=irel_ids).delete()
+    CourseRating.objects.filter(course_instance__in=cinst_ids).delete()
+    InstructorCourseInstanceRelation.objects.filter(pk__in=irel_ids).delete()
+    Comment.objects.filter(course__in=cinst_ids).delete()
+    Reason.objects.filter(course__in=cinst_ids).delete()